@@ -1,13 +1,29 @@
-from aiogram import Router, types, Bot
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from aiogram import F, Router, types, Bot
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
-from db import get_all_users, get_users_stats
+from broadcast import start_broadcast
+from db import get_top_traffic, get_users_page, get_users_stats
+from profiling import MODES, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, PROFILER, SAMPLE
+from traffic import format_bytes
 
 import time
 
 ADMINS = [124508057]
 
+# Number of users shown on one /userlist page
+USERLIST_PAGE_SIZE = 20
+
+# Number of keys listed by /top
+TOP_TRAFFIC_SIZE = 10
+
+# Reconciliations and drains running in the background, by name
+RUNNING: dict[str, asyncio.Task] = {}
+
 
 def is_admin(user_id: int) -> bool:
     return user_id in ADMINS
@@ -32,45 +48,257 @@ async def cmd_users(message: Message):
     await message.answer(text)
 
 
+def format_user(row, now: int) -> str:
+    user_id, username, is_trial, is_paid, created_at, expires_at = row
+    if expires_at and expires_at < now:
+        status = "\u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d"
+    elif is_paid:
+        status = "\u043f\u043b\u0430\u0442\u043d\u044b\u0439"
+    elif is_trial:
+        status = "\u043f\u0440\u043e\u0431\u043d\u044b\u0439"
+    else:
+        status = "\u043d\u0435\u0430\u043a\u0442\u0438\u0432\u043d\u044b\u0439"
+    created = time.strftime("%Y-%m-%d", time.localtime(created_at)) if created_at else "-"
+    expires = time.strftime("%Y-%m-%d", time.localtime(expires_at)) if expires_at else "-"
+    username = f"@{username}" if username else "-"
+    return (
+        f"\U0001f464 {username} | ID: {user_id}\n"
+        f"\U0001f511 \u0421\u0442\u0430\u0442\u0443\u0441: {status}\n"
+        f"\U0001f4c5 \u0410\u043a\u0442\u0438\u0432\u0430\u0446\u0438\u044f: {created}\n"
+        f"\u23f3 \u0418\u0441\u0442\u0435\u043a\u0430\u0435\u0442: {expires}"
+    )
+
+
+def userlist_keyboard(prev_cursor, next_cursor) -> InlineKeyboardMarkup | None:
+    """Build prev/next buttons carrying ``userlist:<p|n>:<created>:<id>``."""
+    buttons = []
+    if prev_cursor is not None:
+        buttons.append(
+            InlineKeyboardButton(
+                text="\u2b05\ufe0f", callback_data="userlist:p:%d:%d" % prev_cursor
+            )
+        )
+    if next_cursor is not None:
+        buttons.append(
+            InlineKeyboardButton(
+                text="\u27a1\ufe0f", callback_data="userlist:n:%d:%d" % next_cursor
+            )
+        )
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+async def userlist_page(cursor=None, before: bool = False):
+    """Return the text and navigation keyboard of one /userlist page."""
+    rows, prev_cursor, next_cursor = await get_users_page(
+        cursor, limit=USERLIST_PAGE_SIZE, before=before
+    )
+    if not rows:
+        return None, None
+    now = int(time.time())
+    text = "\n\n".join(format_user(row, now) for row in rows)
+    return text, userlist_keyboard(prev_cursor, next_cursor)
+
+
 @router.message(Command("userlist"))
 async def cmd_userlist(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
         return
-    parts = message.text.split(maxsplit=1)
-    page = 1
-    if len(parts) > 1:
+    text, kb = await userlist_page()
+    if text is None:
+        await message.answer("\u041d\u0435\u0442 \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u0435\u0439.")
+    else:
+        await message.answer(text, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("userlist:"))
+async def callback_userlist(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    try:
+        _, direction, created_at, user_id = callback.data.split(":")
+        cursor = (int(created_at), int(user_id))
+    except ValueError:
+        await callback.answer()
+        return
+    text, kb = await userlist_page(cursor, before=direction == "p")
+    if text is not None:
+        await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+
+@router.message(Command("top"))
+async def cmd_top(message: Message):
+    """List the keys with the most transfer over the last 30 days."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    rows = await get_top_traffic(TOP_TRAFFIC_SIZE)
+    if not rows:
+        await message.answer("\u041d\u0435\u0442 \u0434\u0430\u043d\u043d\u044b\u0445 \u043e \u0442\u0440\u0430\u0444\u0438\u043a\u0435.")
+        return
+    lines = []
+    for place, (user_id, username, server, key_id, used) in enumerate(rows, 1):
+        owner = f"@{username}" if username else "-"
+        user = f"ID: {user_id}" if user_id is not None else f"\u043a\u043b\u044e\u0447 {key_id}"
+        lines.append(f"{place}. {owner} | {user} | {format_bytes(used)} | {server}")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    """Send the text after the command to every user: ``/broadcast <text>``."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    args = (message.text or "").split(maxsplit=1)
+    if len(args) < 2 or not args[1].strip():
+        await message.answer("/broadcast <\u0442\u0435\u043a\u0441\u0442>")
+        return
+    broadcast = await start_broadcast(message.bot, message.chat.id, args[1].strip())
+    await message.answer(
+        f"\u0420\u0430\u0441\u0441\u044b\u043b\u043a\u0430 #{broadcast.id} \u0437\u0430\u043f\u0443\u0449\u0435\u043d\u0430."
+    )
+
+
+def run_in_background(
+    name: str, job: Callable[[], Awaitable[str]], bot: Bot, chat_id: int
+) -> bool:
+    """Run ``job()`` and send the text it returns to ``chat_id``.
+
+    Long jobs are not awaited by their handler, so they hold no update slot.
+    Returns ``False`` if a job of the same ``name`` is still running.
+    """
+    if name in RUNNING:
+        return False
+
+    async def run() -> None:
         try:
-            page = max(1, int(parts[1]))
-        except ValueError:
-            page = 1
-    limit = 20
-    offset = (page - 1) * limit
-    rows = await get_all_users(offset=offset, limit=limit)
+            text = await job()
+        except Exception as exc:
+            logging.error("Failed to run %s: %s", name, exc)
+            text = f"\u041e\u0448\u0438\u0431\u043a\u0430 ({name}): {exc}"
+        finally:
+            RUNNING.pop(name, None)
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception as exc:
+            logging.error("Failed to report %s: %s", name, exc)
+
+    RUNNING[name] = asyncio.create_task(run())
+    return True
+
+
+async def reconcile_report(reconciler) -> str:
     lines = []
-    for user_id, username, is_trial, is_paid, created_at, expires_at in rows:
-        if expires_at and expires_at < int(time.time()):
-            status = "\u0437\u0430\u0432\u0435\u0440\u0448\u0451\u043d"
-        elif is_paid:
-            status = "\u043f\u043b\u0430\u0442\u043d\u044b\u0439"
-        elif is_trial:
-            status = "\u043f\u0440\u043e\u0431\u043d\u044b\u0439"
+    for server, summary in (await reconciler.run()).items():
+        if "error" in summary:
+            lines.append(f"{server}: \u043e\u0448\u0438\u0431\u043a\u0430 {summary['error']}")
         else:
-            status = "\u043d\u0435\u0430\u043a\u0442\u0438\u0432\u043d\u044b\u0439"
-        created = time.strftime("%Y-%m-%d", time.localtime(created_at)) if created_at else "-"
-        expires = time.strftime("%Y-%m-%d", time.localtime(expires_at)) if expires_at else "-"
-        username = f"@{username}" if username else "-"
-        block = (
-            f"\U0001f464 {username} | ID: {user_id}\n"
-            f"\U0001f511 \u0421\u0442\u0430\u0442\u0443\u0441: {status}\n"
-            f"\U0001f4c5 \u0410\u043a\u0442\u0438\u0432\u0430\u0446\u0438\u044f: {created}\n"
-            f"\u23f3 \u0418\u0441\u0442\u0435\u043a\u0430\u0435\u0442: {expires}"
+            lines.append(
+                f"{server}: \u043a\u043b\u044e\u0447\u0435\u0439 {summary['server_keys']}, "
+                f"\u0443\u0434\u0430\u043b\u0435\u043d\u043e {summary['deleted']}, "
+                f"\u043e\u0436\u0438\u0434\u0430\u044e\u0442 {summary['pending']}, "
+                f"\u0447\u0443\u0436\u0438\u0445 {summary['foreign']}, "
+                f"\u043d\u0435\u0442 \u043d\u0430 \u0441\u0435\u0440\u0432\u0435\u0440\u0435 {summary['missing']}"
+            )
+    return "\n".join(lines) or "\u041d\u0435\u0442 \u0441\u0435\u0440\u0432\u0435\u0440\u043e\u0432."
+
+
+async def drain_report(drain_server, server: str) -> str:
+    summary = await drain_server(server)
+    return (
+        f"\u0413\u043e\u0442\u043e\u0432\u043e: {server}\n"
+        f"\u041f\u0435\u0440\u0435\u043d\u0435\u0441\u0435\u043d\u043e: {summary['moved']}\n"
+        f"\u041f\u0440\u043e\u043f\u0443\u0449\u0435\u043d\u043e: {summary['skipped']}\n"
+        f"\u041e\u0448\u0438\u0431\u043e\u043a: {summary['failed']}\n"
+        f"\u0423\u0434\u0430\u043b\u0435\u043d\u043e \u0438\u0437 \u043f\u0443\u043b\u0430: {summary['pooled']}"
+    )
+
+
+@router.message(Command("reconcile"))
+async def cmd_reconcile(message: Message, reconciler):
+    """Reconcile server keys with the database and report the result."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    if not run_in_background(
+        "reconcile", lambda: reconcile_report(reconciler), message.bot, message.chat.id
+    ):
+        await message.answer("\u0421\u0432\u0435\u0440\u043a\u0430 \u0443\u0436\u0435 \u0438\u0434\u0451\u0442.")
+        return
+    await message.answer("\u0421\u0432\u0435\u0440\u043a\u0430 \u043a\u043b\u044e\u0447\u0435\u0439...")
+
+
+@router.message(Command("drain"))
+async def cmd_drain(message: Message, outline_servers, drain_server):
+    """Move all keys off a server: ``/drain <server>``."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    servers = outline_servers()
+    args = (message.text or "").split(maxsplit=1)
+    if len(args) < 2 or args[1].strip() not in servers.urls:
+        await servers.measure()
+        lines = [
+            f"{server}: {info['keys']}" + (" (drain)" if info["draining"] else "")
+            for server, info in servers.stats().items()
+        ]
+        await message.answer("/drain <server>\n" + "\n".join(lines))
+        return
+    server = args[1].strip()
+    if len(servers.urls) - len(servers.draining | {server}) < 1:
+        await message.answer("\u041d\u0435\u0442 \u0434\u0440\u0443\u0433\u0438\u0445 \u0441\u0435\u0440\u0432\u0435\u0440\u043e\u0432.")
+        return
+    if not run_in_background(
+        f"drain {server}", lambda: drain_report(drain_server, server), message.bot, message.chat.id
+    ):
+        await message.answer(f"\u041f\u0435\u0440\u0435\u043d\u043e\u0441 \u0441 {server} \u0443\u0436\u0435 \u0438\u0434\u0451\u0442.")
+        return
+    await message.answer(f"\u041f\u0435\u0440\u0435\u043d\u043e\u0441 \u043a\u043b\u044e\u0447\u0435\u0439 \u0441 {server}...")
+
+
+@router.message(Command("profile_start"))
+async def cmd_profile_start(message: Message):
+    """Profile the bot: ``/profile_start [seconds] [sample|cprofile]``."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    args = (message.text or "").split()[1:]
+    try:
+        seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = 0
+    mode = args[1] if len(args) > 1 else SAMPLE
+    if seconds <= 0 or mode not in MODES:
+        await message.answer(
+            f"/profile_start [1-{PROFILE_MAX_SECONDS}] [{'|'.join(MODES)}]"
+        )
+        return
+    if PROFILER.running:
+        await message.answer(
+            "\u041f\u0440\u043e\u0444\u0438\u043b\u0438\u0440\u043e\u0432\u0430\u043d\u0438\u0435 \u0443\u0436\u0435 \u0438\u0434\u0451\u0442. /profile_stop"
+        )
+        return
+    profile = PROFILER.start(message.bot, message.chat.id, seconds, mode)
+    await message.answer(
+        f"\u041f\u0440\u043e\u0444\u0438\u043b\u0438\u0440\u043e\u0432\u0430\u043d\u0438\u0435 ({profile.mode}) \u043d\u0430 {profile.seconds} \u0441."
+    )
+
+
+@router.message(Command("profile_stop"))
+async def cmd_profile_stop(message: Message):
+    """Stop the running profile early and send its result."""
+    if not is_admin(message.from_user.id):
+        await message.answer("\u26d4\ufe0f \u0423 \u0432\u0430\u0441 \u043d\u0435\u0442 \u0434\u043e\u0441\u0442\u0443\u043f\u0430.")
+        return
+    if not await PROFILER.stop(message.bot):
+        await message.answer(
+            "\u041f\u0440\u043e\u0444\u0438\u043b\u0438\u0440\u043e\u0432\u0430\u043d\u0438\u0435 \u043d\u0435 \u0437\u0430\u043f\u0443\u0449\u0435\u043d\u043e."
         )
-        lines.append(block)
-    if not lines:
-        await message.answer("\u041d\u0435\u0442 \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u0435\u0439.")
-    else:
-        await message.answer("\n\n".join(lines))
 
 
 __all__ = ["router"]
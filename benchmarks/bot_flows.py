@@ -0,0 +1,243 @@
+"""End-to-end load test of the bot's user flows.
+
+Feeds synthetic updates for ``--users`` simulated users to the real ``dp``
+dispatcher. Telegram is replaced by a session that answers every API call
+locally, Outline by :class:`FakeOutlineServer`, and the database is a fresh
+SQLite file. The flows run one after another, each with ``--concurrency``
+users at a time, and the throughput and latency percentiles of every flow
+are reported::
+
+    python benchmarks/bot_flows.py --users 2000 --concurrency 50 --json flows.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import EditMessageText, GetMe, SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+import bot as app  # noqa: E402
+import db  # noqa: E402
+from admin import ADMINS, router as admin_router  # noqa: E402
+from metrics import DB  # noqa: E402
+from outline_api.client import close_clients  # noqa: E402
+from outline_api.testing import FakeOutlineServer  # noqa: E402
+from outline_load import percentiles  # noqa: E402
+
+FIRST_USER_ID = 1_000_000
+
+DEVICES = ("android", "ios", "windows", "macos", "androidtv")
+
+
+class FakeTelegramSession(BaseSession):
+    """Session answering Telegram API calls locally after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        if isinstance(method, GetMe):
+            return User(id=1, is_bot=True, first_name="Bot", username="bench_bot")
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+        yield b""
+
+
+_update_ids = itertools.count(1)
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "User", "username": f"u{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> Update:
+    update_id = next(_update_ids)
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": user(user_id),
+                "text": text,
+            },
+        },
+        context={"bot": app.bot},
+    )
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    update_id = next(_update_ids)
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menu",
+                },
+            },
+        },
+        context={"bot": app.bot},
+    )
+
+
+def flows(users: list[int]) -> list[tuple[str, list]]:
+    """Return ``(flow, updates)`` pairs in the order they are run."""
+    admin_id = ADMINS[0]
+    admin_calls = max(1, len(users) // 50)
+    return [
+        (
+            "start",
+            [
+                # Every second user arrives through the previous user's link
+                message_update(u, f"/start ref{u - 1}" if i % 2 else "/start")
+                for i, u in enumerate(users)
+            ],
+        ),
+        ("trial", [callback_update(u, "trial") for u in users]),
+        ("my_keys", [message_update(u, "\U0001f511 Мои активные ключи") for u in users]),
+        (
+            "device",
+            [
+                callback_update(u, f"device_{DEVICES[i % len(DEVICES)]}")
+                for i, u in enumerate(users)
+            ],
+        ),
+        ("admin_users", [message_update(admin_id, "/users") for _ in range(admin_calls)]),
+        ("admin_userlist", [message_update(admin_id, "/userlist") for _ in range(admin_calls)]),
+    ]
+
+
+async def run_flow(updates: list, concurrency: int) -> dict:
+    samples: list[float] = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def feed(update) -> None:
+        nonlocal errors
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await app.dp.feed_update(app.bot, update)
+            except Exception:
+                errors += 1
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_second": len(updates) / elapsed if elapsed else 0.0,
+        "errors": errors,
+        "latency_ms": percentiles(samples),
+    }
+
+
+async def run(args) -> dict:
+    session = FakeTelegramSession(args.telegram_latency)
+    if args.paced:
+        session.middleware(app.OUTBOUND)
+    saved = (app.bot.session, app.OUTLINE_API_URL, db.DB_PATH)
+    fake = FakeOutlineServer(latency=args.outline_latency, seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite")
+        await fake.start()
+        app.bot.session = session
+        app.OUTLINE_API_URL = fake.url
+        if admin_router.parent_router is None:
+            app.dp.include_router(admin_router)
+        try:
+            await db.init_db()
+            users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+            results = {}
+            for flow, updates in flows(users):
+                results[flow] = await run_flow(updates, args.concurrency)
+        finally:
+            await close_clients()
+            await db.close_db()
+            await fake.stop()
+            app.bot.session, app.OUTLINE_API_URL, db.DB_PATH = saved
+    busiest = sorted(DB.children.items(), key=lambda item: -item[1].total)[:10]
+    return {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "paced": args.paced,
+        "outline_latency": args.outline_latency,
+        "telegram_latency": args.telegram_latency,
+        "flows": results,
+        "telegram_calls": session.calls,
+        "outline_requests": fake.requests,
+        "db_seconds": {name: timer.total for name, timer in busiest},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--outline-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument(
+        "--paced", action="store_true", help="send through the Telegram rate limiter"
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    # The bot logs every handled update at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+    for flow, stats in result["flows"].items():
+        latency = stats["latency_ms"]
+        print(
+            f"{flow:<15} {stats['updates']:6} updates {stats['updates_per_second']:8.0f}/s  "
+            f"p50 {latency['p50']:7.1f} ms  p95 {latency['p95']:7.1f} ms  "
+            f"p99 {latency['p99']:7.1f} ms  errors {stats['errors']}"
+        )
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
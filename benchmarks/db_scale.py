@@ -0,0 +1,311 @@
+"""Micro-benchmarks of every ``db.py`` function on a large database.
+
+Fills a SQLite file with ``--users`` users (one million by default) and the
+keys, referrals, notifications and traffic rows such a user base produces,
+then times every public database function, first from a single caller and
+then from ``--concurrency`` concurrent callers, reporting operations per
+second and latency percentiles. ``get_due_notifications`` is the query run
+by each reminder sweep of ``notify_expirations_loop``::
+
+    python benchmarks/db_scale.py --db /tmp/scale.sqlite --json db_scale.json
+
+The populated file is reused by later runs with the same ``--db`` and
+``--users``, so only the first run pays for the fill.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from outline_load import percentiles  # noqa: E402
+
+# Functions that run no data queries
+EXEMPT = {"init_db", "close_db", "flush_writes"}
+
+# Functions scanning many rows by design, timed with --heavy-ops calls
+HEAVY = {
+    "get_due_notifications",
+    "get_scheduled_keys",
+    "refresh_users_stats",
+    "count_keys_by_server",
+    "get_top_traffic",
+    "assign_default_server",
+    "store_traffic",
+}
+
+FIRST_USER_ID = 100_000_000
+SERVERS = ("a.example.com:443", "b.example.com:443")
+DAY = 24 * 60 * 60
+FILL_BATCH = 50_000
+
+
+def generate_users(count: int, now: int, rng: random.Random):
+    """Yield ``(users, vpn_access, referrals, notifications, key_traffic)`` row
+    batches for ``count`` users.
+
+    Users joined evenly over two years. Two in five never took a key; of the
+    rest, one in four holds an active key expiring within 30 days and the
+    others hold a key that expired and was cleared the way ``clear_keys``
+    clears it: no key or expiry in ``vpn_access`` and no flags or expiry in
+    ``users``. Seven in ten keys are trials.
+    """
+    key_id = 0
+    batch: tuple[list, ...] = ([], [], [], [], [])
+    for n in range(count):
+        user_id = FIRST_USER_ID + n
+        created_at = now - rng.randint(0, 730 * DAY)
+        username = f"user{n}" if rng.random() < 0.7 else None
+        expires_at = is_trial = is_paid = None
+        roll = rng.random()
+        if roll >= 0.4:
+            trial = int(rng.random() < 0.7)
+            key_id += 1
+            server = SERVERS[key_id % len(SERVERS)]
+            if roll >= 0.85:
+                is_trial, is_paid = trial, 1 - trial
+                expires_at = now + rng.randint(1, 30 * DAY)
+                batch[1].append(
+                    (user_id, trial, key_id, f"ss://key{key_id}", expires_at, server)
+                )
+                batch[4].append((server, key_id, rng.randint(0, 50 * 2**30), now))
+            else:
+                # Expired and cleared: clear_keys resets the flags as well
+                is_trial, is_paid = 0, 0
+                batch[1].append((user_id, trial, None, None, None, server))
+        batch[0].append((user_id, username, is_trial, is_paid, created_at, expires_at))
+        if n and rng.random() < 0.2:
+            batch[2].append((user_id, FIRST_USER_ID + rng.randrange(n)))
+        if rng.random() < 0.3:
+            batch[3].append((user_id, now - rng.randint(0, 7 * DAY)))
+        if len(batch[0]) >= FILL_BATCH:
+            yield batch
+            batch = ([], [], [], [], [])
+    yield batch
+
+
+def fill(path: str, users: int, now: int, seed: int = 1) -> None:
+    """Insert the generated rows into the schema created by ``init_db``."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        # The counters are seeded with one pass by the next init_db instead
+        # of a trigger update per inserted user
+        conn.execute("DELETE FROM users_stats")
+        for users_rows, keys, referrals, notifications, traffic in generate_users(
+            users, now, rng
+        ):
+            conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", users_rows)
+            conn.executemany(
+                "INSERT INTO vpn_access "
+                "(user_id, is_trial, key_id, access_url, expires_at, server) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                keys,
+            )
+            conn.executemany("INSERT INTO referrals VALUES (?, ?)", referrals)
+            conn.executemany("INSERT INTO notifications VALUES (?, ?)", notifications)
+            conn.executemany(
+                "INSERT INTO key_traffic (server, key_id, bytes, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                traffic,
+            )
+            conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def user_count(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+def calls(users: int, now: int, rng: random.Random) -> dict:
+    """Return a factory of one call's coroutine for every public function."""
+
+    def user() -> int:
+        return FIRST_USER_ID + rng.randrange(users)
+
+    def server() -> str:
+        return rng.choice(SERVERS)
+
+    def key_id() -> int:
+        return rng.randint(1, users)
+
+    async def walk_user_pages():
+        rows, _, cursor = await db.get_users_page(limit=20)
+        await db.get_users_page(cursor, limit=20)
+
+    return {
+        "add_key": lambda: db.add_key(user(), key_id(), "ss://new", now + DAY, True, server()),
+        "clear_key": lambda: db.clear_key(user(), rng.random() < 0.7),
+        "clear_keys": lambda: db.clear_keys([(user(), True) for _ in range(10)]),
+        "get_scheduled_keys": lambda: db.get_scheduled_keys(now + DAY),
+        "get_key_rows": lambda: db.get_key_rows(user()),
+        "get_active_key": lambda: db.get_active_key(user()),
+        "has_used_trial": lambda: db.has_used_trial(user()),
+        "has_vpn_history": lambda: db.has_vpn_history(user()),
+        "record_referral": lambda: db.record_referral(user(), user()),
+        "get_key_info": lambda: db.get_key_info(user()),
+        "update_expiration": lambda: db.update_expiration(user(), False, now + 30 * DAY),
+        "get_last_notification": lambda: db.get_last_notification(user()),
+        "set_last_notification": lambda: db.set_last_notification(user(), now),
+        "set_last_notifications": lambda: db.set_last_notifications(
+            [user() for _ in range(100)], now
+        ),
+        "get_due_notifications": lambda: db.get_due_notifications(now),
+        "add_pool_keys": lambda: db.add_pool_keys([(key_id(), "ss://pool", server())]),
+        "claim_pool_key": lambda: db.claim_pool_key(),
+        "count_pool_keys": lambda: db.count_pool_keys(),
+        "remove_pool_keys": lambda: db.remove_pool_keys("c.example.com:443"),
+        "get_pool_key_ids": lambda: db.get_pool_key_ids(server()),
+        "count_keys_by_server": lambda: db.count_keys_by_server(),
+        "assign_default_server": lambda: db.assign_default_server(SERVERS[0]),
+        "get_server_keys": lambda: db.get_server_keys(server(), key_id(), 100),
+        "move_key": lambda: db.move_key(user(), True, key_id(), key_id(), "ss://moved", server()),
+        "store_traffic": lambda: db.store_traffic(
+            "c.example.com:443", {n: rng.randint(0, 2**30) for n in range(1000)}, now
+        ),
+        "get_key_usage": lambda: db.get_key_usage(user()),
+        "get_top_traffic": lambda: db.get_top_traffic(10),
+        "get_server_traffic": lambda: db.get_server_traffic(),
+        "add_pending_deletion": lambda: db.add_pending_deletion(user(), key_id(), now + 30),
+        "remove_pending_deletions": lambda: db.remove_pending_deletions([(user(), key_id())]),
+        "get_pending_deletions": lambda: db.get_pending_deletions(),
+        "save_user": lambda: db.save_user(user(), "renamed"),
+        "get_all_users": lambda: db.get_all_users(offset=rng.randrange(1000), limit=20),
+        "get_users_page": walk_user_pages,
+        "get_user_ids": lambda: db.get_user_ids(user(), 500),
+        "create_broadcast": lambda: db.create_broadcast(1, "bench"),
+        "update_broadcast": lambda: db.update_broadcast(1, user(), 10, 0),
+        "get_running_broadcasts": lambda: db.get_running_broadcasts(),
+        "refresh_users_stats": lambda: db.refresh_users_stats(now + rng.randint(0, DAY)),
+        "get_users_stats": lambda: db.get_users_stats(),
+    }
+
+
+def public_functions() -> set[str]:
+    return {
+        name
+        for name, func in inspect.getmembers(db, inspect.iscoroutinefunction)
+        if func.__module__ == "db" and not name.startswith("_")
+    } - EXEMPT
+
+
+async def measure(factory, ops: int, concurrency: int) -> dict:
+    samples: list[float] = []
+    remaining = ops
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            await factory()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": ops,
+        "ops_per_second": ops / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(samples),
+    }
+
+
+async def run(args) -> dict:
+    now = int(time.time())
+    path = args.db or os.path.join(tempfile.mkdtemp(), "scale.sqlite")
+    db.DB_PATH = path
+    db.key_cache.enabled = not args.no_cache
+    filled = 0.0
+    if user_count(path) != args.users:
+        if os.path.exists(path):
+            os.remove(path)
+        await db.init_db()
+        await db.close_db()
+        started = time.perf_counter()
+        fill(path, args.users, now)
+        filled = time.perf_counter() - started
+    await db.init_db()
+    try:
+        rng = random.Random(2)
+        factories = calls(args.users, now, rng)
+        missing = public_functions() - set(factories)
+        if missing:
+            raise SystemExit(f"No benchmark call for: {', '.join(sorted(missing))}")
+        selected = [
+            name for name in factories if not args.only or any(p in name for p in args.only)
+        ]
+        results = {}
+        for name in selected:
+            ops = args.heavy_ops if name in HEAVY else args.ops
+            results[name] = {
+                "single": await measure(factories[name], ops, 1),
+                "concurrent": await measure(factories[name], ops, args.concurrency),
+            }
+    finally:
+        await db.close_db()
+    return {
+        "users": args.users,
+        "db": path,
+        "db_bytes": os.path.getsize(path),
+        "fill_seconds": filled,
+        "concurrency": args.concurrency,
+        "pool_size": db.DB_POOL_SIZE,
+        "key_cache": not args.no_cache,
+        "functions": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--db", help="database file, reused when already filled")
+    parser.add_argument("--ops", type=int, default=2000, help="calls per function")
+    parser.add_argument(
+        "--heavy-ops", type=int, default=20, help="calls per function scanning many rows"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--only", nargs="*", help="time functions containing these names")
+    parser.add_argument("--no-cache", action="store_true", help="disable the key cache")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if result["fill_seconds"]:
+        print(f"Filled {result['users']} users in {result['fill_seconds']:.1f}s")
+    print(f"{'function':<24} {'ops/s':>9} {'p50':>8} {'p99':>8}   {'ops/s':>9} {'p50':>8} {'p99':>8}")
+    for name, stats in result["functions"].items():
+        single, concurrent = stats["single"], stats["concurrent"]
+        print(
+            f"{name:<24} {single['ops_per_second']:9.0f} "
+            f"{single['latency_ms']['p50']:8.2f} {single['latency_ms']['p99']:8.2f}   "
+            f"{concurrent['ops_per_second']:9.0f} "
+            f"{concurrent['latency_ms']['p50']:8.2f} {concurrent['latency_ms']['p99']:8.2f}"
+        )
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
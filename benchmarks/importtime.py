@@ -0,0 +1,95 @@
+"""Measure the startup cost of ``import bot`` with ``python -X importtime``.
+
+Each run imports the bot in a fresh interpreter and parses the timings the
+interpreter writes to stderr. The median over all runs is reported for the
+bot itself and for the slowest modules it pulls in::
+
+    python benchmarks/importtime.py --runs 5 --json importtime.json
+
+``--max-ms`` makes the script exit with status 1 when ``import bot`` is
+slower, so it can guard against regressions in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Any syntactically valid token lets bot.py construct its Bot
+BENCH_TOKEN = "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX"
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """Return ``{module: (self_us, cumulative_us)}`` from ``-X importtime``."""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header line
+        timings[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return timings
+
+
+def measure(module: str = "bot") -> dict[str, tuple[int, int]]:
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", BENCH_TOKEN))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="bot")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--max-ms", type=float, help="fail if the import is slower")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    modules = set.intersection(*(set(run) for run in runs))
+    median_ms = {
+        name: statistics.median(run[name][1] for run in runs) / 1000 for name in modules
+    }
+    total = median_ms[args.module]
+    top = sorted(
+        (name for name in modules if name != args.module),
+        key=median_ms.get,
+        reverse=True,
+    )[: args.top]
+
+    print(f"import {args.module}: {total:.1f} ms (median of {args.runs})")
+    for name in top:
+        print(f"  {median_ms[name]:8.1f} ms  {name}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(
+                {
+                    "module": args.module,
+                    "runs": args.runs,
+                    "total_ms": total,
+                    "modules_ms": {name: median_ms[name] for name in top},
+                },
+                fh,
+                indent=2,
+            )
+    if args.max_ms is not None and total > args.max_ms:
+        print(f"import {args.module} exceeds {args.max_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
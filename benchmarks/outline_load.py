@@ -0,0 +1,121 @@
+"""Load test of the Outline client against the in-process fake server.
+
+Creates, renames and deletes ``--keys`` access keys with ``--concurrency``
+workers through :class:`OutlineClient` and reports throughput and latency
+percentiles per operation::
+
+    python benchmarks/outline_load.py --keys 2000 --latency 0.02 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outline_api.client import OutlineClient  # noqa: E402
+from outline_api.testing import FakeOutlineServer  # noqa: E402
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0.0
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100)
+    return {"p50": cuts[49] * 1000, "p95": cuts[94] * 1000, "p99": cuts[98] * 1000}
+
+
+async def timed(samples: dict[str, list[float]], op: str, call):
+    """Await ``call`` recording its latency; return its result or the error."""
+    started = time.perf_counter()
+    try:
+        return await call
+    except Exception as exc:
+        return exc
+    finally:
+        samples.setdefault(op, []).append(time.perf_counter() - started)
+
+
+async def run(args) -> dict:
+    fake = FakeOutlineServer(
+        latency=(args.latency / 2, args.latency * 1.5) if args.latency else 0.0,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=1,
+    )
+    async with fake:
+        client = OutlineClient(fake.url, max_concurrency=args.concurrency)
+        samples: dict[str, list[float]] = {}
+        errors = 0
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(args.keys):
+            queue.put_nowait(i)
+
+        async def worker() -> None:
+            nonlocal errors
+            while not queue.empty():
+                i = queue.get_nowait()
+                key = await timed(samples, "create_key", client.create_key())
+                if isinstance(key, Exception):
+                    errors += 1
+                    continue
+                for op, call in (
+                    ("rename_key", client.rename_key(key["id"], f"vpn_{i}")),
+                    ("delete_key", client.delete_key(key["id"])),
+                ):
+                    if isinstance(await timed(samples, op, call), Exception):
+                        errors += 1
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        finally:
+            await client.close()
+        elapsed = time.perf_counter() - started
+
+    requests = sum(fake.requests.values())
+    return {
+        "keys": args.keys,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "errors": errors,
+        "injected_failures": fake.failed,
+        "throttled": fake.throttled,
+        "client": client.stats(),
+        "latency_ms": {op: percentiles(values) for op, values in samples.items()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.01, help="mean seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, help="server requests per second")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(
+        f"{result['requests']} requests in {result['seconds']:.2f}s "
+        f"({result['requests_per_second']:.0f}/s), {result['errors']} errors"
+    )
+    for op, stats in result["latency_ms"].items():
+        print(
+            f"  {op:<11} p50 {stats['p50']:7.1f} ms  "
+            f"p95 {stats['p95']:7.1f} ms  p99 {stats['p99']:7.1f} ms"
+        )
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result, fh, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,22 +11,43 @@ from aiogram.types import (
     ReplyKeyboardMarkup,
 )
 from aiogram import F
-from outline_api import Manager
+from outline_api.client import OutlineClient, close_clients, get_client
 import time
 from admin import router as admin_router
+from scheduler import DueQueue
+from key_pool import KeyPool
+from servers import LEAST_KEYS, OutlineServers
+from reconcile import Reconciler
+from traffic import format_bytes, traffic_loop
+from outbound import OutboundLimiter, bulk
+from broadcast import resume_broadcasts
+from metrics import METRICS_PORT, add_gauge, instrument_dispatcher, start_metrics_server
+from tracing import TRACER, trace_dispatcher
 from db import (
     init_db,
+    close_db,
     add_key,
     clear_key,
+    clear_keys,
+    get_key_rows,
+    get_scheduled_keys,
+    get_server_keys,
+    move_key,
+    assign_default_server,
+    remove_pool_keys,
+    add_pending_deletion,
+    remove_pending_deletions,
+    get_pending_deletions,
     has_used_trial,
     get_active_key,
+    get_key_usage,
     record_referral,
     get_key_info,
     update_expiration,
-    get_last_notification,
-    set_last_notification,
+    get_due_notifications,
+    set_last_notifications,
     save_user,
-    get_connection,
+    refresh_users_stats,
 )
 
 TOKEN = os.getenv("BOT_TOKEN")
@@ -37,12 +58,39 @@ if not TOKEN:
     raise RuntimeError("BOT_TOKEN not configured")
 
 bot = Bot(token=TOKEN)
+
+# Paces every message the bot sends to Telegram's limits
+OUTBOUND = OutboundLimiter()
+bot.session.middleware(OUTBOUND)
+
 dp = Dispatcher()
 
+# Times every handler, including those of routers included later
+instrument_dispatcher(dp)
+# Logs updates slower than SLOW_UPDATE_MS with their spans
+trace_dispatcher(dp)
+
 BOT_USERNAME: str | None = None
 
+# "polling" (default) or "webhook" to receive updates through webhook.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
 OUTLINE_API_URL = os.getenv("OUTLINE_API_URL")
 
+# Comma-separated API URLs of every Outline server new keys are spread across
+OUTLINE_API_URLS = [
+    url.strip() for url in os.getenv("OUTLINE_API_URLS", "").split(",") if url.strip()
+]
+
+# How a server is chosen for a new key: "least_keys" or "least_transfer"
+KEY_PLACEMENT = os.getenv("KEY_PLACEMENT", LEAST_KEYS)
+
+# Number of keys moved together while draining a server
+DRAIN_BATCH_SIZE = int(os.getenv("DRAIN_BATCH_SIZE", "20"))
+
+# Seconds to wait between drain batches
+DRAIN_BATCH_DELAY = float(os.getenv("DRAIN_BATCH_DELAY", "5"))
+
 DELETE_DELAY = int(os.getenv("DELETE_DELAY", "30"))
 
 # URL of the Telegram channel with user reviews
@@ -51,8 +99,20 @@ REVIEWS_CHANNEL_URL = os.getenv("REVIEWS_CHANNEL_URL")
 # Number of days granted to a referrer for each invited user
 REFERRAL_BONUS_DAYS = 3
 
-# Track scheduled deletion tasks so we can reschedule them
-DELETION_TASKS: dict[tuple[int, bool], asyncio.Task] = {}
+# Number of reminders whose timestamps are stored in one batch
+NOTIFY_BATCH_SIZE = 500
+
+# How often the /users counters pick up newly expired keys (seconds)
+STATS_REFRESH_INTERVAL = int(os.getenv("STATS_REFRESH_INTERVAL", "60"))
+
+# Keys expiring within this many seconds are loaded into the expiry queue
+KEY_EXPIRY_WINDOW = int(os.getenv("KEY_EXPIRY_WINDOW", str(24 * 60 * 60)))
+
+# Maximum number of expired keys deleted together
+KEY_EXPIRY_BATCH = 100
+
+# Telegram accepts at most this many ids per delete_messages call
+DELETE_MESSAGES_LIMIT = 100
 
 # Device links for Outline clients
 DEVICE_LINKS = {
@@ -72,37 +132,155 @@ async def get_bot_username() -> str:
     return BOT_USERNAME
 
 
+async def delete_temporary_messages(batch: list[tuple]) -> None:
+    """Delete due messages with one bulk request per chat."""
+    by_chat: dict[tuple[Bot, int], list[int]] = {}
+    for (chat_id, message_id), sender in batch:
+        by_chat.setdefault((sender or bot, chat_id), []).append(message_id)
+    for (sender, chat_id), message_ids in by_chat.items():
+        for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+            chunk = message_ids[start : start + DELETE_MESSAGES_LIMIT]
+            try:
+                if len(chunk) == 1:
+                    await sender.delete_message(chat_id, chunk[0])
+                else:
+                    await sender.delete_messages(chat_id, chunk)
+            except Exception as exc:
+                logging.error("Failed to delete message: %s", exc)
+    await remove_pending_deletions([key for key, _ in batch])
+
+
+# Messages sent by send_temporary that are waiting to be deleted
+TEMP_MESSAGES = DueQueue(
+    delete_temporary_messages, batch_size=500, name="message deletion"
+)
+
+
 async def send_temporary(
     bot: Bot, chat_id: int, text: str, delay: int = DELETE_DELAY, **kwargs
 ) -> types.Message:
     msg = await bot.send_message(chat_id, text, **kwargs)
+    delete_at = time.time() + delay
+    TEMP_MESSAGES.schedule((chat_id, msg.message_id), delete_at, bot)
+    try:
+        await add_pending_deletion(chat_id, msg.message_id, int(delete_at))
+    except Exception as exc:
+        logging.error("Failed to store pending deletion: %s", exc)
+    return msg
 
-    async def _remove() -> None:
-        await asyncio.sleep(delay)
-        try:
-            await bot.delete_message(chat_id, msg.message_id)
-        except Exception as exc:
-            logging.error("Failed to delete message: %s", exc)
 
-    asyncio.create_task(_remove())
-    return msg
+async def load_pending_deletions() -> int:
+    """Queue messages left undeleted by a previous run."""
+    rows = await get_pending_deletions()
+    for chat_id, message_id, delete_at in rows:
+        TEMP_MESSAGES.schedule((chat_id, message_id), delete_at)
+    return len(rows)
+
 
+_servers: dict[tuple, OutlineServers] = {}
 
-def outline_manager() -> Manager:
-    if not OUTLINE_API_URL:
+
+def outline_servers() -> OutlineServers:
+    """Return the registry of the configured Outline servers."""
+    urls = OUTLINE_API_URLS or ([OUTLINE_API_URL] if OUTLINE_API_URL else [])
+    if not urls:
         raise RuntimeError("OUTLINE_API_URL not configured")
-    return Manager(apiurl=OUTLINE_API_URL, apicrt="")
+    config = (tuple(urls), OUTLINE_API_URL, KEY_PLACEMENT)
+    servers = _servers.get(config)
+    if servers is None:
+        _servers.clear()
+        servers = _servers[config] = OutlineServers(
+            urls, lambda url: get_client(url), OUTLINE_API_URL, KEY_PLACEMENT
+        )
+    return servers
+
+
+def outline_manager(server: str | None = None) -> OutlineClient:
+    """Return the client of ``server`` (the default server if ``None``)."""
+    return outline_servers().client(server)
+
+
+async def rename_outline_key(key_id, name: str, server: str | None = None) -> None:
+    await outline_manager(server).rename_key(key_id, name)
+
+
+async def create_server_key(label: str | None = None) -> dict:
+    """Create a key on the least loaded server, recording it in ``server``."""
+    server = await outline_servers().choose()
+    key = await outline_manager(server).create_key(label)
+    key["server"] = server
+    return key
+
+
+# Pre-created keys handed out before falling back to the Outline server
+KEY_POOL = KeyPool(create_server_key, rename_outline_key)
 
 
 async def create_outline_key(label: str | None = None) -> dict:
-    manager = outline_manager()
-    key = await asyncio.to_thread(manager.new, label)
-    if label and "id" in key:
+    if KEY_POOL.enabled:
         try:
-            await asyncio.to_thread(manager.rename, key["id"], label)
+            key = await KEY_POOL.claim(label)
         except Exception as exc:
-            logging.error("Failed to rename Outline key: %s", exc)
-    return key
+            logging.error("Failed to claim pooled key: %s", exc)
+            key = None
+        if key is not None:
+            return key
+    return await create_server_key(label)
+
+
+async def expire_keys(batch: list[tuple]) -> None:
+    """Delete due Outline keys and clear their database rows.
+
+    User keys are checked against ``vpn_access`` first, so a key renewed
+    since it was queued is rescheduled to its stored expiry instead.
+    """
+    now = int(time.time())
+    due: list[tuple] = []
+    for _, (key_id, user_id, is_trial, server) in batch:
+        clear = False
+        if user_id is not None:
+            row = next(
+                (r for r in await get_key_rows(user_id) if r[0] == int(is_trial)), None
+            )
+            if row is not None and row[1] is not None and row[3] is not None:
+                _, current_id, _, expires_at, current_server = row
+                if str(current_id) != str(key_id) or current_server != server:
+                    # The key was replaced; its successor expires on its own
+                    schedule_key_deletion(
+                        current_id,
+                        expires_at - now,
+                        user_id=user_id,
+                        is_trial=is_trial,
+                        server=current_server,
+                    )
+                elif expires_at > now:
+                    schedule_key_deletion(
+                        key_id,
+                        expires_at - now,
+                        user_id=user_id,
+                        is_trial=is_trial,
+                        server=server,
+                    )
+                    continue
+                else:
+                    clear = True
+        due.append((key_id, user_id, is_trial, server, clear))
+    if not due:
+        return
+    results = await asyncio.gather(
+        *(outline_manager(server).delete_key(key_id) for key_id, _, _, server, _ in due),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error("Failed to delete Outline key: %s", result)
+    await clear_keys(
+        [(user_id, is_trial) for _, user_id, is_trial, _, clear in due if clear]
+    )
+
+
+# Pending key deletions ordered by expiry time
+KEY_EXPIRY = DueQueue(expire_keys, batch_size=KEY_EXPIRY_BATCH, name="key expiry")
 
 
 def schedule_key_deletion(
@@ -110,28 +288,134 @@ def schedule_key_deletion(
     delay: int = 24 * 60 * 60,
     user_id: int | None = None,
     is_trial: bool | None = None,
-) -> asyncio.Task:
-    """Schedule Outline key removal and return the created task."""
+    server: str | None = None,
+) -> None:
+    """Schedule removal of an Outline key on ``server`` after ``delay`` seconds.
 
-    async def _remove() -> None:
-        await asyncio.sleep(delay)
-        manager = outline_manager()
+    A user's key replaces any pending deletion of their previous key of the
+    same kind.
+    """
+    if user_id is not None and is_trial is not None:
+        is_trial = bool(is_trial)
+        entry = (user_id, is_trial)
+    else:
+        entry = ("key", key_id)
+    KEY_EXPIRY.schedule(entry, time.time() + delay, (key_id, user_id, is_trial, server))
+
+
+async def load_key_expiry(window: int = KEY_EXPIRY_WINDOW) -> int:
+    """Queue deletions of stored keys expiring within ``window`` seconds."""
+    now = int(time.time())
+    rows = await get_scheduled_keys(now + window)
+    for user_id, is_trial, key_id, expires_at, server in rows:
+        schedule_key_deletion(
+            key_id, expires_at - now, user_id=user_id, is_trial=is_trial, server=server
+        )
+    return len(rows)
+
+
+async def key_expiry_loop(window: int = KEY_EXPIRY_WINDOW) -> None:
+    """Rebuild the expiry queue from the database and keep it topped up."""
+    while True:
+        try:
+            count = await load_key_expiry(window)
+            logging.info("Loaded %s expiring keys", count)
+        except Exception as exc:
+            logging.error("Failed to load expiring keys: %s", exc)
+        await asyncio.sleep(window / 2)
+
+
+async def migrate_key(
+    user_id: int, is_trial: bool, key_id, expires_at: int | None, server: str
+) -> bool:
+    """Move one user's key from ``server`` to the least loaded other server."""
+    servers = outline_servers()
+    target = await servers.choose()
+    new_key = await outline_manager(target).create_key(f"vpn_{user_id}")
+    new_id, access_url = new_key.get("id"), new_key.get("accessUrl")
+    if not await move_key(user_id, is_trial, key_id, new_id, access_url, target):
+        # The key was replaced or cleared meanwhile
+        await outline_manager(target).delete_key(new_id)
+        return False
+    try:
+        await outline_manager(server).delete_key(key_id)
+    except Exception as exc:
+        logging.error("Failed to delete migrated key %s: %s", key_id, exc)
+    if KEY_EXPIRY.due_at((user_id, bool(is_trial))) is not None and expires_at:
+        schedule_key_deletion(
+            new_id,
+            expires_at - int(time.time()),
+            user_id=user_id,
+            is_trial=is_trial,
+            server=target,
+        )
+    try:
+        with bulk():
+            await bot.send_message(
+                user_id,
+                "🔄 Ваш VPN перенесён на другой сервер. "
+                "Замените ключ в приложении на новый:",
+            )
+            await bot.send_message(user_id, access_url)
+    except Exception as exc:
+        logging.error("Failed to send migrated key: %s", exc)
+    return True
+
+
+async def drain_server(
+    server: str,
+    batch_size: int = DRAIN_BATCH_SIZE,
+    delay: float = DRAIN_BATCH_DELAY,
+) -> dict[str, int]:
+    """Move every key off ``server`` in batches and stop placing keys on it.
+
+    Batches of ``batch_size`` keys are migrated concurrently with ``delay``
+    seconds between them so neither Outline nor Telegram is flooded.
+    """
+    servers = outline_servers()
+    servers.url(server)
+    servers.draining.add(server)
+    summary = {"moved": 0, "skipped": 0, "failed": 0, "pooled": 0}
+    pooled = await remove_pool_keys(server)
+    for key_id in pooled:
         try:
-            await asyncio.to_thread(manager.delete, key_id)
+            await outline_manager(server).delete_key(key_id)
         except Exception as exc:
-            logging.error("Failed to delete Outline key: %s", exc)
-        if user_id is not None and is_trial is not None:
-            await clear_key(user_id, is_trial)
-            DELETION_TASKS.pop((user_id, is_trial), None)
+            logging.error("Failed to delete pooled key %s: %s", key_id, exc)
+    summary["pooled"] = len(pooled)
+    after = None
+    while True:
+        rows = await get_server_keys(server, after, batch_size)
+        if not rows:
+            break
+        after = rows[-1][2]
+        results = await asyncio.gather(
+            *(
+                migrate_key(user_id, is_trial, key_id, expires_at, server)
+                for user_id, is_trial, key_id, expires_at in rows
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error("Failed to migrate key: %s", result)
+                summary["failed"] += 1
+            elif result:
+                summary["moved"] += 1
+            else:
+                summary["skipped"] += 1
+        await asyncio.sleep(delay)
+    logging.info("Drained server %s: %s", server, summary)
+    return summary
 
-    if user_id is not None and is_trial is not None:
-        old = DELETION_TASKS.pop((user_id, is_trial), None)
-        if old:
-            old.cancel()
-    task = asyncio.create_task(_remove())
-    if user_id is not None and is_trial is not None:
-        DELETION_TASKS[(user_id, is_trial)] = task
-    return task
+
+# Removes keys leaked on the Outline servers
+RECONCILER = Reconciler(outline_servers)
+
+# Passed to the admin handlers, which cannot import this module
+dp["reconciler"] = RECONCILER
+dp["outline_servers"] = outline_servers
+dp["drain_server"] = drain_server
 
 
 async def send_activation_prompt(chat_id: int, access_url: str, expires_at: int) -> None:
@@ -171,19 +455,14 @@ async def notify_expirations_loop(interval: int = 60 * 60) -> None:
     """Periodically check VPN subscriptions and send reminders."""
     while True:
         now = int(time.time())
-        async with get_connection() as conn:
-            cursor = await conn.execute(
-                "SELECT user_id, expires_at FROM vpn_access "
-                "WHERE key_id IS NOT NULL AND expires_at IS NOT NULL"
-            )
-            rows = await cursor.fetchall()
-        for user_id, expires_at in rows:
-            if expires_at is None:
-                continue
-            days_left = (expires_at - now + 86399) // 86400
-            last = await get_last_notification(user_id)
-            if last and now - last < 24 * 60 * 60:
+        rows = await get_due_notifications(now)
+        notified: list[int] = []
+        seen: set[int] = set()
+        for user_id, expires_at, days_left in rows:
+            # A user with both a trial and a paid row gets one reminder
+            if user_id in seen:
                 continue
+            seen.add(user_id)
             text = None
             if days_left == 3:
                 text = (
@@ -209,10 +488,26 @@ async def notify_expirations_loop(interval: int = 60 * 60) -> None:
                     )
             if text:
                 try:
-                    await bot.send_message(user_id, text)
-                    await set_last_notification(user_id, now)
+                    with bulk():
+                        await bot.send_message(user_id, text)
+                    notified.append(user_id)
                 except Exception as exc:
                     logging.error("Failed to send notification: %s", exc)
+            if len(notified) >= NOTIFY_BATCH_SIZE:
+                await set_last_notifications(notified, now)
+                notified = []
+        await set_last_notifications(notified, now)
+        logging.info("Outbound messages: %s", OUTBOUND.stats())
+        await asyncio.sleep(interval)
+
+
+async def users_stats_loop(interval: int = STATS_REFRESH_INTERVAL) -> None:
+    """Periodically advance the incrementally maintained user statistics."""
+    while True:
+        try:
+            await refresh_users_stats()
+        except Exception as exc:
+            logging.error("Failed to refresh user stats: %s", exc)
         await asyncio.sleep(interval)
 
 
@@ -224,18 +519,31 @@ async def grant_referral_bonus(referrer_id: int) -> None:
     try:
         key = await create_outline_key(label=label)
         expires = now_ts + bonus_seconds
-        await add_key(referrer_id, key.get("id"), key.get("accessUrl"), expires, False)
+        await add_key(
+            referrer_id,
+            key.get("id"),
+            key.get("accessUrl"),
+            expires,
+            False,
+            server=key.get("server"),
+        )
         schedule_key_deletion(
-            key.get("id"), delay=bonus_seconds, user_id=referrer_id, is_trial=False
+            key.get("id"),
+            delay=bonus_seconds,
+            user_id=referrer_id,
+            is_trial=False,
+            server=key.get("server"),
         )
 
         logging.info("Issued referral key %s for user %s", key.get("id"), referrer_id)
 
-        await send_activation_prompt(
-            referrer_id,
-            key.get("accessUrl", "не удалось получить"),
-            expires,
-        )
+        # The referrer is not waiting for a reply, unlike the invited user
+        with bulk():
+            await send_activation_prompt(
+                referrer_id,
+                key.get("accessUrl", "не удалось получить"),
+                expires,
+            )
     except Exception as exc:
         logging.error("Failed to create referral key: %s", exc)
 
@@ -322,12 +630,14 @@ async def callback_trial(callback: types.CallbackQuery):
                 key.get("accessUrl"),
                 expires,
                 True,
+                server=key.get("server"),
             )
             schedule_key_deletion(
                 key.get("id"),
                 delay=24 * 60 * 60,
                 user_id=callback.from_user.id,
                 is_trial=True,
+                server=key.get("server"),
             )
             await send_activation_prompt(
                 callback.message.chat.id,
@@ -395,9 +705,11 @@ async def menu_keys(message: types.Message):
             await send_temporary(bot, message.chat.id, "Срок действия вашего ключа истёк.")
         else:
             date_str = time.strftime("%d.%m.%Y", time.localtime(expires_at))
-            await send_temporary(
-                bot, message.chat.id, f"\U0001f511 Ваш ключ активен до {date_str}"
-            )
+            text = f"\U0001f511 Ваш ключ активен до {date_str}"
+            usage = await get_key_usage(message.from_user.id)
+            if usage is not None:
+                text += f"\n\U0001f4ca Трафик за 30 дней: {format_bytes(usage)}"
+            await send_temporary(bot, message.chat.id, text)
             await send_temporary(bot, message.chat.id, access_url)
     else:
         await send_temporary(bot, message.chat.id, "У вас нет активного ключа.")
@@ -513,11 +825,69 @@ async def back_to_menu(message: types.Message):
     await cmd_start(message)
 
 
+def add_gauges() -> None:
+    """Export the counters kept by the bot's queues and limiters."""
+    add_gauge(
+        "bot_outbound_sent_total", "Messages sent to Telegram.", lambda: OUTBOUND.sent, "counter"
+    )
+    add_gauge(
+        "bot_outbound_retried_total",
+        "Messages refused with retry_after.",
+        lambda: OUTBOUND.retried,
+        "counter",
+    )
+    add_gauge(
+        "bot_outbound_backlog",
+        "Messages waiting for the send limiter.",
+        lambda: sum(OUTBOUND.stats()["backlog"].values()),
+    )
+    add_gauge("bot_key_expiry_queue", "Keys waiting for deletion.", lambda: len(KEY_EXPIRY))
+    add_gauge(
+        "bot_slow_updates_total",
+        "Updates slower than SLOW_UPDATE_MS.",
+        lambda: TRACER.slow_updates,
+        "counter",
+    )
+    add_gauge("bot_key_pool_depth", "Spare keys in the warm pool.", lambda: KEY_POOL.depth or 0)
+
+
 async def main() -> None:
     await init_db()
+    metrics_runner = None
+    if METRICS_PORT:
+        add_gauges()
+        metrics_runner = await start_metrics_server()
     dp.include_router(admin_router)
+    if OUTLINE_API_URLS or OUTLINE_API_URL:
+        await assign_default_server(outline_servers().default)
+        asyncio.create_task(RECONCILER.loop())
+        asyncio.create_task(traffic_loop(outline_servers))
+    await load_pending_deletions()
+    await resume_broadcasts(bot)
+    TEMP_MESSAGES.start()
+    KEY_EXPIRY.start()
+    asyncio.create_task(key_expiry_loop())
     asyncio.create_task(notify_expirations_loop())
-    await dp.start_polling(bot)
+    asyncio.create_task(users_stats_loop())
+    if KEY_POOL.enabled:
+        asyncio.create_task(KEY_POOL.run())
+    try:
+        if BOT_MODE == "webhook":
+            # Imported here so polling deployments skip loading aiohttp.web
+            from webhook import WebhookServer
+
+            await WebhookServer(dp, bot).serve()
+        else:
+            # Telegram refuses getUpdates while a webhook is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await KEY_EXPIRY.stop()
+        await TEMP_MESSAGES.stop()
+        await close_clients()
+        await close_db()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""Sending a message from an admin to every user."""
+
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from db import create_broadcast, get_running_broadcasts, get_user_ids, update_broadcast
+from outbound import TokenBucket, bulk
+
+# Messages per second sent by a broadcast, below Telegram's global limit so
+# replies to users keep flowing meanwhile
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+
+# Users read and checkpointed together; a resumed broadcast repeats at most
+# one page
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))
+
+# Messages of a page in flight at the same time
+BROADCAST_CONCURRENCY = 10
+
+# Seconds between progress updates sent to the admin
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# Broadcasts being sent, by id
+RUNNING: dict[int, "Broadcast"] = {}
+
+
+class Broadcast:
+    """One broadcast streaming users from the database in id order.
+
+    Progress is stored after every page, so a broadcast interrupted by a
+    restart continues after the last finished page.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        broadcast_id: int,
+        admin_id: int,
+        text: str,
+        last_user_id: int | None = None,
+        sent: int = 0,
+        failed: int = 0,
+        rate: float = BROADCAST_RATE,
+        page_size: int = BROADCAST_PAGE_SIZE,
+    ) -> None:
+        self.bot = bot
+        self.id = broadcast_id
+        self.admin_id = admin_id
+        self.text = text
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+        self.page_size = page_size
+        self._bucket = TokenBucket(rate, 1)
+        self._slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        self._started = time.monotonic()
+        self._sent_at_start = sent + failed
+        self._progress_message = None
+        self._progress_at = 0.0
+
+    def per_second(self) -> float:
+        elapsed = time.monotonic() - self._started
+        done = self.sent + self.failed - self._sent_at_start
+        return done / elapsed if elapsed > 0 else 0.0
+
+    def progress_text(self, finished: bool = False) -> str:
+        state = "завершена" if finished else "идёт"
+        return (
+            f"📣 Рассылка #{self.id} {state}\n"
+            f"Отправлено: {self.sent}\n"
+            f"Ошибок: {self.failed}\n"
+            f"Скорость: {self.per_second():.1f} сообщ./с"
+        )
+
+    async def _report(self, finished: bool = False) -> None:
+        now = time.monotonic()
+        if not finished and now - self._progress_at < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._progress_at = now
+        text = self.progress_text(finished)
+        try:
+            if self._progress_message is None:
+                self._progress_message = await self.bot.send_message(self.admin_id, text)
+            else:
+                await self.bot.edit_message_text(
+                    text,
+                    chat_id=self.admin_id,
+                    message_id=self._progress_message.message_id,
+                )
+        except Exception as exc:
+            logging.error("Failed to report broadcast progress: %s", exc)
+
+    async def _send(self, user_id: int) -> None:
+        async with self._slots:
+            delay = self._bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                with bulk():
+                    await self.bot.send_message(user_id, self.text)
+                self.sent += 1
+            except (TelegramForbiddenError, TelegramBadRequest):
+                # The user blocked the bot or deleted the account
+                self.failed += 1
+            except Exception as exc:
+                logging.error("Failed to send broadcast to %s: %s", user_id, exc)
+                self.failed += 1
+
+    async def run(self) -> None:
+        RUNNING[self.id] = self
+        try:
+            await self._report()
+            while True:
+                user_ids = await get_user_ids(self.last_user_id, self.page_size)
+                if not user_ids:
+                    break
+                await asyncio.gather(*(self._send(user_id) for user_id in user_ids))
+                self.last_user_id = user_ids[-1]
+                await update_broadcast(self.id, self.last_user_id, self.sent, self.failed)
+                await self._report()
+            await update_broadcast(self.id, self.last_user_id, self.sent, self.failed, "done")
+            logging.info(
+                "Broadcast %s finished: %s sent, %s failed", self.id, self.sent, self.failed
+            )
+            await self._report(finished=True)
+        except Exception as exc:
+            logging.error("Failed to run broadcast %s: %s", self.id, exc)
+        finally:
+            RUNNING.pop(self.id, None)
+
+
+async def start_broadcast(bot: Bot, admin_id: int, text: str) -> Broadcast:
+    """Store a broadcast and start sending it in the background."""
+    broadcast = Broadcast(bot, await create_broadcast(admin_id, text), admin_id, text)
+    asyncio.create_task(broadcast.run())
+    return broadcast
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Continue broadcasts interrupted by the previous run."""
+    rows = await get_running_broadcasts()
+    for broadcast_id, admin_id, text, last_user_id, sent, failed in rows:
+        if broadcast_id in RUNNING:
+            continue
+        logging.info("Resuming broadcast %s after user %s", broadcast_id, last_user_id)
+        broadcast = Broadcast(bot, broadcast_id, admin_id, text, last_user_id, sent, failed)
+        asyncio.create_task(broadcast.run())
+    return len(rows)
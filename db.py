@@ -1,18 +1,427 @@
+import asyncio
+import logging
 import os
 import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
 import aiosqlite
 
+from metrics import DB as DB_METRICS, instrument
+
 DB_PATH = os.getenv("DB_PATH", "vpn.sqlite")
 
+# Number of long-lived connections opened by ``init_db``
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+# Opt-in write-behind mode: queued writes are group-committed every
+# DB_WRITE_BATCH_MS milliseconds or DB_WRITE_BATCH_SIZE statements
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BATCH_MS = int(os.getenv("DB_WRITE_BATCH_MS", "50"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "500"))
+
+# Read-through cache of per-user vpn_access rows
+KEY_CACHE_ENABLED = os.getenv("DB_KEY_CACHE", "1") != "0"
+KEY_CACHE_SIZE = int(os.getenv("DB_KEY_CACHE_SIZE", "10000"))
+KEY_CACHE_TTL = int(os.getenv("DB_KEY_CACHE_TTL", "300"))
+
+# Applied once to every pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+)
+
+
+# Secondary indexes for the hot access paths, created idempotently at startup
+INDEXES = (
+    # Expiration reminders and key expiry look up keys by expires_at
+    "CREATE INDEX IF NOT EXISTS idx_vpn_access_expires ON vpn_access (expires_at, key_id)",
+    # /userlist pages are ordered by (created_at, user_id) with NULLs as 0
+    "CREATE INDEX IF NOT EXISTS idx_users_page ON users (COALESCE(created_at, 0), user_id)",
+    # Superseded by idx_users_page
+    "DROP INDEX IF EXISTS idx_users_created",
+    # /users aggregates are answered from the index alone
+    "CREATE INDEX IF NOT EXISTS idx_users_expires ON users (expires_at, is_trial, is_paid)",
+    # Auto-deleted messages are loaded in deletion order
+    "CREATE INDEX IF NOT EXISTS idx_pending_deletions_at ON pending_deletions (delete_at)",
+    # Per-server key counts and server drains walk keys by server
+    "CREATE INDEX IF NOT EXISTS idx_vpn_access_server ON vpn_access (server, key_id)",
+    # Admins list the heaviest keys first
+    "CREATE INDEX IF NOT EXISTS idx_key_traffic_bytes ON key_traffic (bytes)",
+)
+
+# Columns added after the first release, created on existing databases
+COLUMNS = (
+    ("vpn_access", "server", "TEXT"),
+    ("key_pool", "server", "TEXT"),
+)
+
+
+# users_stats holds the /users counters evaluated at its ``as_of`` watermark.
+# Triggers keep it in step with writes to ``users``; refresh_users_stats
+# advances the watermark by moving keys that expired since then.
+_STATS_ACTIVE = "COALESCE({row}.expires_at > as_of, 0)"
+_STATS_TRIAL = "COALESCE({row}.is_trial = 1 AND {row}.expires_at > as_of, 0)"
+_STATS_PAID = "COALESCE({row}.is_paid = 1 AND {row}.expires_at > as_of, 0)"
+_STATS_EXPIRED = "COALESCE({row}.expires_at <= as_of, 0)"
+
+
+def _stats_update(*terms: tuple[str, str]) -> str:
+    """Return the users_stats UPDATE applying ``(sign, row)`` contributions."""
+    columns = {
+        "active": _STATS_ACTIVE,
+        "trial": _STATS_TRIAL,
+        "paid": _STATS_PAID,
+        "expired": _STATS_EXPIRED,
+    }
+    assignments = []
+    for column, expr in columns.items():
+        delta = " ".join(f"{sign} {expr.format(row=row)}" for sign, row in terms)
+        assignments.append(f"{column} = {column} {delta}")
+    return "UPDATE users_stats SET " + ", ".join(assignments) + " WHERE id = 1;"
+
+
+STATS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN "
+    "UPDATE users_stats SET total = total + 1 WHERE id = 1; "
+    + _stats_update(("+", "NEW"))
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users BEGIN "
+    "UPDATE users_stats SET total = total - 1 WHERE id = 1; "
+    + _stats_update(("-", "OLD"))
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS users_stats_update "
+    "AFTER UPDATE OF is_trial, is_paid, expires_at ON users BEGIN "
+    + _stats_update(("-", "OLD"), ("+", "NEW"))
+    + " END",
+)
+
+
+class ConnectionPool:
+    """Fixed set of SQLite connections shared by all database calls."""
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE) -> None:
+        self.path = path
+        self.size = max(1, size)
+        self._conns: list[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+
+    async def open(self) -> None:
+        dirpath = os.path.dirname(self.path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        for _ in range(self.size):
+            conn = aiosqlite.connect(self.path)
+            # Pooled connections live for the whole process and must not
+            # keep the interpreter alive if ``close`` is never reached.
+            conn.daemon = True
+            await conn
+            for pragma in PRAGMAS:
+                await conn.execute(pragma)
+            self._conns.append(conn)
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    await conn.rollback()
+            except Exception as exc:
+                logging.error("Failed to roll back pooled connection: %s", exc)
+            self._idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                await conn.close()
+            except Exception as exc:
+                logging.error("Failed to close database connection: %s", exc)
+
+
+_pool: ConnectionPool | None = None
+
+
+class WriteQueue:
+    """Single writer task committing queued statements in shared transactions.
+
+    Each submitted item is a list of ``(method, sql, params)`` tuples where
+    ``method`` is ``"execute"`` or ``"executemany"``. Items are drained into
+    one transaction every ``batch_ms`` milliseconds or ``batch_size`` items.
+    """
+
+    def __init__(
+        self, batch_ms: int = DB_WRITE_BATCH_MS, batch_size: int = DB_WRITE_BATCH_SIZE
+    ) -> None:
+        self.batch_delay = batch_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.items = 0
+        self.failed = 0
+        self.max_batch = 0
+        self.last_batch = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Commit everything queued so far and stop the writer."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, statements: list[tuple]) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((statements, fut))
+        return fut
+
+    async def flush(self) -> None:
+        """Wait until every previously submitted write is committed."""
+        await self.submit([])
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "failed": self.failed,
+            "max_batch": self.max_batch,
+            "last_batch": self.last_batch,
+            "avg_batch": self.items / self.batches if self.batches else 0.0,
+        }
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_delay
+        while len(batch) < self.batch_size and batch[-1][0]:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                await self._commit(batch)
+            except Exception as exc:
+                logging.error("Write queue batch failed: %s", exc)
+                for _, fut in batch:
+                    _fail(fut, exc)
+
+    async def _commit(self, batch: list) -> None:
+        writes = [item for item in batch if item[0]]
+        if writes:
+            async with get_connection() as conn:
+                try:
+                    for statements, _ in writes:
+                        await _execute_statements(conn, statements)
+                    await conn.commit()
+                except Exception as exc:
+                    logging.error("Write batch failed, retrying one by one: %s", exc)
+                    await conn.rollback()
+                    await self._commit_each(conn, writes)
+                else:
+                    for _, fut in writes:
+                        if not fut.done():
+                            fut.set_result(None)
+            self.batches += 1
+            self.items += len(writes)
+            self.last_batch = len(writes)
+            self.max_batch = max(self.max_batch, len(writes))
+        for statements, fut in batch:
+            if not statements and not fut.done():
+                fut.set_result(None)
+
+    async def _commit_each(self, conn, writes: list) -> None:
+        for statements, fut in writes:
+            try:
+                await _execute_statements(conn, statements)
+                await conn.commit()
+            except Exception as exc:
+                await conn.rollback()
+                self.failed += 1
+                logging.error("Failed to write %s: %s", statements[0][1], exc)
+                _fail(fut, exc)
+            else:
+                if not fut.done():
+                    fut.set_result(None)
+
+
+_writer: WriteQueue | None = None
+
+
+class KeyCache:
+    """Bounded LRU cache with TTL holding each user's ``vpn_access`` rows.
+
+    Rows are ``(is_trial, key_id, access_url, expires_at)`` tuples ordered by
+    ``is_trial``. Every invalidation bumps a generation counter so that a read
+    which raced with a write does not store the rows it fetched before it.
+    """
+
+    def __init__(
+        self,
+        size: int = KEY_CACHE_SIZE,
+        ttl: float = KEY_CACHE_TTL,
+        enabled: bool = KEY_CACHE_ENABLED,
+    ) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._rows: OrderedDict[int, tuple[float, list[tuple]]] = OrderedDict()
+
+    def get(self, user_id: int) -> list[tuple] | None:
+        if not self.enabled:
+            return None
+        entry = self._rows.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._rows.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: int, rows: list[tuple], generation: int) -> None:
+        if not self.enabled or generation != self.generation:
+            return
+        self._rows[user_id] = (time.monotonic() + self.ttl, rows)
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.size:
+            self._rows.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self.generation += 1
+        self._rows.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._rows.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+key_cache = KeyCache()
+
+
+def key_cache_stats() -> dict:
+    """Return hit/miss counters of the per-user key cache."""
+    return key_cache.stats()
+
+
+def _fail(fut: asyncio.Future, exc: Exception) -> None:
+    if not fut.done():
+        fut.set_exception(exc)
+        # Errors are logged by the writer; most callers never await the write.
+        fut.exception()
+
+
+async def _execute_statements(conn, statements: list[tuple]) -> None:
+    for method, sql, params in statements:
+        await getattr(conn, method)(sql, params)
+
+
+async def _write(statements: list[tuple], user_id: int | None = None) -> None:
+    """Run write statements in one transaction or hand them to the writer.
+
+    ``user_id`` names the user whose cached keys the statements change.
+    """
+    if user_id is not None:
+        key_cache.invalidate(user_id)
+    if _writer is not None:
+        fut = _writer.submit(statements)
+        if user_id is not None:
+            fut.add_done_callback(lambda _: key_cache.invalidate(user_id))
+        return
+    async with get_connection() as conn:
+        await _execute_statements(conn, statements)
+        await conn.commit()
+    if user_id is not None:
+        key_cache.invalidate(user_id)
+
+
+async def flush_writes() -> None:
+    """Wait until queued writes are committed when write-behind is enabled."""
+    if _writer is not None:
+        await _writer.flush()
+
+
+def write_queue_stats() -> dict:
+    """Return queue depth and batch-size counters of the write-behind queue."""
+    if _writer is None:
+        return {"enabled": False}
+    return {"enabled": True, **_writer.stats()}
+
 
 def get_connection():
+    """Return an async context manager yielding a database connection.
+
+    Connections come from the shared pool opened by :func:`init_db`. Before
+    that (or if ``DB_PATH`` changed since) a one-off connection is used.
+    """
+    if _pool is not None and _pool.path == DB_PATH:
+        return _pool.acquire()
     dirpath = os.path.dirname(DB_PATH)
     if dirpath:
         os.makedirs(dirpath, exist_ok=True)
     return aiosqlite.connect(DB_PATH)
 
 
+async def close_db() -> None:
+    """Flush pending writes and close the shared connection pool."""
+    global _pool, _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        await writer.stop()
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
 async def init_db() -> None:
+    global _pool, _writer
+    await close_db()
+    pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+    try:
+        await pool.open()
+    except Exception:
+        await pool.close()
+        raise
+    _pool = pool
+    key_cache.clear()
     async with get_connection() as conn:
         await conn.execute(
             """
@@ -22,6 +431,7 @@ async def init_db() -> None:
                 key_id INTEGER,
                 access_url TEXT,
                 expires_at INTEGER,
+                server TEXT,
                 PRIMARY KEY (user_id, is_trial)
             )
             """
@@ -54,7 +464,105 @@ async def init_db() -> None:
             )
             """
         )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_deletions (
+                chat_id INTEGER,
+                message_id INTEGER,
+                delete_at INTEGER,
+                PRIMARY KEY (chat_id, message_id)
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS key_pool (
+                id INTEGER PRIMARY KEY,
+                key_id INTEGER,
+                access_url TEXT,
+                created_at INTEGER,
+                server TEXT
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS key_traffic (
+                server TEXT,
+                key_id INTEGER,
+                bytes INTEGER,
+                updated_at INTEGER,
+                PRIMARY KEY (server, key_id)
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS server_traffic (
+                server TEXT PRIMARY KEY,
+                bytes INTEGER,
+                updated_at INTEGER
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY,
+                admin_id INTEGER,
+                text TEXT,
+                last_user_id INTEGER,
+                sent INTEGER,
+                failed INTEGER,
+                status TEXT,
+                created_at INTEGER,
+                updated_at INTEGER
+            )
+            """
+        )
+        for table, column, decl in COLUMNS:
+            cursor = await conn.execute(f"PRAGMA table_info({table})")
+            if column not in {row[1] for row in await cursor.fetchall()}:
+                await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        for statement in INDEXES:
+            await conn.execute(statement)
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total INTEGER NOT NULL,
+                active INTEGER NOT NULL,
+                trial INTEGER NOT NULL,
+                paid INTEGER NOT NULL,
+                expired INTEGER NOT NULL,
+                as_of INTEGER NOT NULL
+            )
+            """
+        )
+        for statement in STATS_TRIGGERS:
+            await conn.execute(statement)
+        # One full pass seeds the counters the first time, later starts skip it
+        cursor = await conn.execute("SELECT 1 FROM users_stats WHERE id = 1")
+        if await cursor.fetchone() is None:
+            await conn.execute(
+                """
+                INSERT OR IGNORE INTO users_stats
+                    (id, total, active, trial, paid, expired, as_of)
+                SELECT 1, COUNT(*),
+                    COALESCE(SUM(expires_at > :now), 0),
+                    COALESCE(SUM(is_trial = 1 AND expires_at > :now), 0),
+                    COALESCE(SUM(is_paid = 1 AND expires_at > :now), 0),
+                    COALESCE(SUM(expires_at <= :now), 0),
+                    :now
+                FROM users
+                """,
+                {"now": int(time.time())},
+            )
         await conn.commit()
+    if DB_WRITE_BEHIND:
+        writer = WriteQueue(DB_WRITE_BATCH_MS, DB_WRITE_BATCH_SIZE)
+        writer.start()
+        _writer = writer
 
 
 async def add_key(
@@ -63,79 +571,113 @@ async def add_key(
     access_url: str,
     expires_at: int,
     is_trial: bool,
+    server: str | None = None,
 ) -> None:
-    async with get_connection() as conn:
-        await conn.execute(
-            "INSERT OR REPLACE INTO vpn_access (user_id, is_trial, key_id,"
-            " access_url, expires_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, int(is_trial), key_id, access_url, expires_at),
-        )
-        now_ts = int(time.time())
-        await conn.execute(
-            """
-            INSERT INTO users (user_id, is_trial, is_paid, created_at, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                is_trial=excluded.is_trial,
-                is_paid=excluded.is_paid,
-                created_at=COALESCE(users.created_at, excluded.created_at),
-                expires_at=excluded.expires_at
-            """,
-            (user_id, int(is_trial), int(not is_trial), now_ts, expires_at),
-        )
-        await conn.commit()
+    now_ts = int(time.time())
+    await _write(
+        [
+            (
+                "execute",
+                "INSERT OR REPLACE INTO vpn_access (user_id, is_trial, key_id,"
+                " access_url, expires_at, server) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, int(is_trial), key_id, access_url, expires_at, server),
+            ),
+            (
+                "execute",
+                """
+                INSERT INTO users (user_id, is_trial, is_paid, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    is_trial=excluded.is_trial,
+                    is_paid=excluded.is_paid,
+                    created_at=COALESCE(users.created_at, excluded.created_at),
+                    expires_at=excluded.expires_at
+                """,
+                (user_id, int(is_trial), int(not is_trial), now_ts, expires_at),
+            ),
+        ],
+        user_id,
+    )
 
 
 async def clear_key(user_id: int, is_trial: bool) -> None:
+    await clear_keys([(user_id, is_trial)])
+
+
+async def clear_keys(keys: list[tuple[int, bool]]) -> None:
+    """Clear many ``(user_id, is_trial)`` keys in one transaction."""
+    if not keys:
+        return
+    # Keep writes to the same rows in submission order
+    await flush_writes()
+    trial = [(user_id,) for user_id, is_trial in keys if is_trial]
+    paid = [(user_id,) for user_id, is_trial in keys if not is_trial]
     async with get_connection() as conn:
-        await conn.execute(
+        await conn.executemany(
             "UPDATE vpn_access SET key_id=NULL, access_url=NULL, "
             "expires_at=NULL WHERE user_id=? AND is_trial=?",
-            (user_id, int(is_trial)),
+            [(user_id, int(is_trial)) for user_id, is_trial in keys],
         )
-        if is_trial:
-            await conn.execute(
+        if trial:
+            await conn.executemany(
                 "UPDATE users SET is_trial=0, expires_at=NULL WHERE user_id=?",
-                (user_id,),
+                trial,
             )
-        else:
-            await conn.execute(
+        if paid:
+            await conn.executemany(
                 "UPDATE users SET is_paid=0, expires_at=NULL WHERE user_id=?",
-                (user_id,),
+                paid,
             )
         await conn.commit()
+    for user_id, _ in keys:
+        key_cache.invalidate(user_id)
 
 
-async def get_active_key(user_id: int):
+async def get_scheduled_keys(until: int):
+    """Return ``(user_id, is_trial, key_id, expires_at, server)`` of keys
+    expiring no later than ``until``."""
     async with get_connection() as conn:
         cursor = await conn.execute(
-            "SELECT access_url, expires_at, is_trial FROM vpn_access "
-            "WHERE user_id=? AND key_id IS NOT NULL",
-            (user_id,),
+            "SELECT user_id, is_trial, key_id, expires_at, server FROM vpn_access "
+            "WHERE expires_at <= ? AND key_id IS NOT NULL",
+            (until,),
         )
-        row = await cursor.fetchone()
-        return row
+        return await cursor.fetchall()
 
 
-async def has_used_trial(user_id: int) -> bool:
+async def get_key_rows(user_id: int) -> list[tuple]:
+    """Return the user's ``(is_trial, key_id, access_url, expires_at, server)``
+    rows."""
+    rows = key_cache.get(user_id)
+    if rows is not None:
+        return rows
+    generation = key_cache.generation
     async with get_connection() as conn:
         cursor = await conn.execute(
-            "SELECT 1 FROM vpn_access WHERE user_id=? AND is_trial=1",
+            "SELECT is_trial, key_id, access_url, expires_at, server FROM vpn_access "
+            "WHERE user_id=? ORDER BY is_trial",
             (user_id,),
         )
-        row = await cursor.fetchone()
-        return row is not None
+        rows = await cursor.fetchall()
+    key_cache.put(user_id, rows, generation)
+    return rows
+
+
+async def get_active_key(user_id: int):
+    for is_trial, key_id, access_url, expires_at, _ in await get_key_rows(user_id):
+        if key_id is not None:
+            return access_url, expires_at, is_trial
+    return None
+
+
+async def has_used_trial(user_id: int) -> bool:
+    rows = await get_key_rows(user_id)
+    return any(row[0] == 1 for row in rows)
 
 
 async def has_vpn_history(user_id: int) -> bool:
     """Return True if the user ever had VPN access."""
-    async with get_connection() as conn:
-        cursor = await conn.execute(
-            "SELECT 1 FROM vpn_access WHERE user_id=?",
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        return row is not None
+    return bool(await get_key_rows(user_id))
 
 
 async def record_referral(user_id: int, referrer_id: int) -> bool:
@@ -154,36 +696,33 @@ async def record_referral(user_id: int, referrer_id: int) -> bool:
             return True
         except aiosqlite.IntegrityError:
             return False
+
+
 async def get_key_info(user_id: int):
     """Return key_id, access_url, expires_at, is_trial for the user if any."""
-    async with get_connection() as conn:
-        cursor = await conn.execute(
-            "SELECT key_id, access_url, expires_at, is_trial FROM vpn_access "
-            "WHERE user_id=? AND key_id IS NOT NULL",
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        return row
+    for is_trial, key_id, access_url, expires_at, _ in await get_key_rows(user_id):
+        if key_id is not None:
+            return key_id, access_url, expires_at, is_trial
+    return None
 
 
 async def update_expiration(user_id: int, is_trial: bool, expires_at: int) -> None:
     """Update the expiration time for the user's key."""
-    async with get_connection() as conn:
-        await conn.execute(
-            "UPDATE vpn_access SET expires_at=? WHERE user_id=? AND is_trial=?",
-            (expires_at, user_id, int(is_trial)),
-        )
-        if is_trial:
-            await conn.execute(
-                "UPDATE users SET expires_at=?, is_trial=1, is_paid=0 WHERE user_id=?",
-                (expires_at, user_id),
-            )
-        else:
-            await conn.execute(
-                "UPDATE users SET expires_at=?, is_trial=0, is_paid=1 WHERE user_id=?",
-                (expires_at, user_id),
-            )
-        await conn.commit()
+    if is_trial:
+        users_sql = "UPDATE users SET expires_at=?, is_trial=1, is_paid=0 WHERE user_id=?"
+    else:
+        users_sql = "UPDATE users SET expires_at=?, is_trial=0, is_paid=1 WHERE user_id=?"
+    await _write(
+        [
+            (
+                "execute",
+                "UPDATE vpn_access SET expires_at=? WHERE user_id=? AND is_trial=?",
+                (expires_at, user_id, int(is_trial)),
+            ),
+            ("execute", users_sql, (expires_at, user_id)),
+        ],
+        user_id,
+    )
 
 
 async def get_last_notification(user_id: int) -> int | None:
@@ -199,55 +738,474 @@ async def get_last_notification(user_id: int) -> int | None:
 
 
 async def set_last_notification(user_id: int, ts: int) -> None:
+    await _write(
+        [
+            (
+                "execute",
+                "INSERT OR REPLACE INTO notifications (user_id, last_notified_at) VALUES (?, ?)",
+                (user_id, ts),
+            )
+        ]
+    )
+
+
+async def set_last_notifications(user_ids: list[int], ts: int) -> None:
+    """Store the same notification timestamp for many users at once."""
+    if not user_ids:
+        return
+    await _write(
+        [
+            (
+                "executemany",
+                "INSERT OR REPLACE INTO notifications (user_id, last_notified_at) VALUES (?, ?)",
+                [(user_id, ts) for user_id in user_ids],
+            )
+        ]
+    )
+
+
+async def get_due_notifications(now: int):
+    """Return ``(user_id, expires_at, days_left)`` for keys due a reminder.
+
+    A key is due when it expires in exactly three days or has already
+    expired, and its owner was not notified during the last 24 hours.
+    ``days_left`` is rounded up to whole days like ``ceil`` would.
+    """
     async with get_connection() as conn:
-        await conn.execute(
-            "INSERT OR REPLACE INTO notifications (user_id, last_notified_at) VALUES (?, ?)",
-            (user_id, ts),
+        cursor = await conn.execute(
+            """
+            SELECT v.user_id, v.expires_at,
+                CASE WHEN v.expires_at - :now + 86399 >= 0
+                    THEN (v.expires_at - :now + 86399) / 86400
+                    ELSE -((:now - v.expires_at) / 86400)
+                END AS days_left
+            FROM vpn_access AS v
+            LEFT JOIN notifications AS n ON n.user_id = v.user_id
+            WHERE v.key_id IS NOT NULL
+                AND (
+                    v.expires_at <= :now
+                    OR (v.expires_at > :now + 2 * 86400 AND v.expires_at <= :now + 3 * 86400)
+                )
+                AND (
+                    n.last_notified_at IS NULL
+                    OR n.last_notified_at = 0
+                    OR n.last_notified_at <= :now - 86400
+                )
+            """,
+            {"now": now},
         )
+        return await cursor.fetchall()
+
+
+async def add_pool_keys(keys: list[tuple[int, str, str | None]]) -> None:
+    """Store unassigned ``(key_id, access_url, server)`` keys in the warm pool."""
+    if not keys:
+        return
+    now = int(time.time())
+    await _write(
+        [
+            (
+                "executemany",
+                "INSERT INTO key_pool (key_id, access_url, server, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(key_id, access_url, server, now) for key_id, access_url, server in keys],
+            )
+        ]
+    )
+
+
+async def claim_pool_key():
+    """Atomically take the oldest pooled key as ``(key_id, access_url, server)``."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "DELETE FROM key_pool WHERE id = (SELECT MIN(id) FROM key_pool) "
+            "RETURNING key_id, access_url, server"
+        )
+        row = await cursor.fetchone()
         await conn.commit()
+        return row
 
 
-async def save_user(user_id: int, username: str | None) -> None:
-    """Ensure the user record exists and update the username."""
+async def count_pool_keys() -> int:
     async with get_connection() as conn:
-        await conn.execute(
+        cursor = await conn.execute("SELECT COUNT(*) FROM key_pool")
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def remove_pool_keys(server: str) -> list[int]:
+    """Remove the pooled keys of ``server`` and return their ids."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "DELETE FROM key_pool WHERE server=? RETURNING key_id", (server,)
+        )
+        rows = await cursor.fetchall()
+        await conn.commit()
+        return [row[0] for row in rows]
+
+
+async def get_pool_key_ids(server: str) -> list[int]:
+    """Return the ids of the pooled keys on ``server``."""
+    async with get_connection() as conn:
+        cursor = await conn.execute("SELECT key_id FROM key_pool WHERE server=?", (server,))
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def count_keys_by_server() -> dict[str | None, int]:
+    """Return the number of assigned and pooled keys on each server."""
+    counts: dict[str | None, int] = {}
+    async with get_connection() as conn:
+        for sql in (
+            "SELECT server, COUNT(*) FROM vpn_access WHERE key_id IS NOT NULL GROUP BY server",
+            "SELECT server, COUNT(*) FROM key_pool GROUP BY server",
+        ):
+            cursor = await conn.execute(sql)
+            for server, count in await cursor.fetchall():
+                counts[server] = counts.get(server, 0) + count
+    return counts
+
+
+async def assign_default_server(server: str) -> None:
+    """Record ``server`` for keys stored before servers were tracked."""
+    await flush_writes()
+    async with get_connection() as conn:
+        await conn.execute("UPDATE vpn_access SET server=? WHERE server IS NULL", (server,))
+        await conn.execute("UPDATE key_pool SET server=? WHERE server IS NULL", (server,))
+        await conn.commit()
+    key_cache.clear()
+
+
+async def get_server_keys(server: str, after_key_id=None, limit: int = 100):
+    """Return ``(user_id, is_trial, key_id, expires_at)`` of keys on ``server``
+    ordered by key id, starting after ``after_key_id``."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT user_id, is_trial, key_id, expires_at FROM vpn_access "
+            "WHERE server=? AND key_id > ? ORDER BY key_id LIMIT ?",
+            (server, -1 if after_key_id is None else after_key_id, limit),
+        )
+        return await cursor.fetchall()
+
+
+async def move_key(
+    user_id: int,
+    is_trial: bool,
+    key_id: int,
+    new_key_id: int,
+    access_url: str,
+    server: str,
+) -> bool:
+    """Replace the user's ``key_id`` with a key on ``server``.
+
+    Returns ``False`` if the row no longer holds ``key_id``.
+    """
+    await flush_writes()
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "UPDATE vpn_access SET key_id=?, access_url=?, server=? "
+            "WHERE user_id=? AND is_trial=? AND key_id=?",
+            (new_key_id, access_url, server, user_id, int(is_trial), key_id),
+        )
+        await conn.commit()
+        moved = cursor.rowcount > 0
+    key_cache.invalidate(user_id)
+    return moved
+
+
+async def store_traffic(server: str, usage: dict, updated_at: int) -> None:
+    """Replace the stored 30 day transfer of every key on ``server``.
+
+    ``usage`` maps key ids to bytes; keys missing from it are dropped.
+    """
+    await _write(
+        [
+            (
+                "executemany",
+                "INSERT INTO key_traffic (server, key_id, bytes, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(server, key_id) DO UPDATE SET "
+                "bytes=excluded.bytes, updated_at=excluded.updated_at",
+                [(server, key_id, used, updated_at) for key_id, used in usage.items()],
+            ),
+            (
+                "execute",
+                "DELETE FROM key_traffic WHERE server=? AND updated_at < ?",
+                (server, updated_at),
+            ),
+            (
+                "execute",
+                "INSERT OR REPLACE INTO server_traffic (server, bytes, updated_at) "
+                "VALUES (?, ?, ?)",
+                (server, sum(usage.values()), updated_at),
+            ),
+        ]
+    )
+
+
+async def get_key_usage(user_id: int) -> int | None:
+    """Return the bytes transferred by the user's active key, if polled."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
             """
-            INSERT INTO users (user_id, username, is_trial, is_paid, created_at, expires_at)
-            VALUES (?, ?, 0, 0, NULL, NULL)
-            ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
+            SELECT t.bytes FROM vpn_access AS v
+            JOIN key_traffic AS t ON t.server = v.server AND t.key_id = v.key_id
+            WHERE v.user_id = ? AND v.key_id IS NOT NULL
+            ORDER BY v.is_trial LIMIT 1
             """,
-            (user_id, username),
+            (user_id,),
         )
-        await conn.commit()
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+
+async def get_top_traffic(limit: int = 10):
+    """Return ``(user_id, username, server, key_id, bytes)`` of the keys with
+    the most transfer; ``user_id`` is ``None`` for keys without an owner."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            """
+            SELECT v.user_id, u.username, t.server, t.key_id, t.bytes
+            FROM key_traffic AS t
+            LEFT JOIN vpn_access AS v ON v.server = t.server AND v.key_id = t.key_id
+            LEFT JOIN users AS u ON u.user_id = v.user_id
+            ORDER BY t.bytes DESC LIMIT ?
+            """,
+            (limit,),
+        )
+        return await cursor.fetchall()
+
+
+async def get_server_traffic() -> dict[str, int]:
+    """Return the total bytes last polled from each server."""
+    async with get_connection() as conn:
+        cursor = await conn.execute("SELECT server, bytes FROM server_traffic")
+        return dict(await cursor.fetchall())
+
+
+async def add_pending_deletion(chat_id: int, message_id: int, delete_at: int) -> None:
+    """Remember a message that must be deleted at ``delete_at``."""
+    await _write(
+        [
+            (
+                "execute",
+                "INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, delete_at) "
+                "VALUES (?, ?, ?)",
+                (chat_id, message_id, delete_at),
+            )
+        ]
+    )
+
+
+async def remove_pending_deletions(messages: list[tuple[int, int]]) -> None:
+    """Forget deleted ``(chat_id, message_id)`` messages."""
+    if not messages:
+        return
+    await _write(
+        [
+            (
+                "executemany",
+                "DELETE FROM pending_deletions WHERE chat_id=? AND message_id=?",
+                messages,
+            )
+        ]
+    )
+
+
+async def get_pending_deletions():
+    """Return ``(chat_id, message_id, delete_at)`` of messages to delete."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT chat_id, message_id, delete_at FROM pending_deletions "
+            "ORDER BY delete_at"
+        )
+        return await cursor.fetchall()
+
+
+async def save_user(user_id: int, username: str | None) -> None:
+    """Ensure the user record exists and update the username."""
+    await _write(
+        [
+            (
+                "execute",
+                """
+                INSERT INTO users (user_id, username, is_trial, is_paid, created_at, expires_at)
+                VALUES (?, ?, 0, 0, NULL, NULL)
+                ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
+                """,
+                (user_id, username),
+            )
+        ]
+    )
 
 
 async def get_all_users(offset: int = 0, limit: int = 20):
-    """Return a list of users with basic subscription info."""
+    """Return a list of users with basic subscription info.
+
+    Deep offsets are slow; use :func:`get_users_page` to page through users.
+    """
     async with get_connection() as conn:
         cursor = await conn.execute(
             "SELECT user_id, username, is_trial, is_paid, created_at, expires_at "
-            "FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            "FROM users ORDER BY COALESCE(created_at, 0) DESC, user_id DESC "
+            "LIMIT ? OFFSET ?",
             (limit, offset),
         )
         rows = await cursor.fetchall()
         return rows
 
 
-async def get_users_stats():
-    """Return aggregate statistics about users."""
+def user_cursor(row) -> tuple[int, int]:
+    """Return the ``(created_at, user_id)`` page cursor of a user row."""
+    return row[4] or 0, row[0]
+
+
+async def get_users_page(
+    cursor: tuple[int, int] | None = None, limit: int = 20, before: bool = False
+):
+    """Return one page of users, newest first, using keyset pagination.
+
+    ``cursor`` is the :func:`user_cursor` of the row the page continues
+    after, or precedes when ``before`` is true. Users without ``created_at``
+    sort last. Returns ``(rows, prev_cursor, next_cursor)`` where a cursor is
+    ``None`` if there is no page in that direction.
+    """
+    columns = "user_id, username, is_trial, is_paid, created_at, expires_at"
+    if cursor is None:
+        sql = (
+            f"SELECT {columns} FROM users "
+            "ORDER BY COALESCE(created_at, 0) DESC, user_id DESC LIMIT ?"
+        )
+        params: tuple = (limit + 1,)
+    elif before:
+        sql = (
+            f"SELECT {columns} FROM users "
+            "WHERE COALESCE(created_at, 0) >= :created "
+            "AND (COALESCE(created_at, 0) > :created OR user_id > :user_id) "
+            "ORDER BY COALESCE(created_at, 0), user_id LIMIT :limit"
+        )
+        params = {"created": cursor[0], "user_id": cursor[1], "limit": limit + 1}
+    else:
+        sql = (
+            f"SELECT {columns} FROM users "
+            "WHERE COALESCE(created_at, 0) <= :created "
+            "AND (COALESCE(created_at, 0) < :created OR user_id < :user_id) "
+            "ORDER BY COALESCE(created_at, 0) DESC, user_id DESC LIMIT :limit"
+        )
+        params = {"created": cursor[0], "user_id": cursor[1], "limit": limit + 1}
+    async with get_connection() as conn:
+        result = await conn.execute(sql, params)
+        rows = await result.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+    has_prev = more if before else cursor is not None
+    has_next = cursor is not None if before else more
+    prev_cursor = user_cursor(rows[0]) if has_prev else None
+    next_cursor = user_cursor(rows[-1]) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+async def get_user_ids(after_user_id: int | None = None, limit: int = 500) -> list[int]:
+    """Return up to ``limit`` user ids in ascending order after ``after_user_id``."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (-1 if after_user_id is None else after_user_id, limit),
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def create_broadcast(admin_id: int, text: str) -> int:
+    """Store a new running broadcast and return its id."""
     now = int(time.time())
     async with get_connection() as conn:
         cursor = await conn.execute(
-            "SELECT "
-            "COUNT(*) as total, "
-            "COALESCE(SUM(CASE WHEN expires_at > ? THEN 1 ELSE 0 END), 0) as active, "
-            "COALESCE(SUM(CASE WHEN is_trial=1 AND expires_at > ? THEN 1 ELSE 0 END), 0) as trial, "
-            "COALESCE(SUM(CASE WHEN is_paid=1 AND expires_at > ? THEN 1 ELSE 0 END), 0) as paid, "
-            "COALESCE(SUM(CASE WHEN expires_at <= ? THEN 1 ELSE 0 END), 0) as expired "
-            "FROM users",
-            (now, now, now, now),
+            "INSERT INTO broadcasts "
+            "(admin_id, text, last_user_id, sent, failed, status, created_at, updated_at) "
+            "VALUES (?, ?, NULL, 0, 0, 'running', ?, ?)",
+            (admin_id, text, now, now),
+        )
+        await conn.commit()
+        return cursor.lastrowid
+
+
+async def update_broadcast(
+    broadcast_id: int,
+    last_user_id: int | None,
+    sent: int,
+    failed: int,
+    status: str = "running",
+) -> None:
+    """Checkpoint a broadcast: every user up to ``last_user_id`` is done."""
+    async with get_connection() as conn:
+        await conn.execute(
+            "UPDATE broadcasts SET last_user_id=?, sent=?, failed=?, status=?, updated_at=? "
+            "WHERE id=?",
+            (last_user_id, sent, failed, status, int(time.time()), broadcast_id),
+        )
+        await conn.commit()
+
+
+async def get_running_broadcasts():
+    """Return ``(id, admin_id, text, last_user_id, sent, failed)`` of
+    broadcasts that were interrupted before finishing."""
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT id, admin_id, text, last_user_id, sent, failed FROM broadcasts "
+            "WHERE status='running' ORDER BY id"
+        )
+        return await cursor.fetchall()
+
+
+async def refresh_users_stats(now: int | None = None) -> None:
+    """Move users whose keys expired since the last refresh to ``expired``.
+
+    Only rows with ``expires_at`` between the stored watermark and ``now``
+    are read, so the cost depends on how many keys expired meanwhile.
+    """
+    if now is None:
+        now = int(time.time())
+    async with get_connection() as conn:
+        await conn.execute(
+            """
+            UPDATE users_stats SET
+                active = active - d.n,
+                trial = trial - d.t,
+                paid = paid - d.p,
+                expired = expired + d.n,
+                as_of = :now
+            FROM (
+                SELECT COUNT(*) AS n,
+                    COALESCE(SUM(is_trial = 1), 0) AS t,
+                    COALESCE(SUM(is_paid = 1), 0) AS p
+                FROM users
+                WHERE expires_at > (SELECT as_of FROM users_stats WHERE id = 1)
+                    AND expires_at <= :now
+            ) AS d
+            WHERE id = 1 AND as_of < :now
+            """,
+            {"now": now},
+        )
+        await conn.commit()
+
+
+async def get_users_stats():
+    """Return aggregate statistics about users.
+
+    Counters are maintained incrementally and are current as of the last
+    :func:`refresh_users_stats` call.
+    """
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT total, active, trial, paid, expired FROM users_stats WHERE id = 1"
         )
         row = await cursor.fetchone()
         if row:
             return row
         return (0, 0, 0, 0, 0)
+
+
+# Time every public database function (see metrics.py)
+instrument(globals(), DB_METRICS)
@@ -0,0 +1,155 @@
+"""Warm pool of pre-created Outline keys for instant issuance."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+from db import add_pool_keys, claim_pool_key, count_pool_keys
+
+# Refill the pool once it holds fewer unassigned keys than this
+KEY_POOL_LOW = int(os.getenv("KEY_POOL_LOW", "0"))
+
+# Number of unassigned keys a refill tops the pool up to (0 disables the pool)
+KEY_POOL_HIGH = int(os.getenv("KEY_POOL_HIGH", "0"))
+
+# Seconds between pool depth checks when no key has been claimed
+KEY_POOL_INTERVAL = int(os.getenv("KEY_POOL_INTERVAL", "60"))
+
+# Maximum number of keys created concurrently during a refill
+KEY_POOL_CONCURRENCY = 5
+
+# Name given to pooled keys until they are assigned to a user
+POOL_KEY_NAME = "pool"
+
+
+class KeyPool:
+    """Unassigned Outline keys stored in ``key_pool``.
+
+    ``claim`` takes a key without contacting the Outline server and renames
+    it in the background. A background loop refills the pool up to ``high``
+    keys whenever it drops below ``low``.
+    """
+
+    def __init__(
+        self,
+        create: Callable[[str], Awaitable[dict]],
+        rename: Callable[[object, str, str | None], Awaitable[None]],
+        low: int = KEY_POOL_LOW,
+        high: int = KEY_POOL_HIGH,
+        concurrency: int = KEY_POOL_CONCURRENCY,
+    ) -> None:
+        self.create = create
+        self.rename = rename
+        self.low = low
+        self.high = high
+        self.concurrency = concurrency
+        self.depth: int | None = None
+        self.claims = 0
+        self.misses = 0
+        self.refills = 0
+        self.created = 0
+        self.failed = 0
+        self.refill_rate = 0.0
+        self._wakeup = asyncio.Event()
+        self._renames: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.high > 0
+
+    async def claim(self, name: str | None = None) -> dict | None:
+        """Take the oldest pooled key, or return ``None`` if the pool is empty."""
+        row = await claim_pool_key()
+        if row is None:
+            self.misses += 1
+            self.depth = 0
+            self._wakeup.set()
+            return None
+        self.claims += 1
+        if self.depth:
+            self.depth -= 1
+        if self.depth is None or self.depth < self.low:
+            self._wakeup.set()
+        key_id, access_url, server = row
+        if name:
+            task = asyncio.create_task(self._rename(key_id, name, server))
+            self._renames.add(task)
+            task.add_done_callback(self._renames.discard)
+        return {
+            "id": key_id,
+            "accessUrl": access_url,
+            "name": name or POOL_KEY_NAME,
+            "server": server,
+        }
+
+    async def _rename(self, key_id, name: str, server: str | None) -> None:
+        try:
+            await self.rename(key_id, name, server)
+        except Exception as exc:
+            logging.error("Failed to rename pooled key %s: %s", key_id, exc)
+
+    async def _create_one(self, limit: asyncio.Semaphore) -> bool:
+        """Create one key and store it before the next create starts."""
+        async with limit:
+            try:
+                key = await self.create(POOL_KEY_NAME)
+            except Exception as exc:
+                logging.error("Failed to create pooled key: %s", exc)
+                return False
+            # Stored at once so that a cancelled refill leaks no created keys
+            try:
+                await add_pool_keys([(key.get("id"), key.get("accessUrl"), key.get("server"))])
+            except Exception as exc:
+                logging.error("Failed to store pooled key %s: %s", key.get("id"), exc)
+                return False
+            return True
+
+    async def refill(self) -> int:
+        """Top the pool up to ``high`` keys if it is below ``low``."""
+        self.depth = await count_pool_keys()
+        if self.depth >= self.low and self.depth > 0:
+            return 0
+        missing = self.high - self.depth
+        if missing <= 0:
+            return 0
+        started = time.perf_counter()
+        limit = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._create_one(limit) for _ in range(missing)))
+        added = sum(results)
+        elapsed = time.perf_counter() - started
+        self.refills += 1
+        self.created += added
+        self.failed += missing - added
+        self.refill_rate = added / elapsed if elapsed > 0 else 0.0
+        self.depth += added
+        logging.info("Added %s keys to the pool in %.2fs (depth %s)", added, elapsed, self.depth)
+        return added
+
+    async def run(self, interval: int = KEY_POOL_INTERVAL) -> None:
+        """Refill the pool when it runs low or every ``interval`` seconds."""
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.refill()
+            except Exception as exc:
+                logging.error("Failed to refill key pool: %s", exc)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "low": self.low,
+            "high": self.high,
+            "depth": self.depth,
+            "claims": self.claims,
+            "misses": self.misses,
+            "refills": self.refills,
+            "created": self.created,
+            "failed": self.failed,
+            "refill_rate": self.refill_rate,
+        }
@@ -0,0 +1,256 @@
+"""Latency and error metrics exported in the Prometheus text format.
+
+Update handlers are timed by a dispatcher middleware, database functions by
+wrapping the public coroutines of ``db.py`` once at import, and Outline
+requests reuse the histograms the clients already keep. Recording a call
+costs two clock reads, a bucket increment and a trace lookup, so metrics stay
+on all the time; the HTTP exporter only runs when ``METRICS_PORT`` is set.
+"""
+
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+from tracing import add_span
+
+# Local port serving /metrics, 0 disables the exporter
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Bucket bounds (seconds) for handlers and database calls
+FAST_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class Timer:
+    """Latency counts of one label value."""
+
+    __slots__ = ("buckets", "counts", "count", "total", "errors")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+
+class Latency:
+    """A latency histogram and error counter labelled by one name.
+
+    Exported as ``<name>_seconds`` and ``<name>_errors_total``. Calls timed
+    with :func:`timed` also add a ``<span>.<label>`` span to the update trace;
+    a call made from inside another call of the same family is not timed, so
+    each outer call is counted once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str,
+        buckets: tuple[float, ...] = FAST_BUCKETS,
+        span: str | None = None,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.span = span
+        self.children: dict[str, Timer] = {}
+        self.active: contextvars.ContextVar[bool] = contextvars.ContextVar(
+            f"{name}_active", default=False
+        )
+
+    def child(self, value: str) -> Timer:
+        timer = self.children.get(value)
+        if timer is None:
+            timer = self.children[value] = Timer(self.buckets)
+        return timer
+
+    def render(self) -> list[str]:
+        return render_latency(
+            self.name,
+            self.help,
+            {((self.label, value),): timer for value, timer in self.children.items()},
+        )
+
+
+HANDLERS = Latency("bot_handler", "Time spent handling updates.", "handler", span="handler")
+DB = Latency("bot_db", "Time spent in database functions.", "function", span="db")
+
+# name -> (help, type, callable returning the current value)
+_gauges: dict[str, tuple[str, str, Callable[[], float]]] = {}
+
+
+def _labels(pairs) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in pairs)
+
+
+def render_latency(name: str, help: str, timers: dict) -> list[str]:
+    """Render histograms given as ``{((label, value), ...): histogram}``.
+
+    Any object with ``buckets``, ``counts``, ``count``, ``total`` and
+    ``errors`` attributes can be rendered.
+    """
+    lines = [f"# HELP {name}_seconds {help}", f"# TYPE {name}_seconds histogram"]
+    for pairs, timer in timers.items():
+        labels = _labels(pairs)
+        cumulative = 0
+        for bound, count in zip(timer.buckets, timer.counts):
+            cumulative += count
+            lines.append(f'{name}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_seconds_bucket{{{labels},le="+Inf"}} {timer.count}')
+        lines.append(f"{name}_seconds_sum{{{labels}}} {timer.total}")
+        lines.append(f"{name}_seconds_count{{{labels}}} {timer.count}")
+    lines.append(f"# HELP {name}_errors_total Calls that raised.")
+    lines.append(f"# TYPE {name}_errors_total counter")
+    for pairs, timer in timers.items():
+        lines.append(f"{name}_errors_total{{{_labels(pairs)}}} {timer.errors}")
+    return lines
+
+
+def timed(family: Latency, label: str):
+    """Decorate a coroutine function to record its latency in ``family``."""
+
+    def decorator(func):
+        timer = family.child(label)
+        span = f"{family.span}.{label}" if family.span else None
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if family.active.get():
+                # Already counted by the outer call
+                return await func(*args, **kwargs)
+            token = family.active.set(True)
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                elapsed = time.perf_counter() - started
+                timer.observe(elapsed, error=True)
+                if span:
+                    add_span(span, started, elapsed, True)
+                raise
+            finally:
+                family.active.reset(token)
+            elapsed = time.perf_counter() - started
+            timer.observe(elapsed)
+            if span:
+                add_span(span, started, elapsed)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def instrument(namespace: dict, family: Latency) -> int:
+    """Wrap the public coroutine functions defined in a module's namespace.
+
+    Call it at the end of the module with ``globals()`` so that the module's
+    own calls and later ``from module import name`` imports are timed too.
+    """
+    module = namespace["__name__"]
+    wrapped = 0
+    for name, func in list(namespace.items()):
+        if (
+            not name.startswith("_")
+            and inspect.iscoroutinefunction(func)
+            and func.__module__ == module
+        ):
+            namespace[name] = timed(family, name)(func)
+            wrapped += 1
+    return wrapped
+
+
+class HandlerMetrics:
+    """Inner middleware timing the handler chosen for each event.
+
+    A plain callable rather than an aiogram ``BaseMiddleware`` so ``db.py``
+    can import this module without loading aiogram.
+    """
+
+    async def __call__(self, handler, event, data):
+        callback = getattr(data.get("handler"), "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        timer = HANDLERS.child(name)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            timer.observe(elapsed, error=True)
+            add_span(f"handler.{name}", started, elapsed, True)
+            raise
+        elapsed = time.perf_counter() - started
+        timer.observe(elapsed)
+        add_span(f"handler.{name}", started, elapsed)
+        return result
+
+
+def instrument_dispatcher(dispatcher) -> None:
+    """Time the handlers of ``dispatcher`` and of every router included in it."""
+    middleware = HandlerMetrics()
+    for event, observer in dispatcher.observers.items():
+        if event not in ("update", "error"):
+            observer.middleware(middleware)
+
+
+def add_gauge(name: str, help: str, value: Callable[[], float], kind: str = "gauge") -> None:
+    """Export ``value()`` as ``name`` on every scrape."""
+    _gauges[name] = (help, kind, value)
+
+
+def _outline_lines() -> list[str]:
+    # Imported here so that db.py can use this module without loading aiohttp
+    from outline_api.client import outline_latencies
+
+    timers = {
+        (("server", urlsplit(url).netloc), ("op", op)): histogram
+        for (url, op), histogram in outline_latencies().items()
+    }
+    return render_latency("bot_outline", "Time spent in Outline API requests.", timers)
+
+
+def render() -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    lines = HANDLERS.render() + DB.render() + _outline_lines()
+    for name, (help, kind, value) in _gauges.items():
+        try:
+            current = value()
+        except Exception as exc:
+            logging.error("Failed to read metric %s: %s", name, exc)
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {current}"]
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Serve ``/metrics`` on ``host:port`` and return the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on %s:%s", host, port)
+    return runner
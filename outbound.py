@@ -0,0 +1,205 @@
+"""Pacing of outgoing Telegram messages.
+
+Telegram accepts about 30 messages per second from a bot and about one per
+second in a single chat, and answers faster senders with 429 errors. The
+:class:`OutboundLimiter` request middleware holds every sending method until
+both limits allow it, serves interactive replies before bulk traffic and
+waits out ``retry_after`` instead of losing the message. Code that sends in
+bulk marks its messages with :func:`bulk`::
+
+    with bulk():
+        await bot.send_message(user_id, text)
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from tracing import add_span
+
+# Messages per second sent by the bot in total
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+
+# Messages per second sent to one chat, and the burst allowed on top
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+# Times a message is resent after Telegram asked to retry later
+TELEGRAM_MAX_RETRIES = 3
+
+# Lanes, served in this order
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Window over which the send rate is reported (seconds)
+RATE_WINDOW = 10
+
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("outbound_lane", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk():
+    """Send the messages of the enclosed code through the bulk lane."""
+    token = _lane.set(BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def is_paced(method) -> bool:
+    """Return True for methods that post messages to a chat."""
+    return type(method).__name__.startswith(("Send", "Copy", "Forward"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Take a token, returning how long to wait until it is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Session middleware pacing messages globally, per chat and by lane."""
+
+    def __init__(
+        self,
+        rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: int = TELEGRAM_CHAT_BURST,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+    ) -> None:
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate, 1)
+        self._chats: dict = {}
+        self._waiting = {INTERACTIVE: collections.deque(), BULK: collections.deque()}
+        self._pump: asyncio.Task | None = None
+        self._paused_until = 0.0
+        self._recent: collections.deque[float] = collections.deque()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def __call__(self, make_request, bot, method):
+        # The span includes the time spent waiting for the limits
+        started = time.perf_counter()
+        error = True
+        try:
+            result = await self._send(make_request, bot, method)
+            error = False
+            return result
+        finally:
+            add_span(
+                f"telegram.{type(method).__name__}",
+                started,
+                time.perf_counter() - started,
+                error,
+            )
+
+    async def _send(self, make_request, bot, method):
+        if not is_paced(method):
+            return await make_request(bot, method)
+        lane = _lane.get()
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self._chat_turn(chat_id)
+            await self._global_turn(lane)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                self.retried += 1
+                # Flood control applies to the whole bot, so everyone waits
+                self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                attempt += 1
+                logging.warning("Telegram asked to retry in %ss", exc.retry_after)
+                continue
+            self._record_sent()
+            return result
+
+    async def _chat_turn(self, chat_id) -> None:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        delay = bucket.delay()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _prune_chats(self) -> None:
+        now = time.monotonic()
+        full = (self.chat_burst - 1) / self.chat_rate
+        self._chats = {
+            chat_id: bucket
+            for chat_id, bucket in self._chats.items()
+            if now - bucket.updated < full
+        }
+
+    async def _global_turn(self, lane: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[lane].append(future)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self) -> None:
+        """Release waiting messages at the global rate, interactive first."""
+        while True:
+            lane = next((lane for lane, queue in self._waiting.items() if queue), None)
+            if lane is None:
+                return
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            delay = self._global.delay()
+            if delay:
+                await asyncio.sleep(delay)
+            # Pick again: an interactive message may have arrived meanwhile
+            lane = next((lane for lane, queue in self._waiting.items() if queue), None)
+            if lane is None:
+                return
+            future = self._waiting[lane].popleft()
+            if not future.done():
+                future.set_result(None)
+
+    def _record_sent(self) -> None:
+        now = time.monotonic()
+        self.sent += 1
+        self._recent.append(now)
+        while self._recent and now - self._recent[0] > RATE_WINDOW:
+            self._recent.popleft()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        recent = sum(1 for sent_at in self._recent if now - sent_at <= RATE_WINDOW)
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "backlog": {lane: len(queue) for lane, queue in self._waiting.items()},
+            "per_second": recent / RATE_WINDOW,
+        }
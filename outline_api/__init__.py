@@ -1,31 +1,79 @@
-import aiohttp
 import os
 import importlib.metadata
 import importlib.util
 import sys
 
-# Load original installed package modules under the canonical names
-_dist = importlib.metadata.distribution('outline_api')
-_pkg_path = _dist.locate_file('outline_api')
-
-# Load dependency modules first so that outline_api.py can import them
-for name in ['errors.py', 'prometheus.py', 'outline_api.py']:
-    spec = importlib.util.spec_from_file_location(f'outline_api.{name[:-3]}', _pkg_path / name)
-    mod = importlib.util.module_from_spec(spec)
-    sys.modules[f'outline_api.{name[:-3]}'] = mod
-    spec.loader.exec_module(mod)
-
-# Load the original __init__ under a temporary name to access its attributes
-spec_init = importlib.util.spec_from_file_location(
-    'outline_api._orig_init', _pkg_path / '__init__.py', submodule_search_locations=[str(_pkg_path)]
-)
-_orig = importlib.util.module_from_spec(spec_init)
-sys.modules['outline_api._orig_init'] = _orig
-spec_init.loader.exec_module(_orig)
-
-__all__ = list(getattr(_orig, '__all__', [])) + ['create_named_key']
-for name in getattr(_orig, '__all__', []):
-    globals()[name] = getattr(_orig, name)
+from .client import OutlineAPIError, OutlineClient, close_clients, get_client, outline_stats
+from .resilience import CircuitOpenError
+
+# Names re-exported from the installed outline_api package
+_UPSTREAM_NAMES = [
+    'Manager',
+    'get_key_numbers',
+    'get_created_key_numbers',
+    'get_active_keys',
+    'get_active_keys_list',
+    'get_key_datatransfer',
+    'get_server_datatransfer',
+    'get_server_datatransfer_history',
+    'get_active_keys_history',
+]
+
+# Modules of the installed package, in dependency order
+_UPSTREAM_MODULES = ['errors', 'prometheus', 'outline_api']
+
+_orig = None
+
+
+def _load_upstream():
+    """Load the installed package modules under the canonical names.
+
+    This pulls in ``requests`` and scans the installed distributions, so it
+    only happens on first use of an upstream name.
+    """
+    global _orig
+    if _orig is not None:
+        return _orig
+    _dist = importlib.metadata.distribution('outline_api')
+    _pkg_path = _dist.locate_file('outline_api')
+
+    # Load dependency modules first so that outline_api.py can import them
+    for name in _UPSTREAM_MODULES:
+        spec = importlib.util.spec_from_file_location(f'outline_api.{name}', _pkg_path / f'{name}.py')
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[f'outline_api.{name}'] = mod
+        spec.loader.exec_module(mod)
+        globals()[name] = mod
+
+    # Load the original __init__ under a temporary name to access its attributes
+    spec_init = importlib.util.spec_from_file_location(
+        'outline_api._orig_init', _pkg_path / '__init__.py', submodule_search_locations=[str(_pkg_path)]
+    )
+    orig = importlib.util.module_from_spec(spec_init)
+    sys.modules['outline_api._orig_init'] = orig
+    spec_init.loader.exec_module(orig)
+    for name in getattr(orig, '__all__', []):
+        globals()[name] = getattr(orig, name)
+    _orig = orig
+    return orig
+
+
+def __getattr__(name):
+    if name in _UPSTREAM_NAMES or name in _UPSTREAM_MODULES:
+        _load_upstream()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+__all__ = _UPSTREAM_NAMES + [
+    'create_named_key',
+    'OutlineAPIError',
+    'OutlineClient',
+    'close_clients',
+    'get_client',
+    'outline_stats',
+    'CircuitOpenError',
+]
 
 OUTLINE_API_URL = os.getenv('OUTLINE_API_URL', '')
 OUTLINE_API_TOKEN = os.getenv('OUTLINE_API_TOKEN', '')
@@ -39,11 +87,5 @@ async def create_named_key(vpn_name: str) -> dict:
     """Create a key and set its name using Outline API."""
     if not OUTLINE_API_URL:
         raise RuntimeError('OUTLINE_API_URL not configured')
-    async with aiohttp.ClientSession(headers=_headers) as session:
-        async with session.post(f"{OUTLINE_API_URL}/access-keys") as response:
-            data = await response.json()
-            key_id = data['id']
-        payload = {'name': vpn_name}
-        async with session.patch(f"{OUTLINE_API_URL}/access-keys/{key_id}", json=payload) as r:
-            await r.text()
-        return {'id': key_id, 'name': vpn_name}
+    key = await get_client(OUTLINE_API_URL, headers=_headers).create_key(vpn_name)
+    return {'id': key['id'], 'name': vpn_name}
@@ -0,0 +1,220 @@
+"""Asynchronous client for the Outline server management API."""
+
+import asyncio
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from tracing import add_span
+
+from .resilience import (
+    OUTLINE_RETRIES,
+    OUTLINE_RETRY_DELAY,
+    CircuitBreaker,
+    LatencyHistogram,
+    is_failure,
+    is_retryable,
+    retry_budget,
+)
+
+# Maximum number of concurrent requests sent to one Outline server
+OUTLINE_MAX_CONCURRENCY = int(os.getenv("OUTLINE_MAX_CONCURRENCY", "10"))
+
+# Seconds before an Outline API request is abandoned
+OUTLINE_TIMEOUT = float(os.getenv("OUTLINE_TIMEOUT", "30"))
+
+
+class OutlineAPIError(Exception):
+    """Raised when the Outline server answers with an unexpected status."""
+
+    def __init__(self, status: int, message: str = "") -> None:
+        super().__init__(f"Outline API returned {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class OutlineClient:
+    """Outline management API client with one keep-alive session.
+
+    Outline servers use self-signed certificates, so TLS verification is
+    disabled like in the synchronous ``Manager``.
+
+    At most ``max_concurrency`` requests are in flight. Failed requests are
+    retried with jittered exponential backoff while the shared retry budget
+    allows, and a circuit breaker fails fast while the server is unhealthy.
+    Latencies are recorded per operation in ``latency``.
+    """
+
+    def __init__(
+        self,
+        apiurl: str,
+        max_concurrency: int = OUTLINE_MAX_CONCURRENCY,
+        timeout: float = OUTLINE_TIMEOUT,
+        headers: dict | None = None,
+        retries: int = OUTLINE_RETRIES,
+        retry_delay: float = OUTLINE_RETRY_DELAY,
+    ) -> None:
+        self.apiurl = apiurl.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._limit = asyncio.Semaphore(max_concurrency)
+        self._session: aiohttp.ClientSession | None = None
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.breaker = CircuitBreaker()
+        self.latency: dict[str, LatencyHistogram] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=False, limit=self.max_concurrency, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _send(self, method: str, path: str, expected: tuple[int, ...], json):
+        async with self._limit:
+            session = self._get_session()
+            async with session.request(method, self.apiurl + path, json=json) as resp:
+                if resp.status not in expected:
+                    raise OutlineAPIError(resp.status, await resp.text())
+                if resp.status == 204:
+                    return None
+                return await resp.json(content_type=None)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        expected: tuple[int, ...],
+        json: dict | None = None,
+        op: str | None = None,
+    ):
+        """Send an API request and return the decoded JSON body, if any.
+
+        Only idempotent methods are retried after the server may have acted
+        on the request; ``POST`` is retried on refused connections and
+        explicit 429/503 answers alone.
+        """
+        op = op or method.lower()
+        histogram = self.latency.setdefault(op, LatencyHistogram())
+        idempotent = method != "POST"
+        retry_budget.deposit()
+        attempt = 0
+        while True:
+            self.breaker.before()
+            started = time.perf_counter()
+            try:
+                result = await self._send(method, path, expected, json)
+            except Exception as exc:
+                elapsed = time.perf_counter() - started
+                histogram.observe(elapsed, error=True)
+                add_span(f"outline.{op}", started, elapsed, True)
+                if is_failure(exc):
+                    self.breaker.failure(exc)
+                else:
+                    # The server answered, so it is up even if it refused
+                    self.breaker.success()
+                if (
+                    attempt >= self.retries
+                    or not is_retryable(exc, idempotent)
+                    or not retry_budget.withdraw()
+                ):
+                    raise
+                attempt += 1
+                delay = random.uniform(0, self.retry_delay * 2**attempt)
+                logging.warning("Retrying Outline %s in %.2fs: %s", op, delay, exc)
+                await asyncio.sleep(delay)
+                continue
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed)
+            add_span(f"outline.{op}", started, elapsed)
+            self.breaker.success()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "rejected": self.breaker.rejected,
+            "latency": {op: h.stats() for op, h in self.latency.items()},
+        }
+
+    async def create_key(self, name: str | None = None) -> dict:
+        """Create an access key, naming it in the same request if possible."""
+        body = {"name": name} if name else {}
+        key = await self.request("POST", "/access-keys", (200, 201), body, op="create_key")
+        if name and key.get("name") != name:
+            # Older servers ignore the name sent on creation
+            try:
+                await self.rename_key(key["id"], name)
+                key["name"] = name
+            except Exception as exc:
+                logging.error("Failed to rename Outline key: %s", exc)
+        return key
+
+    async def rename_key(self, key_id, name: str) -> None:
+        await self.request(
+            "PUT", f"/access-keys/{key_id}/name", (204,), {"name": name}, op="rename_key"
+        )
+
+    async def delete_key(self, key_id) -> None:
+        await self.request("DELETE", f"/access-keys/{key_id}", (204,), op="delete_key")
+
+    async def list_keys(self) -> list[dict]:
+        data = await self.request("GET", "/access-keys", (200,), op="list_keys")
+        return data.get("accessKeys", [])
+
+    async def transfer_metrics(self) -> dict[str, int]:
+        """Return bytes transferred per key id over the last 30 days."""
+        data = await self.request("GET", "/metrics/transfer", (200,), op="transfer_metrics")
+        return data.get("bytesTransferredByUserId", {})
+
+
+_clients: dict[str, OutlineClient] = {}
+
+
+def get_client(apiurl: str, **kwargs) -> OutlineClient:
+    """Return the shared client for ``apiurl``, creating it on first use."""
+    client = _clients.get(apiurl)
+    if client is None:
+        client = _clients[apiurl] = OutlineClient(apiurl, **kwargs)
+    return client
+
+
+def outline_stats() -> dict:
+    """Return breaker state and latencies of every shared client."""
+    return {
+        "retries": retry_budget.retries,
+        "retry_budget_exhausted": retry_budget.exhausted,
+        "servers": {url: client.stats() for url, client in _clients.items()},
+    }
+
+
+def outline_latencies() -> dict[tuple[str, str], LatencyHistogram]:
+    """Return the latency histogram of every ``(url, op)`` of the shared clients."""
+    return {
+        (url, op): histogram
+        for url, client in _clients.items()
+        for op, histogram in client.latency.items()
+    }
+
+
+async def close_clients() -> None:
+    """Close the sessions of every shared client."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
@@ -0,0 +1,169 @@
+"""Failure handling for Outline API calls: retries, circuit breaker, latency."""
+
+import asyncio
+import bisect
+import os
+import time
+
+import aiohttp
+
+# Retries after the first attempt of a failed Outline request
+OUTLINE_RETRIES = int(os.getenv("OUTLINE_RETRIES", "2"))
+
+# Base delay of the exponential retry backoff (seconds)
+OUTLINE_RETRY_DELAY = float(os.getenv("OUTLINE_RETRY_DELAY", "0.2"))
+
+# Retries earned per request; caps retries at this share of all traffic
+OUTLINE_RETRY_RATIO = float(os.getenv("OUTLINE_RETRY_RATIO", "0.2"))
+
+# Consecutive failures that open a server's circuit
+OUTLINE_BREAKER_FAILURES = int(os.getenv("OUTLINE_BREAKER_FAILURES", "5"))
+
+# Seconds an open circuit fails fast before letting one probe through
+OUTLINE_BREAKER_RESET = float(os.getenv("OUTLINE_BREAKER_RESET", "30"))
+
+# Upper bounds of the latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Statuses that mean the server is overloaded or briefly unavailable
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without contacting a server whose circuit is open."""
+
+    def __init__(self, cause: Exception | None) -> None:
+        super().__init__(f"Outline server unavailable: {cause}")
+        self.cause = cause
+
+
+def is_failure(exc: Exception) -> bool:
+    """Return True if ``exc`` says the server is unhealthy."""
+    status = getattr(exc, "status", None)
+    if status is not None:
+        return status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def is_retryable(exc: Exception, idempotent: bool) -> bool:
+    """Return True if the request may be sent again after ``exc``.
+
+    Requests that create something are only repeated when the server
+    certainly did not act on them.
+    """
+    status = getattr(exc, "status", None)
+    if status is not None:
+        return status in RETRY_STATUSES if idempotent else status in (429, 503)
+    if isinstance(exc, aiohttp.ClientConnectorError):
+        return True
+    return idempotent and is_failure(exc)
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a share of all requests.
+
+    Every request deposits ``ratio`` tokens and every retry spends one, so a
+    failing server sees at most ``1 + ratio`` times its normal traffic.
+    """
+
+    def __init__(self, ratio: float = OUTLINE_RETRY_RATIO, minimum: float = 10.0) -> None:
+        self.ratio = ratio
+        self.capacity = max(minimum, 100 * ratio)
+        self.tokens = minimum
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+class CircuitBreaker:
+    """Stop calling a server after ``failures`` consecutive failures.
+
+    While open, calls fail with the last error until ``reset`` seconds have
+    passed; then a single probe decides whether the circuit closes again.
+    """
+
+    def __init__(
+        self, failures: int = OUTLINE_BREAKER_FAILURES, reset: float = OUTLINE_BREAKER_RESET
+    ) -> None:
+        self.failures = failures
+        self.reset = reset
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.last_error: Exception | None = None
+        self.rejected = 0
+
+    def before(self) -> None:
+        if self.state == "closed":
+            return
+        if time.monotonic() - self.opened_at >= self.reset:
+            # Also covers a probe that never reported back
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.last_error)
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.consecutive = 0
+
+    def failure(self, exc: Exception) -> None:
+        self.last_error = exc
+        self.consecutive += 1
+        if self.state == "half_open" or self.consecutive >= self.failures:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    """Request latencies counted in fixed buckets."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sum": self.total,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+# Shared by every client so a widespread outage cannot multiply traffic
+retry_budget = RetryBudget()
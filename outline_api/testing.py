@@ -0,0 +1,162 @@
+"""In-process fake of the Outline management API for tests and benchmarks.
+
+``FakeOutlineServer`` serves the endpoints used by :class:`OutlineClient`
+(create, rename, delete and list access keys, transfer metrics) from memory
+on a local port. Latency, failures and throttling can be configured so the
+client and the bot can be exercised end to end without a network::
+
+    async with FakeOutlineServer(latency=0.05, error_rate=0.01) as server:
+        client = OutlineClient(server.url)
+        await client.create_key("vpn_1")
+"""
+
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+
+class FakeOutlineServer:
+    """Outline API served from memory on ``127.0.0.1``.
+
+    ``latency`` is added to every request, either a fixed number of seconds
+    or a ``(low, high)`` range sampled uniformly. A share ``error_rate`` of
+    requests fails with ``500``. More than ``rate_limit`` requests per second
+    are answered with ``429`` and more than ``max_concurrency`` requests in
+    flight with ``503``. ``ignore_names`` mimics old servers that ignore the
+    name sent on creation.
+    """
+
+    def __init__(
+        self,
+        latency: float | tuple[float, float] = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float | None = None,
+        max_concurrency: int | None = None,
+        ignore_names: bool = False,
+        secret: str = "secret",
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.ignore_names = ignore_names
+        self.secret = secret
+        self.random = random.Random(seed)
+        self.keys: dict[str, dict] = {}
+        self.transfer: dict[str, int] = {}
+        self.requests: dict[str, int] = {}
+        self.failed = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._next_id = 0
+        self._tokens = rate_limit or 0.0
+        self._refilled_at = time.monotonic()
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def __aenter__(self) -> "FakeOutlineServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._faults])
+        prefix = f"/{self.secret}"
+        app.router.add_post(f"{prefix}/access-keys", self._create)
+        app.router.add_get(f"{prefix}/access-keys", self._list)
+        app.router.add_put(f"{prefix}/access-keys/{{key_id}}/name", self._rename)
+        app.router.add_delete(f"{prefix}/access-keys/{{key_id}}", self._delete)
+        app.router.add_get(f"{prefix}/metrics/transfer", self._metrics)
+        return app
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/{self.secret}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(
+            self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler):
+        route = f"{request.method} {request.match_info.route.resource.canonical}"
+        self.requests[route] = self.requests.get(route, 0) + 1
+        if self.rate_limit is not None and not self._take_token():
+            self.throttled += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            self.throttled += 1
+            return web.Response(status=503, text="overloaded")
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            latency = self.latency
+            if isinstance(latency, tuple):
+                latency = self.random.uniform(*latency)
+            if latency:
+                await asyncio.sleep(latency)
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.failed += 1
+                return web.Response(status=500, text="injected failure")
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    async def _create(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.can_read_body else {}
+        key_id = str(self._next_id)
+        self._next_id += 1
+        key = {
+            "id": key_id,
+            "name": "" if self.ignore_names else body.get("name", ""),
+            "password": f"pw{key_id}",
+            "port": 443,
+            "method": "chacha20-ietf-poly1305",
+            "accessUrl": f"ss://fake-{key_id}@127.0.0.1:443/?outline=1",
+        }
+        self.keys[key_id] = key
+        return web.json_response(key, status=201)
+
+    async def _list(self, request: web.Request) -> web.Response:
+        return web.json_response({"accessKeys": list(self.keys.values())})
+
+    async def _rename(self, request: web.Request) -> web.Response:
+        key = self.keys.get(request.match_info["key_id"])
+        if key is None:
+            return web.Response(status=404, text="Access key not found")
+        key["name"] = (await request.json()).get("name", "")
+        return web.Response(status=204)
+
+    async def _delete(self, request: web.Request) -> web.Response:
+        key_id = request.match_info["key_id"]
+        if self.keys.pop(key_id, None) is None:
+            return web.Response(status=404, text="Access key not found")
+        self.transfer.pop(key_id, None)
+        return web.Response(status=204)
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        usage = {key_id: self.transfer.get(key_id, 0) for key_id in self.keys}
+        return web.json_response({"bytesTransferredByUserId": usage})
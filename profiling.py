@@ -0,0 +1,158 @@
+"""Profiling the running bot on an admin's request.
+
+Two profilers are available. ``sample`` reads the main thread's stack from a
+background thread every ``PROFILE_SAMPLE_INTERVAL`` seconds and produces
+collapsed stacks (``frame;frame;frame count`` lines) that flamegraph.pl or
+speedscope turn into a flame graph; its overhead does not depend on how much
+code runs. ``cprofile`` records every call with :mod:`cProfile` and produces
+a pstats dump for ``python -m pstats``; it is exact but slows the bot down
+while it runs. A profile stops by itself after at most
+``PROFILE_MAX_SECONDS`` seconds.
+"""
+
+import asyncio
+import collections
+import cProfile
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+# Longest profile an admin can request (seconds)
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+# Profile length when none is given (seconds)
+PROFILE_DEFAULT_SECONDS = 30
+
+# Seconds between stack samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+
+class StackSampler:
+    """Counts the stacks of one thread sampled at a fixed interval."""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self.samples = 0
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> bytes:
+        lines = (f"{stack} {count}" for stack, count in self.stacks.most_common())
+        return "\n".join(lines).encode() + b"\n"
+
+
+class Profile:
+    """One running profile of the bot process."""
+
+    def __init__(self, mode: str, seconds: int) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiler: {mode}")
+        self.mode = mode
+        self.seconds = min(seconds, PROFILE_MAX_SECONDS)
+        self.started = time.monotonic()
+        self._sampler: StackSampler | None = None
+        self._profile: cProfile.Profile | None = None
+
+    def start(self) -> None:
+        if self.mode == SAMPLE:
+            self._sampler = StackSampler()
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> tuple[str, bytes, str]:
+        """Stop profiling and return the file name, contents and a summary."""
+        elapsed = time.monotonic() - self.started
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        if self._sampler is not None:
+            self._sampler.stop()
+            summary = f"{self._sampler.samples} samples in {elapsed:.0f} s"
+            return f"profile-{stamp}.collapsed.txt", self._sampler.collapsed(), summary
+        self._profile.disable()
+        self._profile.create_stats()
+        stats = self._profile.stats
+        calls = sum(total for _, total, _, _, _ in stats.values())
+        summary = f"{calls} calls in {elapsed:.0f} s"
+        # The same format pstats.Stats.dump_stats writes
+        return f"profile-{stamp}.pstats", marshal.dumps(stats), summary
+
+
+class ProfileRunner:
+    """Runs at most one profile and sends its result to the admin chat."""
+
+    def __init__(self) -> None:
+        self.profile: Profile | None = None
+        self._chat_id: int | None = None
+        self._timer: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self, bot: Bot, chat_id: int, seconds: int, mode: str = SAMPLE) -> Profile:
+        if self.profile is not None:
+            raise RuntimeError("A profile is already running")
+        profile = Profile(mode, seconds)
+        profile.start()
+        self.profile = profile
+        self._chat_id = chat_id
+        self._timer = asyncio.create_task(self._stop_later(bot, profile.seconds))
+        return profile
+
+    async def _stop_later(self, bot: Bot, seconds: int) -> None:
+        await asyncio.sleep(seconds)
+        self._timer = None
+        await self.stop(bot)
+
+    async def stop(self, bot: Bot) -> bool:
+        """Stop the running profile and send the result; False if none runs."""
+        profile, self.profile = self.profile, None
+        if profile is None:
+            return False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        name, data, summary = profile.stop()
+        logging.info("Profile %s finished: %s", name, summary)
+        try:
+            await bot.send_document(
+                self._chat_id, BufferedInputFile(data, filename=name), caption=summary
+            )
+        except Exception as exc:
+            logging.error("Failed to send profile: %s", exc)
+        return True
+
+
+PROFILER = ProfileRunner()
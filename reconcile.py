@@ -0,0 +1,197 @@
+"""Reconciliation of the keys on Outline servers with the database."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+from db import clear_keys, get_key_rows, get_pool_key_ids, get_server_keys
+from outline_api.client import OutlineAPIError
+from servers import OutlineServers
+
+# Seconds between reconciliation runs after the one at startup (0 disables)
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", str(6 * 60 * 60)))
+
+# Maximum number of leaked keys deleted per second on one server
+RECONCILE_DELETE_RATE = float(os.getenv("RECONCILE_DELETE_RATE", "5"))
+
+# Comma-separated name prefixes of keys created by the bot
+BOT_KEY_PREFIXES = tuple(
+    prefix.strip()
+    for prefix in os.getenv("BOT_KEY_PREFIXES", "vpn_,ref_bonus_,pool").split(",")
+    if prefix.strip()
+)
+
+# Orphan deletion is refused when orphans are this share of a server's keys,
+# which usually means the bot runs against the wrong or an empty database
+RECONCILE_MAX_ORPHAN_SHARE = 0.5
+
+# Keys expired for longer than this are left to reconciliation (seconds)
+RECONCILE_GRACE = 5 * 60
+
+# Delay between the startup run and the run confirming its orphans (seconds)
+RECONCILE_CONFIRM_DELAY = 10 * 60
+
+# Number of stored keys read per query
+RECONCILE_PAGE_SIZE = 1000
+
+
+class Reconciler:
+    """Deletes keys that exist on a server but not in the database.
+
+    Each run lists every server's keys once and diffs them in memory against
+    ``vpn_access`` and ``key_pool``. Keys named by the bot are *orphans*;
+    other keys are reported as *foreign* and never touched. Orphans are only
+    deleted once a second run still finds them, so a key created just before
+    its row is written is never removed. Stored keys
+    expired for more than ``RECONCILE_GRACE`` seconds are deleted as well.
+    """
+
+    def __init__(
+        self,
+        servers: Callable[[], OutlineServers],
+        delete_rate: float = RECONCILE_DELETE_RATE,
+        prefixes: tuple[str, ...] = BOT_KEY_PREFIXES,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        self.servers = servers
+        self.delete_rate = delete_rate
+        self.prefixes = prefixes
+        # Waits between deletions to keep under ``delete_rate``
+        self.sleep = sleep
+        self.suspects: dict[str, set[str]] = {}
+        self.last_summary: dict[str, dict] = {}
+
+    def is_bot_key(self, key: dict) -> bool:
+        return (key.get("name") or "").startswith(self.prefixes)
+
+    async def _stored_keys(self, server: str) -> dict[str, tuple]:
+        stored = {}
+        after = None
+        while True:
+            rows = await get_server_keys(server, after, RECONCILE_PAGE_SIZE)
+            for user_id, is_trial, key_id, expires_at in rows:
+                stored[str(key_id)] = (user_id, bool(is_trial), expires_at)
+            if len(rows) < RECONCILE_PAGE_SIZE:
+                return stored
+            after = rows[-1][2]
+
+    async def _delete(self, server: str, key_ids: list[str]) -> int:
+        client = self.servers().client(server)
+        deleted = 0
+        for key_id in key_ids:
+            started = time.monotonic()
+            try:
+                await client.delete_key(key_id)
+                deleted += 1
+            except OutlineAPIError as exc:
+                if exc.status == 404:
+                    deleted += 1
+                else:
+                    logging.error("Failed to delete leaked key %s: %s", key_id, exc)
+            except Exception as exc:
+                logging.error("Failed to delete leaked key %s: %s", key_id, exc)
+            await self.sleep(max(0.0, 1 / self.delete_rate - (time.monotonic() - started)))
+        return deleted
+
+    async def reconcile_server(self, server: str) -> dict:
+        """Reconcile one server."""
+        # List the server before reading the database so that a key stored in
+        # between is never taken for an orphan
+        keys = await self.servers().client(server).list_keys()
+        stored = await self._stored_keys(server)
+        pooled = {str(key_id) for key_id in await get_pool_key_ids(server)}
+        on_server = {str(key["id"]): key for key in keys}
+
+        orphans, foreign = [], []
+        for key_id, key in on_server.items():
+            if key_id not in stored and key_id not in pooled:
+                (orphans if self.is_bot_key(key) else foreign).append(key_id)
+        deadline = int(time.time()) - RECONCILE_GRACE
+        expired = {
+            key_id: (user_id, is_trial)
+            for key_id, (user_id, is_trial, expires_at) in stored.items()
+            if expires_at is not None and expires_at <= deadline
+        }
+        missing = [key_id for key_id in stored if key_id not in on_server]
+
+        seen_before = self.suspects.get(server, set())
+        due = [key_id for key_id in orphans if key_id in seen_before]
+        refused = len(orphans) > 10 and (
+            len(orphans) / len(on_server) > RECONCILE_MAX_ORPHAN_SHARE
+        )
+        if refused:
+            logging.error(
+                "Not deleting %s of %s keys on %s: too many orphans",
+                len(orphans),
+                len(on_server),
+                server,
+            )
+            due = []
+        self.suspects[server] = set(orphans) - set(due)
+        deleted = await self._delete(
+            server, due + [key_id for key_id in expired if key_id in on_server]
+        )
+
+        # Skip rows renewed or replaced while the keys were being deleted
+        cleared = []
+        for key_id, (user_id, is_trial) in expired.items():
+            for row_trial, row_key, _, expires_at, row_server in await get_key_rows(user_id):
+                if (
+                    row_trial == int(is_trial)
+                    and str(row_key) == key_id
+                    and row_server == server
+                    and expires_at is not None
+                    and expires_at <= deadline
+                ):
+                    cleared.append((user_id, is_trial))
+        await clear_keys(cleared)
+
+        summary = {
+            "server_keys": len(on_server),
+            "stored": len(stored),
+            "pooled": len(pooled),
+            "orphans": len(orphans),
+            "pending": len(self.suspects[server]),
+            "foreign": len(foreign),
+            "expired": len(expired),
+            "cleared": len(cleared),
+            "missing": len(missing),
+            "deleted": deleted,
+            "refused": refused,
+        }
+        if foreign:
+            logging.info("Foreign keys on %s: %s", server, ", ".join(sorted(foreign)))
+        logging.info("Reconciled %s: %s", server, summary)
+        return summary
+
+    async def run(self) -> dict[str, dict]:
+        """Reconcile every server and return a summary per server."""
+        summaries = {}
+        for server in self.servers().urls:
+            try:
+                summaries[server] = await self.reconcile_server(server)
+            except Exception as exc:
+                logging.error("Failed to reconcile %s: %s", server, exc)
+                summaries[server] = {"error": str(exc)}
+        self.last_summary = summaries
+        return summaries
+
+    async def loop(
+        self, interval: int = RECONCILE_INTERVAL, confirm_delay: float = RECONCILE_CONFIRM_DELAY
+    ) -> None:
+        """Reconcile at startup and then every ``interval`` seconds.
+
+        The startup run only records orphans: keys being created or pooled
+        at the same time are not stored yet. A second run ``confirm_delay``
+        seconds later deletes the orphans it still finds.
+        """
+        await self.run()
+        await asyncio.sleep(confirm_delay)
+        await self.run()
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            await self.run()
@@ -0,0 +1,116 @@
+"""Single-task scheduler for many timestamped jobs."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class DueQueue:
+    """Min-heap of keyed deadlines served by one worker task.
+
+    ``schedule`` replaces any pending entry with the same key and ``cancel``
+    drops it. The worker sleeps until the earliest deadline (unix time) and
+    passes due ``(key, payload)`` pairs to ``handler`` in batches of at most
+    ``batch_size``. If a batch fails, its entries are handled again one at a
+    time, so handlers must tolerate seeing an entry twice.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list[tuple[Hashable, Any]]], Awaitable[None]],
+        batch_size: int = 100,
+        name: str = "due queue",
+    ) -> None:
+        self.handler = handler
+        self.batch_size = batch_size
+        self.name = name
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._entries: dict[Hashable, tuple[float, int, Any]] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key: Hashable, due: float, payload: Any = None) -> None:
+        seq = next(self._seq)
+        self._entries[key] = (due, seq, payload)
+        heapq.heappush(self._heap, (due, seq, key))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def cancel(self, key: Hashable) -> bool:
+        return self._entries.pop(key, None) is not None
+
+    def due_at(self, key: Hashable) -> float | None:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _compact(self) -> None:
+        """Drop heap items left behind by rescheduled or cancelled keys."""
+        self._heap = [(due, seq, key) for key, (due, seq, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, seq: int, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] == seq
+
+    def next_due(self) -> float | None:
+        while self._heap and not self._is_current(self._heap[0][1], self._heap[0][2]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[tuple[Hashable, Any]]:
+        batch = []
+        while len(batch) < self.batch_size:
+            due = self.next_due()
+            if due is None or due > now:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            batch.append((key, self._entries.pop(key)[2]))
+        return batch
+
+    async def _handle_each(self, batch: list[tuple[Hashable, Any]]) -> None:
+        """Handle entries one by one so a bad entry does not drop the others."""
+        for entry in batch:
+            try:
+                await self.handler([entry])
+            except Exception as exc:
+                logging.error("Failed to process %s entry %s: %s", self.name, entry[0], exc)
+
+    async def _run(self) -> None:
+        while True:
+            batch = self.pop_due(time.time())
+            if batch:
+                try:
+                    await self.handler(batch)
+                except Exception as exc:
+                    logging.error("Failed to process %s batch: %s", self.name, exc)
+                    await self._handle_each(batch)
+                continue
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
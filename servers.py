@@ -0,0 +1,127 @@
+"""Outline server registry with load-aware key placement."""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+from db import count_keys_by_server, get_server_traffic
+from outline_api.client import OutlineClient
+
+# Place new keys on the server holding the fewest keys
+LEAST_KEYS = "least_keys"
+
+# Place new keys on the server that transferred the fewest bytes recently
+LEAST_TRANSFER = "least_transfer"
+
+# Seconds a measured server load is reused before it is measured again
+SERVER_LOAD_TTL = int(os.getenv("SERVER_LOAD_TTL", "60"))
+
+
+def server_id(url: str) -> str:
+    """Return the id stored with keys of the server at ``url``."""
+    return urlsplit(url).netloc or url
+
+
+class OutlineServers:
+    """The configured Outline servers and their current load.
+
+    Keys record the id of the server they were created on (the host and port
+    of its API URL). Keys stored without a server belong to ``default``.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        client: Callable[[str], OutlineClient],
+        default: str | None = None,
+        strategy: str = LEAST_KEYS,
+        ttl: int = SERVER_LOAD_TTL,
+    ) -> None:
+        if strategy not in (LEAST_KEYS, LEAST_TRANSFER):
+            raise ValueError(f"Unknown key placement strategy: {strategy}")
+        self.urls = {server_id(url): url for url in urls}
+        self.default = server_id(default) if default else next(iter(self.urls))
+        self._client = client
+        self.strategy = strategy
+        self.ttl = ttl
+        self.draining: set[str] = set()
+        self.keys: dict[str, int] = {}
+        self.load: dict[str, float] = {}
+        self._measured_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    def url(self, server: str | None = None) -> str:
+        try:
+            return self.urls[server or self.default]
+        except KeyError:
+            raise RuntimeError(f"Unknown Outline server: {server}") from None
+
+    def client(self, server: str | None = None) -> OutlineClient:
+        return self._client(self.url(server))
+
+    async def _transfer(self, server: str) -> float:
+        try:
+            metrics = await self.client(server).transfer_metrics()
+        except Exception as exc:
+            logging.error("Failed to read transfer of %s: %s", server, exc)
+            return math.inf
+        return float(sum(metrics.values()))
+
+    async def measure(self) -> dict[str, float]:
+        """Refresh the load of every server."""
+        counts = await count_keys_by_server()
+        self.keys = {
+            server: counts.get(server, 0)
+            + (counts.get(None, 0) if server == self.default else 0)
+            for server in self.urls
+        }
+        if self.strategy == LEAST_TRANSFER:
+            # Totals stored by the traffic poller spare a request per server
+            polled = await get_server_traffic()
+            unpolled = [server for server in self.urls if server not in polled]
+            fetched = await asyncio.gather(*(self._transfer(s) for s in unpolled))
+            self.load = {
+                server: float(polled[server]) for server in self.urls if server in polled
+            }
+            self.load.update(zip(unpolled, fetched))
+        else:
+            self.load = {server: float(count) for server, count in self.keys.items()}
+        self._measured_at = time.monotonic()
+        return self.load
+
+    async def choose(self) -> str:
+        """Return the least loaded server that is not being drained.
+
+        The chosen server's load is bumped by one key's share right away so
+        concurrent placements between measurements spread out.
+        """
+        candidates = [server for server in self.urls if server not in self.draining]
+        if not candidates:
+            raise RuntimeError("No Outline server accepts new keys")
+        if len(candidates) == 1:
+            return candidates[0]
+        async with self._lock:
+            if self._measured_at is None or time.monotonic() - self._measured_at > self.ttl:
+                await self.measure()
+            server = min(candidates, key=lambda s: (self.load[s], self.keys[s]))
+            keys = self.keys[server]
+            if self.strategy == LEAST_TRANSFER and keys:
+                self.load[server] += self.load[server] / keys
+            elif self.strategy == LEAST_KEYS:
+                self.load[server] += 1
+            self.keys[server] = keys + 1
+        return server
+
+    def stats(self) -> dict:
+        return {
+            server: {
+                "keys": self.keys.get(server),
+                "load": self.load.get(server),
+                "draining": server in self.draining,
+            }
+            for server in self.urls
+        }
@@ -10,7 +10,7 @@ import pytest
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
 os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
 
-from admin import cmd_users, cmd_userlist  # noqa: E402
+from admin import callback_userlist, cmd_users, cmd_userlist  # noqa: E402
 
 
 @pytest.mark.asyncio
@@ -44,9 +44,9 @@ async def test_cmd_userlist_formats_user_block():
         f"\U0001f4c5 \u0410\u043a\u0442\u0438\u0432\u0430\u0446\u0438\u044f: {created}\n"
         f"\u23f3 \u0418\u0441\u0442\u0435\u043a\u0430\u0435\u0442: {expires}"
     )
-    with patch("admin.get_all_users", new=AsyncMock(return_value=[row])), patch("admin.time.time", return_value=0):
+    with patch("admin.get_users_page", new=AsyncMock(return_value=([row], None, None))), patch("admin.time.time", return_value=0):
         await cmd_userlist(message)
-    message.answer.assert_awaited_with(expected)
+    message.answer.assert_awaited_with(expected, reply_markup=None)
 
 
 @pytest.mark.asyncio
@@ -56,6 +56,41 @@ async def test_cmd_userlist_empty():
         text="/userlist",
         answer=AsyncMock(),
     )
-    with patch("admin.get_all_users", new=AsyncMock(return_value=[])):
+    with patch("admin.get_users_page", new=AsyncMock(return_value=([], None, None))):
         await cmd_userlist(message)
     message.answer.assert_awaited_with("\u041d\u0435\u0442 \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u0435\u0439.")
+
+
+@pytest.mark.asyncio
+async def test_cmd_userlist_adds_next_button():
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=124508057),
+        text="/userlist",
+        answer=AsyncMock(),
+    )
+    row = (7, "alice", 0, 1, 1700000000, 1700003600)
+    with patch("admin.get_users_page", new=AsyncMock(return_value=([row], None, (1700000000, 7)))):
+        await cmd_userlist(message)
+    kb = message.answer.await_args.kwargs["reply_markup"]
+    assert [b.callback_data for b in kb.inline_keyboard[0]] == ["userlist:n:1700000000:7"]
+
+
+@pytest.mark.asyncio
+async def test_callback_userlist_loads_previous_page():
+    row = (7, "alice", 0, 1, 1700000000, 1700003600)
+    callback = SimpleNamespace(
+        from_user=SimpleNamespace(id=124508057),
+        data="userlist:p:1700000000:9",
+        message=SimpleNamespace(edit_text=AsyncMock()),
+        answer=AsyncMock(),
+    )
+    page = AsyncMock(return_value=([row], (1700000000, 7), (1700000000, 7)))
+    with patch("admin.get_users_page", new=page):
+        await callback_userlist(callback)
+    page.assert_awaited_with((1700000000, 9), limit=20, before=True)
+    kb = callback.message.edit_text.await_args.kwargs["reply_markup"]
+    assert [b.callback_data for b in kb.inline_keyboard[0]] == [
+        "userlist:p:1700000000:7",
+        "userlist:n:1700000000:7",
+    ]
+    callback.answer.assert_awaited()
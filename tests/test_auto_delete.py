@@ -1,6 +1,5 @@
 """Tests for ``send_temporary`` message auto-deletion."""
 
-import asyncio
 import os
 import sys
 from types import SimpleNamespace
@@ -13,21 +12,33 @@ os.environ.setdefault(
     "BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX"
 )
 
-from bot import send_temporary  # noqa: E402
+from bot import TEMP_MESSAGES, delete_temporary_messages, send_temporary  # noqa: E402
 
 
 @pytest.mark.asyncio
-async def test_send_temporary_deletes_message(task_spy):
+async def test_send_temporary_deletes_message():
     bot = AsyncMock()
     bot.send_message = AsyncMock(return_value=SimpleNamespace(message_id=10))
 
-    tasks, fake_create_task = task_spy
-
-    with patch("bot.asyncio.create_task", side_effect=fake_create_task), patch(
-        "bot.asyncio.sleep", new=AsyncMock()
-    ) as sleep_mock:
+    with patch("bot.time.time", return_value=1000), patch(
+        "bot.add_pending_deletion", new=AsyncMock()
+    ) as store_mock, patch(
+        "bot.remove_pending_deletions", new=AsyncMock()
+    ) as remove_mock:
         await send_temporary(bot, 123, "hi", delay=5)
-        await asyncio.gather(*tasks)
         bot.send_message.assert_awaited_with(123, "hi")
-        assert any(c.args[0] == 5 for c in sleep_mock.await_args_list)
+        store_mock.assert_awaited_with(123, 10, 1005)
+        assert TEMP_MESSAGES.due_at((123, 10)) == 1005
+        await delete_temporary_messages(TEMP_MESSAGES.pop_due(1005))
         bot.delete_message.assert_awaited_with(123, 10)
+        remove_mock.assert_awaited_with([(123, 10)])
+
+
+@pytest.mark.asyncio
+async def test_delete_temporary_messages_groups_by_chat():
+    bot = AsyncMock()
+    batch = [((1, 10), bot), ((2, 20), bot), ((1, 11), bot)]
+    with patch("bot.remove_pending_deletions", new=AsyncMock()):
+        await delete_temporary_messages(batch)
+    bot.delete_messages.assert_awaited_once_with(1, [10, 11])
+    bot.delete_message.assert_awaited_once_with(2, 20)
@@ -0,0 +1,33 @@
+"""Smoke test of the end-to-end flow benchmark."""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from bot_flows import run  # noqa: E402
+
+
+@pytest.mark.asyncio
+async def test_every_flow_runs_without_errors():
+    args = argparse.Namespace(
+        users=6, concurrency=3, outline_latency=0.0, telegram_latency=0.0, paced=False
+    )
+    result = await run(args)
+    assert set(result["flows"]) == {
+        "start",
+        "trial",
+        "my_keys",
+        "device",
+        "admin_users",
+        "admin_userlist",
+    }
+    assert all(flow["errors"] == 0 for flow in result["flows"].values())
+    # Three referral bonuses and six trials each created a key
+    assert result["outline_requests"]["POST /secret/access-keys"] == 9
+    assert result["telegram_calls"]["AnswerCallbackQuery"] == 12
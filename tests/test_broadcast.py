@@ -0,0 +1,82 @@
+"""Tests for admin broadcasts."""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+import broadcast  # noqa: E402
+from broadcast import Broadcast, resume_broadcasts  # noqa: E402
+from db import (  # noqa: E402
+    close_db,
+    create_broadcast,
+    get_running_broadcasts,
+    init_db,
+    save_user,
+    update_broadcast,
+)
+
+ADMIN_ID = 124508057
+
+
+def fake_bot(blocked: set[int] = frozenset()):
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        if chat_id in blocked:
+            raise TelegramForbiddenError(
+                SendMessage(chat_id=chat_id, text=text), "bot was blocked by the user"
+            )
+        sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(sent))
+
+    return SimpleNamespace(send_message=send_message, edit_message_text=AsyncMock()), sent
+
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_to_every_user_and_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "broadcast.sqlite"), raising=False)
+    await init_db()
+    try:
+        for user_id in range(1, 26):
+            await save_user(user_id, f"user{user_id}")
+        bot, sent = fake_bot(blocked={7})
+        broadcast_id = await create_broadcast(ADMIN_ID, "news")
+        job = Broadcast(bot, broadcast_id, ADMIN_ID, "news", rate=1000, page_size=10)
+        await job.run()
+
+        recipients = [chat_id for chat_id, text in sent if text == "news"]
+        assert sorted(recipients) == [n for n in range(1, 26) if n != 7]
+        assert (job.sent, job.failed, job.last_user_id) == (24, 1, 25)
+        assert await get_running_broadcasts() == []
+        # The admin got a progress message, edited when the broadcast finished
+        assert sent[0][0] == ADMIN_ID
+        assert "завершена" in bot.edit_message_text.await_args.args[0]
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_interrupted_broadcast_resumes_after_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "resume.sqlite"), raising=False)
+    await init_db()
+    try:
+        for user_id in range(1, 11):
+            await save_user(user_id, None)
+        broadcast_id = await create_broadcast(ADMIN_ID, "news")
+        await update_broadcast(broadcast_id, 6, 6, 0)
+        bot, sent = fake_bot()
+        assert await resume_broadcasts(bot) == 1
+        while broadcast.RUNNING or await get_running_broadcasts():
+            await asyncio.sleep(0.01)
+        assert [chat_id for chat_id, text in sent if text == "news"] == [7, 8, 9, 10]
+    finally:
+        await close_db()
@@ -3,6 +3,7 @@
 import os
 import sys
 import shutil
+import time
 
 import pytest
 
@@ -11,10 +12,24 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
 from db import (  # noqa: E402
     add_key,
     clear_key,
+    close_db,
+    flush_writes,
     get_active_key,
+    get_connection,
+    get_due_notifications,
+    get_key_info,
+    get_users_page,
     has_used_trial,
+    get_users_stats,
     init_db,
+    key_cache,
+    key_cache_stats,
     record_referral,
+    refresh_users_stats,
+    save_user,
+    set_last_notifications,
+    update_expiration,
+    write_queue_stats,
 )
 
 
@@ -74,3 +89,156 @@ async def test_init_db_creates_directory(tmp_path, monkeypatch):
     await init_db()
     assert db_file.exists()
     assert db_file.parent.exists()
+
+
+@pytest.mark.asyncio
+async def test_init_db_opens_shared_pool(tmp_path, monkeypatch):
+    db_file = tmp_path / "pool.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    monkeypatch.setattr("db.DB_POOL_SIZE", 1, raising=False)
+    await init_db()
+    async with get_connection() as conn:
+        first = conn
+        cursor = await conn.execute("PRAGMA journal_mode")
+        assert (await cursor.fetchone())[0] == "wal"
+        cursor = await conn.execute("PRAGMA synchronous")
+        assert (await cursor.fetchone())[0] == 1
+    async with get_connection() as conn:
+        assert conn is first
+    await close_db()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_group_commits(tmp_path, monkeypatch):
+    db_file = tmp_path / "queue.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    monkeypatch.setattr("db.DB_WRITE_BEHIND", True, raising=False)
+    monkeypatch.setattr("db.DB_WRITE_BATCH_MS", 1000, raising=False)
+    await init_db()
+    for user_id in range(10):
+        await save_user(user_id, f"user{user_id}")
+    await add_key(1, 2, "url", 123, False)
+    assert write_queue_stats()["depth"] == 11
+    await flush_writes()
+    stats = write_queue_stats()
+    assert stats["depth"] == 0
+    assert stats["batches"] == 1
+    assert stats["items"] == 11
+    assert await get_active_key(1) == ("url", 123, 0)
+    await close_db()
+    assert write_queue_stats() == {"enabled": False}
+
+
+@pytest.mark.asyncio
+async def test_get_due_notifications(tmp_path, monkeypatch):
+    db_file = tmp_path / "notify.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    await init_db()
+    now = 1_000_000
+    day = 24 * 60 * 60
+    await add_key(1, 11, "a", now + 3 * day - 10, False)  # three days left
+    await add_key(2, 12, "b", now + 5 * day, False)  # not due yet
+    await add_key(3, 13, "c", now - 10, False)  # expired today
+    await add_key(4, 14, "d", now - day - 10, False)  # expired yesterday
+    await add_key(5, 15, "e", now - 10, True)  # notified recently
+    await set_last_notifications([5], now - 60)
+    rows = await get_due_notifications(now)
+    assert sorted(rows) == [
+        (1, now + 3 * day - 10, 3),
+        (3, now - 10, 0),
+        (4, now - day - 10, -1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_key_cache_serves_reads_and_invalidates_on_write(tmp_path, monkeypatch):
+    db_file = tmp_path / "cache.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    monkeypatch.setattr(key_cache, "enabled", True)
+    await init_db()
+    await add_key(1, 2, "url", 123, True)
+    before = key_cache_stats()
+    assert await get_key_info(1) == (2, "url", 123, 1)
+    assert await has_used_trial(1)
+    assert await get_active_key(1) == ("url", 123, 1)
+    stats = key_cache_stats()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 1
+
+    await update_expiration(1, True, 456)
+    assert await get_active_key(1) == ("url", 456, 1)
+    await clear_key(1, True)
+    assert await get_active_key(1) is None
+    assert await has_used_trial(1)
+    assert key_cache_stats()["misses"] - before["misses"] == 3
+
+
+@pytest.mark.asyncio
+async def test_get_users_page_walks_both_directions(tmp_path, monkeypatch):
+    db_file = tmp_path / "pages.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    await init_db()
+    for user_id in range(1, 8):
+        await save_user(user_id, None)
+    for user_id in (2, 4, 6):
+        await add_key(user_id, user_id, "url", 999, False)
+    # Keyed users first (all share created_at), then users without a key
+    expected = [6, 4, 2, 7, 5, 3, 1]
+
+    seen = []
+    rows, prev_cursor, cursor = await get_users_page(limit=3)
+    assert prev_cursor is None
+    seen += [row[0] for row in rows]
+    while cursor is not None:
+        rows, prev_cursor, cursor = await get_users_page(cursor, limit=3)
+        seen += [row[0] for row in rows]
+    assert seen == expected
+
+    rows, prev_cursor, _ = await get_users_page(prev_cursor, limit=3, before=True)
+    assert [row[0] for row in rows] == [7, 5, 3]
+    rows, prev_cursor, next_cursor = await get_users_page(prev_cursor, limit=3, before=True)
+    assert [row[0] for row in rows] == [6, 4, 2]
+    assert prev_cursor is None and next_cursor is not None
+
+
+async def full_users_stats(now: int):
+    async with get_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT COUNT(*), "
+            "COALESCE(SUM(expires_at > :now), 0), "
+            "COALESCE(SUM(is_trial = 1 AND expires_at > :now), 0), "
+            "COALESCE(SUM(is_paid = 1 AND expires_at > :now), 0), "
+            "COALESCE(SUM(expires_at <= :now), 0) FROM users",
+            {"now": now},
+        )
+        return await cursor.fetchone()
+
+
+@pytest.mark.asyncio
+async def test_users_stats_follow_writes_and_refresh(tmp_path, monkeypatch):
+    db_file = tmp_path / "stats.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    now = int(time.time())
+    await init_db()
+    # Simulate a database created before users_stats existed
+    async with get_connection() as conn:
+        await conn.execute("DROP TABLE users_stats")
+        for name in ("insert", "delete", "update"):
+            await conn.execute(f"DROP TRIGGER users_stats_{name}")
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (99, 'old')")
+        await conn.commit()
+    await init_db()
+    await save_user(1, "a")
+    await add_key(1, 11, "url", now + 100, True)
+    await add_key(2, 12, "url", now + 5000, False)
+    await add_key(3, 13, "url", now - 10, False)
+    await update_expiration(2, False, now + 200)
+    await clear_key(3, False)
+    assert await get_users_stats() == await full_users_stats(now)
+
+    await refresh_users_stats(now + 150)
+    assert await get_users_stats() == await full_users_stats(now + 150)
+    assert await get_users_stats() == (4, 1, 0, 1, 1)
+    await add_key(4, 14, "url", now + 120, True)
+    await refresh_users_stats(now + 300)
+    assert await get_users_stats() == await full_users_stats(now + 300)
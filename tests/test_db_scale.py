@@ -0,0 +1,38 @@
+"""Smoke test of the database scale benchmark."""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))  # noqa: E402
+
+import db  # noqa: E402
+from db_scale import public_functions, run  # noqa: E402
+
+
+@pytest.mark.asyncio
+async def test_every_db_function_is_benchmarked(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", db.DB_PATH)
+    monkeypatch.setattr(db.key_cache, "enabled", db.key_cache.enabled)
+    args = argparse.Namespace(
+        users=300,
+        db=str(tmp_path / "scale.sqlite"),
+        ops=3,
+        heavy_ops=1,
+        concurrency=2,
+        only=None,
+        no_cache=False,
+    )
+    result = await run(args)
+    assert set(result["functions"]) == public_functions()
+    assert result["fill_seconds"] > 0
+    stats = result["functions"]["get_due_notifications"]
+    assert stats["single"]["ops"] == stats["concurrent"]["ops"] == 1
+
+    # A second run reuses the filled file
+    result = await run(argparse.Namespace(**{**vars(args), "only": ["get_key_rows"]}))
+    assert result["fill_seconds"] == 0
+    assert list(result["functions"]) == ["get_key_rows"]
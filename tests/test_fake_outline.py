@@ -0,0 +1,102 @@
+"""End-to-end tests against the in-process fake Outline server."""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from bot import callback_trial  # noqa: E402
+from db import close_db, get_key_rows, init_db  # noqa: E402
+from outline_api.client import OutlineAPIError, OutlineClient, close_clients  # noqa: E402
+from outline_api.resilience import CircuitOpenError, RetryBudget  # noqa: E402
+from outline_api.testing import FakeOutlineServer  # noqa: E402
+
+
+@pytest.mark.asyncio
+async def test_client_round_trip():
+    async with FakeOutlineServer() as server:
+        client = OutlineClient(server.url)
+        try:
+            key = await client.create_key("vpn_1")
+            server.transfer[key["id"]] = 1234
+            assert [k["name"] for k in await client.list_keys()] == ["vpn_1"]
+            assert await client.transfer_metrics() == {key["id"]: 1234}
+            await client.delete_key(key["id"])
+            with pytest.raises(OutlineAPIError) as err:
+                await client.delete_key(key["id"])
+        finally:
+            await client.close()
+    assert err.value.status == 404
+    assert server.keys == {}
+
+
+@pytest.mark.asyncio
+async def test_client_concurrency_is_bounded():
+    async with FakeOutlineServer(latency=0.02) as server:
+        client = OutlineClient(server.url, max_concurrency=4)
+        try:
+            await asyncio.gather(*(client.create_key(f"vpn_{i}") for i in range(20)))
+        finally:
+            await client.close()
+    assert len(server.keys) == 20
+    assert server.peak_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_throttled_requests_are_retried(monkeypatch):
+    monkeypatch.setattr("outline_api.client.retry_budget", RetryBudget(ratio=1))
+    async with FakeOutlineServer(rate_limit=4) as server:
+        client = OutlineClient(server.url, retries=8, retry_delay=0.1)
+        try:
+            await asyncio.gather(*(client.create_key() for _ in range(8)))
+        finally:
+            await client.close()
+    assert server.throttled > 0
+    assert len(server.keys) == 8
+    assert client.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_failing_server_opens_the_circuit():
+    async with FakeOutlineServer(error_rate=1.0) as server:
+        client = OutlineClient(server.url, retries=0)
+        try:
+            for _ in range(client.breaker.failures):
+                with pytest.raises(OutlineAPIError):
+                    await client.list_keys()
+            with pytest.raises(CircuitOpenError):
+                await client.list_keys()
+        finally:
+            await client.close()
+    assert server.failed == client.breaker.failures
+
+
+@pytest.mark.asyncio
+async def test_trial_key_is_issued_end_to_end(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "fake.db"), raising=False)
+    await init_db()
+    message = AsyncMock()
+    message.chat.id = 42
+    callback = SimpleNamespace(
+        from_user=SimpleNamespace(id=1), message=message, answer=AsyncMock()
+    )
+    try:
+        async with FakeOutlineServer(latency=0.01) as server:
+            with patch("bot.OUTLINE_API_URL", server.url), patch(
+                "bot.bot.send_message", new=AsyncMock()
+            ) as send_mock:
+                await callback_trial(callback)
+            await close_clients()
+        (is_trial, key_id, access_url, _, _), = await get_key_rows(1)
+    finally:
+        await close_db()
+    assert is_trial == 1
+    assert server.keys[str(key_id)]["name"] == "vpn_1"
+    assert access_url == server.keys[str(key_id)]["accessUrl"]
+    assert access_url in [c.args[1] for c in send_mock.await_args_list]
@@ -0,0 +1,139 @@
+"""Tests for the warm pool of Outline keys."""
+
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from bot import create_outline_key  # noqa: E402
+from db import close_db, count_pool_keys, init_db  # noqa: E402
+from key_pool import POOL_KEY_NAME, KeyPool  # noqa: E402
+
+
+def fake_create():
+    counter = iter(range(1, 1000))
+
+    async def create(name):
+        key_id = next(counter)
+        return {"id": key_id, "accessUrl": f"ss://{key_id}", "name": name, "server": "a:1"}
+
+    return AsyncMock(side_effect=create)
+
+
+@pytest.mark.asyncio
+async def test_refill_tops_up_below_low_watermark(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "pool.db"), raising=False)
+    await init_db()
+    create = fake_create()
+    pool = KeyPool(create, AsyncMock(), low=2, high=5)
+    try:
+        assert await pool.refill() == 5
+        create.assert_awaited_with(POOL_KEY_NAME)
+        assert await count_pool_keys() == 5
+        # Above the low watermark nothing is created
+        assert await pool.refill() == 0
+        for _ in range(4):
+            await pool.claim()
+        assert await pool.refill() == 4
+        stats = pool.stats()
+        assert stats["depth"] == 5
+        assert stats["refills"] == 2
+        assert stats["created"] == 9
+        assert stats["claims"] == 4
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_refill_keeps_created_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "pool.db"), raising=False)
+    await init_db()
+    stalled = asyncio.Event()
+    created = fake_create()
+
+    async def create(name):
+        if created.await_count >= 3:
+            await stalled.wait()
+        return await created(name)
+
+    pool = KeyPool(create, AsyncMock(), low=1, high=10, concurrency=1)
+    try:
+        refill = asyncio.create_task(pool.refill())
+        while created.await_count < 3:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        refill.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await refill
+        assert await count_pool_keys() == 3
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_claim_returns_oldest_key_and_renames(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "pool.db"), raising=False)
+    await init_db()
+    rename = AsyncMock()
+    # Keys are stored as their creates finish, so create one at a time
+    pool = KeyPool(fake_create(), rename, low=1, high=2, concurrency=1)
+    try:
+        await pool.refill()
+        first = await pool.claim("vpn_5")
+        second = await pool.claim("vpn_6")
+        assert first == {"id": 1, "accessUrl": "ss://1", "name": "vpn_5", "server": "a:1"}
+        assert second["id"] == 2
+        assert await pool.claim("vpn_7") is None
+        await asyncio.sleep(0)
+        rename.assert_any_await(1, "vpn_5", "a:1")
+        rename.assert_any_await(2, "vpn_6", "a:1")
+        assert pool.misses == 1
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_claims_get_distinct_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "pool.db"), raising=False)
+    await init_db()
+    pool = KeyPool(fake_create(), AsyncMock(), low=1, high=10)
+    try:
+        await pool.refill()
+        keys = await asyncio.gather(*(pool.claim() for _ in range(12)))
+        ids = [key["id"] for key in keys if key is not None]
+        assert sorted(ids) == list(range(1, 11))
+        assert pool.misses == 2
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_create_outline_key_falls_back_when_pool_empty():
+    pool = AsyncMock()
+    pool.enabled = True
+    pool.claim.return_value = None
+    client = AsyncMock()
+    client.create_key.return_value = {"id": 3, "accessUrl": "ss://3"}
+    with patch("bot.KEY_POOL", pool), patch(
+        "bot.OUTLINE_API_URL", "https://example.com/api"
+    ), patch("bot.get_client", return_value=client):
+        key = await create_outline_key(label="vpn_1")
+    pool.claim.assert_awaited_with("vpn_1")
+    client.create_key.assert_awaited_with("vpn_1")
+    assert key["id"] == 3
+
+
+@pytest.mark.asyncio
+async def test_create_outline_key_uses_pooled_key():
+    pool = AsyncMock()
+    pool.enabled = True
+    pool.claim.return_value = {"id": 8, "accessUrl": "ss://8", "name": "vpn_1"}
+    with patch("bot.KEY_POOL", pool), patch("bot.get_client") as get_client:
+        key = await create_outline_key(label="vpn_1")
+    get_client.assert_not_called()
+    assert key["id"] == 8
@@ -19,7 +19,9 @@ async def test_menu_keys_shows_expiration():
     date_str = time.strftime("%d.%m.%Y", time.localtime(exp))
     with patch(
         "bot.get_active_key", new=AsyncMock(return_value=("url", exp, False))
-    ), patch("bot.send_temporary", new=AsyncMock()) as send_mock, patch(
+    ), patch("bot.get_key_usage", new=AsyncMock(return_value=None)), patch(
+        "bot.send_temporary", new=AsyncMock()
+    ) as send_mock, patch(
         "bot.time.time", return_value=0
     ):
         await menu_keys(message)
@@ -29,3 +31,14 @@ async def test_menu_keys_shows_expiration():
         assert date_str in first_text
         assert "url" == second_text
 
+
+@pytest.mark.asyncio
+async def test_menu_keys_shows_stored_usage():
+    message = SimpleNamespace(from_user=SimpleNamespace(id=1), chat=SimpleNamespace(id=2))
+    with patch(
+        "bot.get_active_key", new=AsyncMock(return_value=("url", 123, False))
+    ), patch("bot.get_key_usage", new=AsyncMock(return_value=3 * 1024**3)), patch(
+        "bot.send_temporary", new=AsyncMock()
+    ) as send_mock, patch("bot.time.time", return_value=0):
+        await menu_keys(message)
+    assert "3.0 \u0413\u0411" in send_mock.await_args_list[0].args[2]
@@ -0,0 +1,107 @@
+"""Tests for the Prometheus metrics."""
+
+import os
+import sys
+
+import aiohttp
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import db  # noqa: E402
+import metrics  # noqa: E402
+from metrics import DB, HANDLERS, Latency, instrument, instrument_dispatcher  # noqa: E402
+
+TOKEN = "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX"
+
+
+async def fetch(value):
+    return value
+
+
+async def explode():
+    raise ValueError("boom")
+
+
+@pytest.mark.asyncio
+async def test_instrument_times_public_coroutines():
+    family = Latency("test", "Test calls.", "function")
+    namespace = {
+        "__name__": __name__,
+        "fetch": fetch,
+        "explode": explode,
+        "_private": fetch,
+    }
+    assert instrument(namespace, family) == 2
+    assert await namespace["fetch"](5) == 5
+    with pytest.raises(ValueError):
+        await namespace["explode"]()
+    assert namespace["_private"] is fetch
+    assert family.children["fetch"].count == 1
+    assert family.children["explode"].errors == 1
+
+    text = "\n".join(family.render())
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{function="fetch",le="+Inf"} 1' in text
+    assert 'test_seconds_count{function="explode"} 1' in text
+    assert 'test_errors_total{function="explode"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_db_functions_are_timed(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "metrics.sqlite"), raising=False)
+    await db.init_db()
+    try:
+        before = DB.child("get_users_stats").count
+        await db.get_users_stats()
+        assert DB.child("get_users_stats").count == before + 1
+        # Nested db calls are part of the outer call, not counted again
+        outer, inner = DB.child("get_active_key").count, DB.child("get_key_rows").count
+        await db.get_active_key(1)
+        assert DB.child("get_active_key").count == outer + 1
+        assert DB.child("get_key_rows").count == inner
+    finally:
+        await db.close_db()
+
+
+@pytest.mark.asyncio
+async def test_handlers_are_timed_by_name():
+    dp = Dispatcher()
+    instrument_dispatcher(dp)
+
+    @dp.message()
+    async def echo_handler(message):
+        pass
+
+    update = Update.model_validate(
+        {
+            "update_id": 1,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": 1, "type": "private"},
+                "text": "hi",
+            },
+        }
+    )
+    await dp.feed_update(Bot(TOKEN), update)
+    assert HANDLERS.children["echo_handler"].count == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_are_served_over_http():
+    metrics.add_gauge("test_gauge", "A test value.", lambda: 42)
+    runner = await metrics.start_metrics_server(port=0)
+    try:
+        port = runner.addresses[0][1]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                assert resp.status == 200
+                text = await resp.text()
+    finally:
+        await runner.cleanup()
+        metrics._gauges.pop("test_gauge")
+    assert "# TYPE bot_db_seconds histogram" in text
+    assert "test_gauge 42" in text
@@ -6,19 +6,17 @@ import pytest
 from bot import notify_expirations_loop
 
 @pytest.mark.asyncio
-async def test_notify_expirations_loop_selects_all_keys():
-    conn = AsyncMock()
-    conn.__aenter__.return_value = conn
-    conn.__aexit__.return_value = AsyncMock()
-    cursor = AsyncMock()
-    conn.execute.return_value = cursor
-    cursor.fetchall.return_value = []
+async def test_notify_expirations_loop_sends_due_reminders_once_per_user():
+    rows = [(1, 100, 3), (1, 50, 0), (2, 10, -1), (3, 500, 5)]
 
-    with patch("bot.get_connection", return_value=conn), \
-         patch("bot.bot.send_message", new=AsyncMock()), \
+    with patch("bot.get_due_notifications", new=AsyncMock(return_value=rows)) as due, \
+         patch("bot.set_last_notifications", new=AsyncMock()) as store, \
+         patch("bot.bot.send_message", new=AsyncMock()) as send, \
+         patch("bot.time.time", return_value=1000), \
          patch("bot.asyncio.sleep", new=AsyncMock(side_effect=asyncio.CancelledError)):
         with pytest.raises(asyncio.CancelledError):
             await notify_expirations_loop(interval=0)
 
-    query = conn.execute.await_args.args[0].lower()
-    assert "is_trial" not in query
+    due.assert_awaited_once_with(1000)
+    assert [c.args[0] for c in send.await_args_list] == [1, 2]
+    store.assert_awaited_once_with([1, 2], 1000)
@@ -0,0 +1,99 @@
+"""Tests for the outgoing message limiter."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from outbound import BULK, INTERACTIVE, OutboundLimiter, bulk  # noqa: E402
+
+
+def recorder(sent):
+    async def make_request(bot, method):
+        sent.append(method)
+        return True
+
+    return make_request
+
+
+@pytest.mark.asyncio
+async def test_other_methods_are_not_paced():
+    limiter = OutboundLimiter(rate=1, chat_rate=1, chat_burst=1)
+    sent = []
+    for _ in range(5):
+        await limiter(recorder(sent), None, GetMe())
+    assert len(sent) == 5
+    assert limiter.stats()["sent"] == 0
+
+
+@pytest.mark.asyncio
+async def test_messages_to_one_chat_are_spaced():
+    limiter = OutboundLimiter(rate=1000, chat_rate=20, chat_burst=1)
+    sent = []
+    started = time.monotonic()
+    for _ in range(3):
+        await limiter(recorder(sent), None, SendMessage(chat_id=1, text="x"))
+    assert time.monotonic() - started >= 0.09
+    assert limiter.stats()["sent"] == 3
+
+
+@pytest.mark.asyncio
+async def test_interactive_messages_overtake_bulk_backlog():
+    limiter = OutboundLimiter(rate=50, chat_rate=1, chat_burst=1)
+    sent = []
+    make_request = recorder(sent)
+
+    async def send(chat_id):
+        await limiter(make_request, None, SendMessage(chat_id=chat_id, text="x"))
+
+    async def send_bulk(chat_id):
+        with bulk():
+            await send(chat_id)
+
+    reminders = [asyncio.create_task(send_bulk(n)) for n in range(1, 7)]
+    await asyncio.sleep(0)
+    assert limiter.stats()["backlog"][BULK] >= 5
+    await send(100)
+    order = [method.chat_id for method in sent]
+    assert order.index(100) <= 2
+    await asyncio.gather(*reminders)
+    assert limiter.stats()["backlog"] == {INTERACTIVE: 0, BULK: 0}
+    assert limiter.stats()["sent"] == 7
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_waited_out():
+    limiter = OutboundLimiter(rate=1000, chat_rate=1000, chat_burst=5)
+    method = SendMessage(chat_id=1, text="x")
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=0.1)
+        return True
+
+    assert await limiter(make_request, None, method) is True
+    assert calls[1] - calls[0] >= 0.09
+    assert limiter.stats()["retried"] == 1
+    assert limiter.stats()["sent"] == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_after_gives_up_after_max_retries():
+    limiter = OutboundLimiter(rate=1000, chat_rate=1000, chat_burst=5, max_retries=1)
+    method = SendMessage(chat_id=1, text="x")
+
+    async def make_request(bot, method):
+        raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=0)
+
+    with pytest.raises(TelegramRetryAfter):
+        await limiter(make_request, None, method)
+    assert limiter.stats()["retried"] == 2
+    assert limiter.stats()["failed"] == 1
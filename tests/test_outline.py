@@ -2,28 +2,168 @@
 
 import os
 import sys
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
 os.environ.setdefault("BOT_TOKEN", "TEST")
 
 from bot import create_outline_key  # noqa: E402
+from outline_api.client import OutlineAPIError, OutlineClient  # noqa: E402
+from outline_api.resilience import CircuitOpenError, RetryBudget  # noqa: E402
 
 
 @pytest.mark.asyncio
 async def test_create_outline_key_calls_manager():
-    os.environ["OUTLINE_API_URL"] = "https://example.com/api"
+    client = AsyncMock()
+    client.create_key.return_value = {"accessUrl": "url", "id": 11}
     with patch("bot.OUTLINE_API_URL", "https://example.com/api"), patch(
-        "bot.Manager"
-    ) as manager_cls:
-        manager = manager_cls.return_value
-        manager.new.return_value = {"accessUrl": "url", "id": 11}
+        "bot.get_client", return_value=client
+    ) as get_client:
         res = await create_outline_key(label="vpn_7")
-        manager_cls.assert_called_with(
-            apiurl="https://example.com/api", apicrt=""
-        )
-        manager.new.assert_called_with("vpn_7")
-        manager.rename.assert_called_with(11, "vpn_7")
-        assert res == {"accessUrl": "url", "id": 11}
+    get_client.assert_called_with("https://example.com/api")
+    client.create_key.assert_awaited_with("vpn_7")
+    assert res == {"accessUrl": "url", "id": 11, "server": "example.com"}
+
+
+async def start_server(ignore_name: bool) -> tuple[TestServer, list]:
+    calls = []
+
+    async def create(request):
+        body = await request.json()
+        calls.append(("create", body))
+        name = "" if ignore_name else body.get("name", "")
+        return web.json_response({"id": "3", "name": name, "accessUrl": "ss://k"}, status=201)
+
+    async def rename(request):
+        calls.append(("rename", request.match_info["key_id"], (await request.json())["name"]))
+        return web.Response(status=204)
+
+    async def delete(request):
+        return web.Response(status=404, text="missing")
+
+    app = web.Application()
+    app.router.add_post("/secret/access-keys", create)
+    app.router.add_put("/secret/access-keys/{key_id}/name", rename)
+    app.router.add_delete("/secret/access-keys/{key_id}", delete)
+    server = TestServer(app)
+    await server.start_server()
+    return server, calls
+
+
+@pytest.mark.asyncio
+async def test_client_names_key_on_creation():
+    server, calls = await start_server(ignore_name=False)
+    client = OutlineClient(str(server.make_url("/secret")))
+    try:
+        key = await client.create_key("vpn_1")
+    finally:
+        await client.close()
+        await server.close()
+    assert key == {"id": "3", "name": "vpn_1", "accessUrl": "ss://k"}
+    assert calls == [("create", {"name": "vpn_1"})]
+
+
+@pytest.mark.asyncio
+async def test_client_renames_when_server_ignores_name():
+    server, calls = await start_server(ignore_name=True)
+    client = OutlineClient(str(server.make_url("/secret")))
+    try:
+        key = await client.create_key("vpn_2")
+        with pytest.raises(OutlineAPIError) as err:
+            await client.delete_key("3")
+    finally:
+        await client.close()
+        await server.close()
+    assert key["name"] == "vpn_2"
+    assert calls == [("create", {"name": "vpn_2"}), ("rename", "3", "vpn_2")]
+    assert err.value.status == 404
+
+
+async def start_flaky_server(statuses: list[int]) -> tuple[TestServer, list]:
+    """Serve every endpoint with the next status of ``statuses``."""
+    calls = []
+
+    async def handle(request):
+        calls.append(request.method)
+        status = statuses.pop(0) if statuses else 200
+        if status == 200:
+            return web.json_response({"id": "1", "name": "", "accessKeys": []})
+        return web.Response(status=status, text="busy")
+
+    app = web.Application()
+    app.router.add_route("*", "/secret/{tail:.*}", handle)
+    server = TestServer(app)
+    await server.start_server()
+    return server, calls
+
+
+@pytest.mark.asyncio
+async def test_idempotent_request_is_retried():
+    server, calls = await start_flaky_server([503, 502])
+    client = OutlineClient(str(server.make_url("/secret")), retry_delay=0)
+    try:
+        assert await client.list_keys() == []
+    finally:
+        await client.close()
+        await server.close()
+    assert calls == ["GET", "GET", "GET"]
+    latency = client.stats()["latency"]["list_keys"]
+    assert latency["count"] == 3
+    assert latency["errors"] == 2
+
+
+@pytest.mark.asyncio
+async def test_create_is_only_retried_when_server_did_not_act():
+    server, calls = await start_flaky_server([503, 500])
+    client = OutlineClient(str(server.make_url("/secret")), retry_delay=0)
+    try:
+        with pytest.raises(OutlineAPIError) as err:
+            await client.create_key()
+    finally:
+        await client.close()
+        await server.close()
+    assert err.value.status == 500
+    assert calls == ["POST", "POST"]
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_and_fails_fast(monkeypatch):
+    server, calls = await start_flaky_server([500] * 5)
+    client = OutlineClient(str(server.make_url("/secret")), retries=0)
+    try:
+        for _ in range(5):
+            with pytest.raises(OutlineAPIError):
+                await client.list_keys()
+        with pytest.raises(CircuitOpenError) as err:
+            await client.list_keys()
+        assert len(calls) == 5
+        assert isinstance(err.value.cause, OutlineAPIError)
+        # After the reset timeout one probe closes the circuit again
+        monkeypatch.setattr(client.breaker, "reset", 0)
+        assert await client.list_keys() == []
+        assert client.breaker.state == "closed"
+    finally:
+        await client.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_limits_retries(monkeypatch):
+    budget = RetryBudget(ratio=0, minimum=1)
+    monkeypatch.setattr("outline_api.client.retry_budget", budget)
+    server, calls = await start_flaky_server([503] * 10)
+    client = OutlineClient(str(server.make_url("/secret")), retry_delay=0)
+    try:
+        for _ in range(2):
+            with pytest.raises(OutlineAPIError):
+                await client.list_keys()
+    finally:
+        await client.close()
+        await server.close()
+    # One retry is allowed in total, not one per request
+    assert len(calls) == 3
+    assert budget.exhausted == 2
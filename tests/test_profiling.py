@@ -0,0 +1,94 @@
+"""Tests for admin-triggered profiling."""
+
+import asyncio
+import os
+import pstats
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from admin import cmd_profile_start, cmd_profile_stop  # noqa: E402
+from profiling import (  # noqa: E402
+    CPROFILE,
+    PROFILE_MAX_SECONDS,
+    PROFILER,
+    Profile,
+    StackSampler,
+)
+
+
+def busy(seconds: float) -> int:
+    total = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+
+def test_sampler_collapses_stacks():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    busy(0.1)
+    sampler.stop()
+    assert sampler.samples > 0
+    lines = sampler.collapsed().decode().splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.endswith("test_profiling.py:busy")
+    assert int(count) > 0
+
+
+def test_cprofile_result_loads_with_pstats(tmp_path):
+    profile = Profile(CPROFILE, 10)
+    profile.start()
+    busy(0.01)
+    name, data, summary = profile.stop()
+    assert name.endswith(".pstats")
+    assert "calls" in summary
+    path = tmp_path / name
+    path.write_bytes(data)
+    functions = {func for _, _, func in pstats.Stats(str(path)).stats}
+    assert "busy" in functions
+
+
+def admin_message(text: str, user_id: int = 124508057):
+    return SimpleNamespace(
+        text=text,
+        from_user=SimpleNamespace(id=user_id),
+        chat=SimpleNamespace(id=user_id),
+        bot=SimpleNamespace(send_document=AsyncMock()),
+        answer=AsyncMock(),
+    )
+
+
+@pytest.mark.asyncio
+async def test_profile_commands_are_capped_and_send_a_document():
+    denied = admin_message("/profile_start 5", user_id=1)
+    await cmd_profile_start(denied)
+    assert not PROFILER.running
+
+    message = admin_message(f"/profile_start {PROFILE_MAX_SECONDS * 10} sample")
+    await cmd_profile_start(message)
+    try:
+        assert PROFILER.profile.seconds == PROFILE_MAX_SECONDS
+        await cmd_profile_start(admin_message("/profile_start 5"))
+    finally:
+        await cmd_profile_stop(message)
+    assert not PROFILER.running
+    document = message.bot.send_document.await_args
+    assert document.args[0] == 124508057
+    assert document.args[1].filename.endswith(".collapsed.txt")
+
+
+@pytest.mark.asyncio
+async def test_profile_stops_by_itself():
+    bot = SimpleNamespace(send_document=AsyncMock())
+    PROFILER.start(bot, 42, 0, CPROFILE)
+    await asyncio.sleep(0.05)
+    assert not PROFILER.running
+    assert bot.send_document.await_args.args[1].filename.endswith(".pstats")
@@ -0,0 +1,151 @@
+"""Query plan regression tests for ``db.py``.
+
+Every public database function is run against a seeded database while the
+executed SQL is traced. Each traced statement is then checked with
+``EXPLAIN QUERY PLAN`` and must not scan a table or index, apart from the
+scans listed in ``ALLOWED_SCANS``.
+"""
+
+import inspect
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import db  # noqa: E402
+
+# Functions that run no data queries
+EXEMPT = {"init_db", "close_db", "flush_writes"}
+
+# Tables that stay small by design and may be scanned
+SMALL_TABLES = {"pending_deletions", "key_pool", "server_traffic", "broadcasts"}
+
+# Index scans allowed by design, by function; any other SCAN is a failure
+ALLOWED_SCANS = {
+    # Counts every stored key, once per SERVER_LOAD_TTL
+    "count_keys_by_server": {"SCAN vpn_access USING COVERING INDEX idx_vpn_access_server"},
+    # Walk the index in order and stop after LIMIT rows
+    "get_top_traffic": {"SCAN t USING INDEX idx_key_traffic_bytes"},
+    "get_users_page": {"SCAN users USING INDEX idx_users_page"},
+    # OFFSET paging reads every skipped row; /userlist uses get_users_page
+    "get_all_users": {"SCAN users USING INDEX idx_users_page"},
+}
+
+NOW = 1_700_000_000
+
+
+async def walk_user_pages():
+    rows, _, cursor = await db.get_users_page(limit=5)
+    rows, prev_cursor, _ = await db.get_users_page(cursor, limit=5)
+    await db.get_users_page(prev_cursor, limit=5, before=True)
+
+
+CALLS = {
+    "add_key": lambda: db.add_key(1, 10, "url", NOW + 3600, False),
+    "clear_key": lambda: db.clear_key(2, True),
+    "clear_keys": lambda: db.clear_keys([(3, False), (4, True)]),
+    "get_scheduled_keys": lambda: db.get_scheduled_keys(NOW + 86400),
+    "get_key_rows": lambda: db.get_key_rows(1),
+    "get_active_key": lambda: db.get_active_key(1),
+    "has_used_trial": lambda: db.has_used_trial(1),
+    "has_vpn_history": lambda: db.has_vpn_history(1),
+    "record_referral": lambda: db.record_referral(500, 1),
+    "get_key_info": lambda: db.get_key_info(1),
+    "update_expiration": lambda: db.update_expiration(1, False, NOW + 7200),
+    "get_last_notification": lambda: db.get_last_notification(1),
+    "set_last_notification": lambda: db.set_last_notification(1, NOW),
+    "set_last_notifications": lambda: db.set_last_notifications([1, 2], NOW),
+    "get_due_notifications": lambda: db.get_due_notifications(NOW),
+    "save_user": lambda: db.save_user(3, "carol"),
+    "add_pending_deletion": lambda: db.add_pending_deletion(5, 50, NOW),
+    "remove_pending_deletions": lambda: db.remove_pending_deletions([(5, 50)]),
+    "get_pending_deletions": lambda: db.get_pending_deletions(),
+    "add_pool_keys": lambda: db.add_pool_keys([(900, "ss://pool", "a:1")]),
+    "remove_pool_keys": lambda: db.remove_pool_keys("b:1"),
+    "get_pool_key_ids": lambda: db.get_pool_key_ids("a:1"),
+    "count_keys_by_server": lambda: db.count_keys_by_server(),
+    "assign_default_server": lambda: db.assign_default_server("a:1"),
+    "get_server_keys": lambda: db.get_server_keys("a:1", 5, limit=10),
+    "move_key": lambda: db.move_key(6, True, 6, 600, "url", "b:1"),
+    "claim_pool_key": lambda: db.claim_pool_key(),
+    "count_pool_keys": lambda: db.count_pool_keys(),
+    "store_traffic": lambda: db.store_traffic("a:1", {1: 500, 2: 700}, NOW),
+    "get_key_usage": lambda: db.get_key_usage(1),
+    "get_top_traffic": lambda: db.get_top_traffic(5),
+    "get_server_traffic": lambda: db.get_server_traffic(),
+    "get_all_users": lambda: db.get_all_users(offset=5, limit=10),
+    "get_users_page": walk_user_pages,
+    "get_users_stats": lambda: db.get_users_stats(),
+    "refresh_users_stats": lambda: db.refresh_users_stats(NOW + 5000),
+    "get_user_ids": lambda: db.get_user_ids(5, limit=10),
+    "create_broadcast": lambda: db.create_broadcast(1, "hello"),
+    "update_broadcast": lambda: db.update_broadcast(1, 10, 9, 1),
+    "get_running_broadcasts": lambda: db.get_running_broadcasts(),
+}
+
+
+def public_db_functions() -> set[str]:
+    return {
+        name
+        for name, func in inspect.getmembers(db, inspect.iscoroutinefunction)
+        if func.__module__ == "db" and not name.startswith("_")
+    } - EXEMPT
+
+
+def full_scans(conn: sqlite3.Connection, sql: str) -> list[str]:
+    plan = [detail for *_, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    # Scanning the result of a subquery is not a table scan
+    subqueries = {
+        detail.split()[-1]
+        for detail in plan
+        if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))
+    }
+    return [
+        detail
+        for detail in plan
+        if detail.startswith("SCAN ")
+        and detail.split()[1] not in subqueries | SMALL_TABLES
+    ]
+
+
+def test_every_db_function_is_covered():
+    assert public_db_functions() == set(CALLS)
+
+
+@pytest.mark.asyncio
+async def test_db_queries_avoid_full_table_scans(tmp_path, monkeypatch):
+    db_file = tmp_path / "plans.sqlite"
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    # Cache hits would hide the queries behind the cached functions
+    monkeypatch.setattr(db.key_cache, "enabled", False)
+    await db.init_db()
+    for user_id in range(1, 200):
+        await db.add_key(user_id, user_id, f"url{user_id}", NOW + user_id * 600, user_id % 2 == 0)
+
+    statements: dict[str, list[str]] = {}
+    for name, call in CALLS.items():
+        traced = statements[name] = []
+        for conn in db._pool._conns:
+            await conn.set_trace_callback(traced.append)
+        await call()
+    for conn in db._pool._conns:
+        await conn.set_trace_callback(None)
+    await db.close_db()
+
+    queries = {
+        (name, sql.strip())
+        for name, traced in statements.items()
+        for sql in traced
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT"))
+    }
+    assert queries
+    with sqlite3.connect(db_file) as conn:
+        problems = {
+            (name, sql): scans
+            for name, sql in queries
+            if (scans := set(full_scans(conn, sql)) - ALLOWED_SCANS.get(name, set()))
+        }
+    assert problems == {}
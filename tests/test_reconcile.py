@@ -0,0 +1,148 @@
+"""Tests for reconciling Outline server keys with the database."""
+
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from admin import RUNNING, cmd_reconcile  # noqa: E402
+from db import (  # noqa: E402
+    add_key,
+    add_pool_keys,
+    close_db,
+    get_key_rows,
+    get_pool_key_ids,
+    init_db,
+)
+from key_pool import KeyPool  # noqa: E402
+from outline_api.client import OutlineClient  # noqa: E402
+from outline_api.testing import FakeOutlineServer  # noqa: E402
+from reconcile import Reconciler  # noqa: E402
+from servers import OutlineServers  # noqa: E402
+
+URL = "https://a.example:1/s"
+SERVER = "a.example:1"
+
+
+def server_keys(*keys):
+    return [{"id": str(key_id), "name": name} for key_id, name in keys]
+
+
+async def make_reconciler(tmp_path, monkeypatch, keys):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "reconcile.db"), raising=False)
+    await init_db()
+    client = AsyncMock()
+    client.list_keys.return_value = keys
+    servers = OutlineServers([URL], lambda url: client)
+    return Reconciler(lambda: servers, sleep=AsyncMock()), client
+
+
+@pytest.mark.asyncio
+async def test_timed_run_deletes_orphans_seen_twice(tmp_path, monkeypatch):
+    keys = server_keys((1, "vpn_1"), (2, "vpn_2"), (3, "pool"), (4, "admin laptop"))
+    reconciler, client = await make_reconciler(tmp_path, monkeypatch, keys)
+    try:
+        await add_key(1, 1, "url", 9_999_999_999, False, server=SERVER)
+        await add_pool_keys([(3, "ss://3", SERVER)])
+        first = await reconciler.run()
+        client.delete_key.assert_not_awaited()
+        assert first[SERVER]["orphans"] == 1
+        assert first[SERVER]["pending"] == 1
+        assert first[SERVER]["foreign"] == 1
+        second = await reconciler.run()
+        client.delete_key.assert_awaited_once_with("2")
+        assert second[SERVER]["deleted"] == 1
+        assert second[SERVER]["pending"] == 0
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_expired_rows_are_cleared_and_orphans_wait_for_second_run(tmp_path, monkeypatch):
+    keys = server_keys(*[(i, f"vpn_{i}") for i in range(1, 6)], (9, "ref_bonus_9_1"))
+    reconciler, client = await make_reconciler(tmp_path, monkeypatch, keys)
+    try:
+        for user_id in range(1, 6):
+            await add_key(user_id, user_id, "url", 9_999_999_999, False, server=SERVER)
+        await add_key(7, 7, "url", 100, True, server=SERVER)  # long expired
+        await add_key(8, 5, "url", 100, False, server="b.example:2")
+        summary = (await reconciler.run())[SERVER]
+        client.delete_key.assert_not_awaited()
+        assert summary["pending"] == 1
+        assert summary["expired"] == 1
+        assert summary["cleared"] == 1
+        assert summary["missing"] == 1
+        assert (await get_key_rows(7))[0][1] is None
+        await reconciler.run()
+        client.delete_key.assert_awaited_once_with("9")
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_mass_orphans_are_not_deleted(tmp_path, monkeypatch):
+    keys = server_keys(*[(i, f"vpn_{i}") for i in range(1, 21)])
+    reconciler, client = await make_reconciler(tmp_path, monkeypatch, keys)
+    try:
+        await reconciler.run()
+        summary = (await reconciler.run())[SERVER]
+    finally:
+        await close_db()
+    client.delete_key.assert_not_awaited()
+    assert summary["refused"] is True
+
+
+@pytest.mark.asyncio
+async def test_startup_reconcile_spares_keys_of_a_running_refill(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "reconcile.db"), raising=False)
+    await init_db()
+    fake = FakeOutlineServer(latency=(0.01, 0.05), seed=1)
+    await fake.start()
+    client = OutlineClient(fake.url)
+    servers = OutlineServers([fake.url], lambda url: client)
+    server = servers.default
+
+    async def create(name):
+        key = await client.create_key(name)
+        key["server"] = server
+        return key
+
+    pool = KeyPool(create, AsyncMock(), low=1, high=30)
+    reconciler = Reconciler(lambda: servers, delete_rate=1000)
+    try:
+        stored = await asyncio.gather(*(client.create_key(f"vpn_{n}") for n in range(100)))
+        for user_id, key in enumerate(stored, 1):
+            await add_key(user_id, key["id"], key["accessUrl"], 9_999_999_999, False, server)
+        refill = asyncio.create_task(pool.refill())
+        while len(fake.keys) < 105:
+            await asyncio.sleep(0.005)
+        await asyncio.gather(refill, reconciler.loop(interval=0, confirm_delay=0.3))
+        pooled = {str(key_id) for key_id in await get_pool_key_ids(server)}
+        assert len(pooled) == 30
+        assert pooled <= set(fake.keys)
+        assert len(fake.keys) == 130
+    finally:
+        await client.close()
+        await fake.stop()
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_reconcile_command_reports_summary_when_done():
+    message = AsyncMock()
+    message.from_user.id = 124508057
+    message.chat.id = 124508057
+    summary = {"server_keys": 3, "deleted": 1, "pending": 0, "foreign": 1, "missing": 0}
+    reconciler = AsyncMock()
+    reconciler.run.return_value = {SERVER: summary}
+    await cmd_reconcile(message, reconciler)
+    await RUNNING["reconcile"]
+    assert "reconcile" not in RUNNING
+    chat_id, text = message.bot.send_message.await_args.args
+    assert chat_id == 124508057
+    assert SERVER in text
@@ -69,8 +69,12 @@ async def test_grant_referral_bonus_creates_key():
         "bot.time.time", return_value=now):
         await grant_referral_bonus(4)
         assert create_mock.await_args.kwargs["label"].startswith("ref_bonus_4_")
-        add_key_mock.assert_awaited_with(4, 8, "url", now + REFERRAL_BONUS_DAYS * 24 * 60 * 60, False)
-        sched_mock.assert_called_with(8, delay=REFERRAL_BONUS_DAYS * 24 * 60 * 60, user_id=4, is_trial=False)
+        add_key_mock.assert_awaited_with(
+            4, 8, "url", now + REFERRAL_BONUS_DAYS * 24 * 60 * 60, False, server=None
+        )
+        sched_mock.assert_called_with(
+            8, delay=REFERRAL_BONUS_DAYS * 24 * 60 * 60, user_id=4, is_trial=False, server=None
+        )
         send_mock.assert_awaited()
 
 
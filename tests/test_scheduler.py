@@ -0,0 +1,81 @@
+"""Tests for the ``DueQueue`` deadline scheduler."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from scheduler import DueQueue  # noqa: E402
+
+
+async def noop(batch):
+    pass
+
+
+def test_pop_due_orders_replaces_and_cancels():
+    queue = DueQueue(noop, batch_size=2)
+    queue.schedule("a", 30, "A")
+    queue.schedule("b", 10, "B")
+    queue.schedule("c", 20, "C")
+    queue.schedule("b", 40, "B2")  # reschedule
+    assert queue.cancel("c")
+    assert len(queue) == 2
+    assert queue.next_due() == 30
+    assert queue.pop_due(25) == []
+    assert queue.pop_due(50) == [("a", "A"), ("b", "B2")]
+    assert len(queue) == 0
+
+
+def test_pop_due_respects_batch_size():
+    queue = DueQueue(noop, batch_size=2)
+    for n in range(5):
+        queue.schedule(n, n)
+    assert [key for key, _ in queue.pop_due(10)] == [0, 1]
+    assert [key for key, _ in queue.pop_due(10)] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_worker_wakes_for_earlier_deadline():
+    handled = []
+    done = asyncio.Event()
+
+    async def handler(batch):
+        handled.extend(batch)
+        done.set()
+
+    queue = DueQueue(handler)
+    queue.schedule("late", time.time() + 3600)
+    queue.start()
+    await asyncio.sleep(0)
+    queue.schedule("soon", time.time() + 0.01, "payload")
+    await asyncio.wait_for(done.wait(), 1)
+    await queue.stop()
+    assert handled == [("soon", "payload")]
+    assert queue.due_at("late") is not None
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_entry_by_entry():
+    handled = []
+    done = asyncio.Event()
+
+    async def handler(batch):
+        if any(key == "bad" for key, _ in batch):
+            raise RuntimeError("boom")
+        handled.extend(key for key, _ in batch)
+        if len(handled) == 2:
+            done.set()
+
+    queue = DueQueue(handler)
+    now = time.time()
+    for key in ("a", "bad", "b"):
+        queue.schedule(key, now - 1)
+    queue.start()
+    await asyncio.wait_for(done.wait(), 1)
+    await queue.stop()
+    assert sorted(handled) == ["a", "b"]
+    assert len(queue) == 0
@@ -0,0 +1,156 @@
+"""Tests for multi-server key placement and server drains."""
+
+import asyncio
+import os
+import sqlite3
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from admin import RUNNING, cmd_drain  # noqa: E402
+from bot import create_outline_key, drain_server  # noqa: E402
+from db import add_key, close_db, get_key_rows, init_db  # noqa: E402
+from servers import LEAST_TRANSFER, OutlineServers, server_id  # noqa: E402
+
+URLS = ["https://a.example:1/s", "https://b.example:2/s"]
+
+
+def fake_clients():
+    clients = {}
+
+    def client(url):
+        if url not in clients:
+            counter = iter(range(100, 1000))
+            mock = clients[url] = AsyncMock()
+
+            async def create(name):
+                key_id = next(counter)
+                return {"id": key_id, "accessUrl": f"ss://{server_id(url)}/{key_id}"}
+
+            mock.create_key.side_effect = create
+        return clients[url]
+
+    return clients, client
+
+
+@pytest.mark.asyncio
+async def test_least_keys_placement_spreads_new_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "servers.db"), raising=False)
+    await init_db()
+    try:
+        for user_id in range(3):
+            await add_key(user_id, user_id, "url", 999, False, server="a.example:1")
+        _, client = fake_clients()
+        servers = OutlineServers(URLS, client)
+        chosen = [await servers.choose() for _ in range(4)]
+        assert chosen.count("b.example:2") == 3
+        servers.draining.add("b.example:2")
+        assert await servers.choose() == "a.example:1"
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_least_transfer_placement_uses_server_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "servers.db"), raising=False)
+    await init_db()
+    try:
+        clients, client = fake_clients()
+        client(URLS[0]).transfer_metrics.return_value = {"1": 10}
+        client(URLS[1]).transfer_metrics.return_value = {"1": 500, "2": 500}
+        servers = OutlineServers(URLS, client, strategy=LEAST_TRANSFER)
+        assert await servers.choose() == "a.example:1"
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_created_key_records_its_server(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "servers.db"), raising=False)
+    await init_db()
+    clients, client = fake_clients()
+    try:
+        with patch("bot.OUTLINE_API_URLS", URLS), patch(
+            "bot.get_client", side_effect=client
+        ):
+            key = await create_outline_key(label="vpn_1")
+    finally:
+        await close_db()
+    url = {server_id(url): url for url in URLS}[key["server"]]
+    clients[url].create_key.assert_awaited_with("vpn_1")
+
+
+@pytest.mark.asyncio
+async def test_drain_server_moves_keys_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "servers.db"), raising=False)
+    await init_db()
+    clients, client = fake_clients()
+    try:
+        for user_id in range(1, 6):
+            await add_key(
+                user_id, user_id, f"old{user_id}", 9_999_999_999, False, server="a.example:1"
+            )
+        with patch("bot.OUTLINE_API_URLS", URLS), patch(
+            "bot.get_client", side_effect=client
+        ), patch("bot.bot.send_message", new=AsyncMock()) as send_mock, patch(
+            "bot.asyncio.sleep", new=AsyncMock()
+        ) as sleep_mock:
+            summary = await drain_server("a.example:1", batch_size=2, delay=1)
+        assert summary["moved"] == 5
+        assert sleep_mock.await_count == 3
+        for user_id in range(1, 6):
+            (_, key_id, access_url, _, server), = await get_key_rows(user_id)
+            assert server == "b.example:2"
+            assert access_url == f"ss://b.example:2/{key_id}"
+        deleted = {c.args[0] for c in clients[URLS[0]].delete_key.await_args_list}
+        assert deleted == {1, 2, 3, 4, 5}
+        assert send_mock.await_count == 10
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_drain_command_runs_in_background():
+    _, client = fake_clients()
+    servers = OutlineServers(URLS, client)
+    release = asyncio.Event()
+
+    async def drain(server):
+        await release.wait()
+        return {"moved": 4, "skipped": 0, "failed": 1, "pooled": 2}
+
+    message = AsyncMock()
+    message.from_user.id = message.chat.id = 124508057
+    message.text = "/drain a.example:1"
+    await cmd_drain(message, lambda: servers, drain)
+    task = RUNNING["drain a.example:1"]
+    assert not task.done()
+    await cmd_drain(message, lambda: servers, drain)
+    assert "a.example:1" in message.answer.await_args.args[0]
+    release.set()
+    await task
+    chat_id, text = message.bot.send_message.await_args.args
+    assert chat_id == 124508057
+    assert "4" in text and "a.example:1" in text
+    assert "drain a.example:1" not in RUNNING
+
+
+@pytest.mark.asyncio
+async def test_init_db_adds_server_column(tmp_path, monkeypatch):
+    db_file = tmp_path / "old.db"
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(
+            "CREATE TABLE vpn_access (user_id INTEGER, is_trial INTEGER, key_id INTEGER,"
+            " access_url TEXT, expires_at INTEGER, PRIMARY KEY (user_id, is_trial))"
+        )
+        conn.execute("INSERT INTO vpn_access VALUES (1, 0, 5, 'url', 999)")
+    monkeypatch.setattr("db.DB_PATH", str(db_file), raising=False)
+    await init_db()
+    try:
+        assert await get_key_rows(1) == [(0, 5, "url", 999, None)]
+    finally:
+        await close_db()
@@ -0,0 +1,41 @@
+"""Tests for the startup cost of importing the bot."""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))  # noqa: E402
+
+from importtime import parse_importtime  # noqa: E402
+
+CHECK = """
+import sys
+import bot
+import outline_api
+print("requests" in sys.modules, "outline_api.outline_api" in sys.modules)
+print(outline_api.Manager.__name__, "requests" in sys.modules)
+"""
+
+
+def test_bot_import_does_not_load_upstream_outline_api():
+    env = dict(os.environ, BOT_TOKEN="123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["False", "False", "Manager", "True"]
+
+
+def test_parse_importtime():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   db\n"
+        "import time:      3503 |       3623 | bot\n"
+        "unrelated output\n"
+    )
+    assert parse_importtime(stderr) == {"db": (120, 120), "bot": (3503, 3623)}
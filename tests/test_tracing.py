@@ -0,0 +1,77 @@
+"""Tests for per-update tracing and the slow update log."""
+
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from metrics import DB, instrument_dispatcher, timed  # noqa: E402
+from tracing import UpdateTracer, trace_dispatcher  # noqa: E402
+
+TOKEN = "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX"
+
+
+@timed(DB, "lookup_user")
+async def lookup_user(user_id):
+    await asyncio.sleep(0.01)
+    return user_id
+
+
+def dispatcher(tracer: UpdateTracer) -> Dispatcher:
+    dp = Dispatcher()
+    instrument_dispatcher(dp)
+    trace_dispatcher(dp, tracer)
+
+    @dp.message()
+    async def slow_handler(message):
+        await lookup_user(message.from_user.id)
+
+    return dp
+
+
+def update(update_id: int) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": 7, "type": "private"},
+                "from": {"id": 7, "is_bot": False, "first_name": "Test"},
+                "text": "hi",
+            },
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_sampled_update_is_logged_with_spans(caplog):
+    tracer = UpdateTracer(sample_rate=1, slow_ms=5)
+    dp = dispatcher(tracer)
+    with caplog.at_level(logging.WARNING, logger="slow_updates"):
+        await dp.feed_update(Bot(TOKEN), update(1))
+    assert tracer.stats() == {"updates": 1, "sampled": 1, "slow": 1}
+    [record] = caplog.records
+    text = record.getMessage()
+    assert text.startswith("Update 1 (message from 7) took")
+    assert "db.lookup_user" in text
+    assert "handler.slow_handler" in text
+
+
+@pytest.mark.asyncio
+async def test_unsampled_and_fast_updates(caplog):
+    unsampled = UpdateTracer(sample_rate=0, slow_ms=5)
+    fast = UpdateTracer(sample_rate=1, slow_ms=10_000)
+    with caplog.at_level(logging.WARNING, logger="slow_updates"):
+        await dispatcher(unsampled).feed_update(Bot(TOKEN), update(2))
+        await dispatcher(fast).feed_update(Bot(TOKEN), update(3))
+    [record] = caplog.records
+    assert "(not sampled)" in record.getMessage()
+    assert "db.lookup_user" not in record.getMessage()
+    assert fast.stats() == {"updates": 1, "sampled": 1, "slow": 0}
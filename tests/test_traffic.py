@@ -0,0 +1,95 @@
+"""Tests for the cached per-key transfer statistics."""
+
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+os.environ.setdefault("BOT_TOKEN", "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX")
+
+from admin import cmd_top  # noqa: E402
+from db import (  # noqa: E402
+    add_key,
+    close_db,
+    get_key_usage,
+    get_top_traffic,
+    init_db,
+    save_user,
+)
+from servers import LEAST_TRANSFER, OutlineServers  # noqa: E402
+from traffic import format_bytes, poll_traffic  # noqa: E402
+
+URLS = ["https://a.example:1/s", "https://b.example:2/s"]
+
+
+def make_servers(metrics: dict[str, dict]) -> tuple[OutlineServers, dict]:
+    clients = {}
+    for url in URLS:
+        clients[url] = AsyncMock()
+        clients[url].transfer_metrics.return_value = metrics.get(url, {})
+    return OutlineServers(URLS, clients.__getitem__, strategy=LEAST_TRANSFER), clients
+
+
+@pytest.mark.asyncio
+async def test_poll_stores_usage_read_without_outline(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "traffic.db"), raising=False)
+    await init_db()
+    try:
+        await save_user(1, "alice")
+        await add_key(1, 5, "url", 9_999_999_999, False, server="a.example:1")
+        await add_key(2, 5, "url", 9_999_999_999, False, server="b.example:2")
+        servers, clients = make_servers(
+            {URLS[0]: {"5": 3000, "6": 10}, URLS[1]: {"5": 7000}}
+        )
+        assert await poll_traffic(servers) == 3
+        assert await get_key_usage(1) == 3000
+        assert await get_key_usage(2) == 7000
+        assert await get_key_usage(3) is None
+        top = await get_top_traffic(2)
+        assert top == [(2, None, "b.example:2", 5, 7000), (1, "alice", "a.example:1", 5, 3000)]
+
+        # Keys no longer reported are dropped on the next poll
+        clients[URLS[0]].transfer_metrics.return_value = {"6": 20}
+        monkeypatch.setattr("traffic.time.time", lambda: 9_999_999_000)
+        await poll_traffic(servers)
+        assert await get_key_usage(1) is None
+    finally:
+        await close_db()
+
+
+@pytest.mark.asyncio
+async def test_least_transfer_reads_polled_totals(tmp_path, monkeypatch):
+    monkeypatch.setattr("db.DB_PATH", str(tmp_path / "traffic.db"), raising=False)
+    await init_db()
+    try:
+        servers, clients = make_servers({URLS[0]: {"1": 900}, URLS[1]: {"1": 100}})
+        await poll_traffic(servers)
+        for client in clients.values():
+            client.transfer_metrics.reset_mock()
+        assert await servers.choose() == "b.example:2"
+        for client in clients.values():
+            client.transfer_metrics.assert_not_awaited()
+    finally:
+        await close_db()
+
+
+def test_format_bytes():
+    assert format_bytes(512) == "512 Б"
+    assert format_bytes(1536) == "1.5 КБ"
+    assert format_bytes(5 * 1024**4) == "5.0 ТБ"
+
+
+@pytest.mark.asyncio
+async def test_cmd_top_lists_heaviest_keys(monkeypatch):
+    message = SimpleNamespace(from_user=SimpleNamespace(id=124508057), answer=AsyncMock())
+    rows = [(7, "bob", "a.example:1", 3, 2 * 1024**3), (None, None, "a.example:1", 4, 10)]
+    monkeypatch.setattr("admin.get_top_traffic", AsyncMock(return_value=rows))
+    await cmd_top(message)
+    text = message.answer.await_args.args[0]
+    assert text.splitlines() == [
+        "1. @bob | ID: 7 | 2.0 ГБ | a.example:1",
+        "2. - | ключ 4 | 10 Б | a.example:1",
+    ]
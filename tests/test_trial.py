@@ -1,6 +1,5 @@
 """Tests for trial key workflow and scheduled deletion."""
 
-import asyncio
 import os
 import sys
 from types import SimpleNamespace
@@ -11,21 +10,53 @@ import pytest
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
 os.environ.setdefault("BOT_TOKEN", "TEST")
 
-from bot import callback_trial, schedule_key_deletion  # noqa: E402
+from bot import (  # noqa: E402
+    KEY_EXPIRY,
+    callback_trial,
+    expire_keys,
+    schedule_key_deletion,
+)
 
 
 @pytest.mark.asyncio
-async def test_schedule_key_deletion_removes_key(task_spy):
-    tasks, fake_create_task = task_spy
+async def test_schedule_key_deletion_removes_key():
+    manager = AsyncMock()
+    with patch("bot.outline_manager", return_value=manager), patch(
+        "bot.time.time", return_value=100
+    ), patch("bot.clear_keys", new=AsyncMock()) as clear_mock:
+        schedule_key_deletion(5, delay=5)
+        assert KEY_EXPIRY.due_at(("key", 5)) == 105
+        await expire_keys(KEY_EXPIRY.pop_due(105))
+    manager.delete_key.assert_awaited_with(5)
+    clear_mock.assert_awaited_with([])
 
-    manager = Mock()
+
+@pytest.mark.asyncio
+async def test_expired_user_key_is_deleted_and_cleared():
+    manager = AsyncMock()
+    rows = [(1, 7, "url", 90, None)]
+    with patch("bot.outline_manager", return_value=manager), patch(
+        "bot.time.time", return_value=100
+    ), patch("bot.get_key_rows", new=AsyncMock(return_value=rows)), patch(
+        "bot.clear_keys", new=AsyncMock()
+    ) as clear_mock:
+        schedule_key_deletion(7, delay=-10, user_id=3, is_trial=True)
+        await expire_keys(KEY_EXPIRY.pop_due(100))
+    manager.delete_key.assert_awaited_with(7)
+    clear_mock.assert_awaited_with([(3, True)])
+
+
+@pytest.mark.asyncio
+async def test_renewed_key_is_rescheduled_not_deleted():
+    manager = AsyncMock()
+    rows = [(0, 8, "url", 500, None)]
     with patch("bot.outline_manager", return_value=manager), patch(
-        "bot.asyncio.create_task", side_effect=fake_create_task
-    ), patch("bot.asyncio.sleep", new=AsyncMock()) as sleep_mock:
-        _ = schedule_key_deletion(5, delay=5)
-        await asyncio.gather(*tasks)
-        assert any(c.args[0] == 5 for c in sleep_mock.await_args_list)
-        manager.delete.assert_called_with(5)
+        "bot.time.time", return_value=100
+    ), patch("bot.get_key_rows", new=AsyncMock(return_value=rows)):
+        await expire_keys([((4, False), (8, 4, False, None))])
+    manager.delete_key.assert_not_awaited()
+    assert KEY_EXPIRY.due_at((4, False)) == 500
+    KEY_EXPIRY.cancel((4, False))
 
 
 @pytest.mark.asyncio
@@ -54,7 +85,7 @@ async def test_callback_trial_creates_key_and_schedules_deletion():
         create_key_mock.assert_awaited_with(label="vpn_1")
         add_key_mock.assert_awaited()
         sched_mock.assert_called_with(
-            key["id"], delay=24 * 60 * 60, user_id=1, is_trial=True
+            key["id"], delay=24 * 60 * 60, user_id=1, is_trial=True, server=None
         )
         send_mock.assert_awaited()
         callback.answer.assert_awaited()
@@ -0,0 +1,85 @@
+"""Tests for serving updates from a webhook."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+TOKEN = "123456789:TESTTOKENEXAMPLEEXAMPLEEXAMPLEEX"
+
+
+def update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+            "text": "hi",
+        },
+    }
+
+
+def blocking_dispatcher(release: asyncio.Event, seen: list):
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message):
+        seen.append(message.message_id)
+        await release.wait()
+
+    return dp
+
+
+@pytest.mark.asyncio
+async def test_updates_are_limited_and_drained():
+    release = asyncio.Event()
+    seen = []
+    server = WebhookServer(
+        blocking_dispatcher(release, seen), Bot(TOKEN), secret="s3", max_handlers=2
+    )
+    server.ready = True
+    async with TestClient(TestServer(server.app())) as client:
+        headers = {SECRET_HEADER: "s3"}
+        assert (await client.post("/webhook", json=update(1))).status == 401
+        for n in (1, 2):
+            assert (await client.post("/webhook", json=update(n), headers=headers)).status == 200
+        third = asyncio.create_task(client.post("/webhook", json=update(3), headers=headers))
+        await asyncio.sleep(0.05)
+        # The third request waits until a handler finishes
+        assert not third.done()
+        assert seen == [1, 2]
+        assert server.stats()["in_flight"] == 2
+
+        drained = asyncio.create_task(server.drain())
+        await asyncio.sleep(0)
+        assert (await client.get("/readyz")).status == 503
+        assert (await client.get("/healthz")).status == 200
+        assert (await client.post("/webhook", json=update(4), headers=headers)).status == 503
+        release.set()
+        assert (await third).status == 200
+        assert await drained == 0
+        assert server.stats()["handled"] == 3
+
+
+@pytest.mark.asyncio
+async def test_drain_cancels_handlers_after_timeout():
+    release = asyncio.Event()
+    server = WebhookServer(
+        blocking_dispatcher(release, []), Bot(TOKEN), drain_timeout=0.05
+    )
+    server.ready = True
+    async with TestClient(TestServer(server.app())) as client:
+        assert (await client.get("/readyz")).status == 200
+        assert (await client.post("/webhook", json=update(1))).status == 200
+        assert (await client.post("/webhook", json={"update_id": "x"})).status == 400
+        await asyncio.sleep(0)
+        assert await server.drain() == 1
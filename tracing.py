@@ -0,0 +1,124 @@
+"""Per-update span tracing with a log of slow updates.
+
+An outer dispatcher middleware opens a trace for a sampled share of the
+incoming updates. Database functions, Outline requests and Telegram API
+calls add child spans to the trace of the update they run for, so an update
+slower than ``SLOW_UPDATE_MS`` is logged with a breakdown of where the time
+went. Updates outside the sample are only timed as a whole; slow ones are
+still logged, without spans.
+"""
+
+import contextvars
+import logging
+import os
+import random
+import time
+
+# Share of updates traced with child spans, from 0 to 1
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+# Updates taking longer than this many milliseconds are written to the slow log
+SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS", "1000"))
+
+# Optional file the slow log is also written to
+SLOW_LOG_PATH = os.getenv("SLOW_LOG_PATH", "")
+
+# Spans kept per trace; the rest are counted but not stored
+MAX_SPANS = 200
+
+slow_log = logging.getLogger("slow_updates")
+if SLOW_LOG_PATH:
+    slow_log.addHandler(logging.FileHandler(SLOW_LOG_PATH))
+
+
+class Trace:
+    __slots__ = ("started", "spans", "dropped")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float, float, bool]] = []
+        self.dropped = 0
+
+
+_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("trace", default=None)
+
+
+def add_span(name: str, started: float, duration: float, error: bool = False) -> None:
+    """Record a finished span of the current update, if it is traced.
+
+    ``started`` is a ``time.perf_counter()`` reading.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return
+    if len(trace.spans) >= MAX_SPANS:
+        trace.dropped += 1
+        return
+    trace.spans.append((name, started - trace.started, duration, error))
+
+
+def format_trace(title: str, total: float, trace: Trace | None) -> str:
+    lines = [f"{title} took {total * 1000:.0f} ms"]
+    if trace is None:
+        lines.append("  (not sampled)")
+        return "\n".join(lines)
+    for name, offset, duration, error in trace.spans:
+        lines.append(
+            f"  +{offset * 1000:7.1f} ms {duration * 1000:8.1f} ms  {name}"
+            + ("  !" if error else "")
+        )
+    if trace.dropped:
+        lines.append(f"  ... {trace.dropped} more spans")
+    return "\n".join(lines)
+
+
+def describe(update) -> str:
+    event = update.event_type
+    user = getattr(getattr(update.event, "from_user", None), "id", None)
+    return f"Update {update.update_id} ({event} from {user})"
+
+
+class UpdateTracer:
+    """Outer ``dp.update`` middleware timing every update as the root span."""
+
+    def __init__(
+        self, sample_rate: float = TRACE_SAMPLE_RATE, slow_ms: int = SLOW_UPDATE_MS
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.slow = slow_ms / 1000
+        self.updates = 0
+        self.sampled = 0
+        self.slow_updates = 0
+
+    async def __call__(self, handler, update, data):
+        self.updates += 1
+        trace = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            trace = Trace()
+            self.sampled += 1
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(update, data)
+        finally:
+            total = time.perf_counter() - started
+            _trace.reset(token)
+            if total >= self.slow:
+                self.slow_updates += 1
+                slow_log.warning(format_trace(describe(update), total, trace))
+
+    def stats(self) -> dict:
+        return {
+            "updates": self.updates,
+            "sampled": self.sampled,
+            "slow": self.slow_updates,
+        }
+
+
+# Shared so every dispatcher reports into the same counters
+TRACER = UpdateTracer()
+
+
+def trace_dispatcher(dispatcher, tracer: UpdateTracer = TRACER) -> None:
+    """Trace every update fed to ``dispatcher``."""
+    dispatcher.update.outer_middleware(tracer)
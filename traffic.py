@@ -0,0 +1,59 @@
+"""Background polling of per-key transfer from the Outline servers."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable
+
+from db import store_traffic
+from servers import OutlineServers
+
+# Seconds between transfer polls of every server
+TRAFFIC_POLL_INTERVAL = int(os.getenv("TRAFFIC_POLL_INTERVAL", "600"))
+
+BYTE_UNITS = ("Б", "КБ", "МБ", "ГБ", "ТБ")
+
+
+def format_bytes(count: int) -> str:
+    """Return ``count`` bytes in the largest fitting unit, e.g. ``1.5 ГБ``."""
+    value = float(count)
+    for unit in BYTE_UNITS[:-1]:
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == BYTE_UNITS[0] else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} {BYTE_UNITS[-1]}"
+
+
+def _key_id(key_id: str):
+    return int(key_id) if key_id.isdigit() else key_id
+
+
+async def poll_traffic(servers: OutlineServers) -> int:
+    """Store the transfer of every key with one metrics request per server."""
+    now = int(time.time())
+    stored = 0
+    for server in servers.urls:
+        try:
+            metrics = await servers.client(server).transfer_metrics()
+        except Exception as exc:
+            logging.error("Failed to poll transfer of %s: %s", server, exc)
+            continue
+        await store_traffic(
+            server, {_key_id(key_id): used for key_id, used in metrics.items()}, now
+        )
+        stored += len(metrics)
+    return stored
+
+
+async def traffic_loop(
+    servers: Callable[[], OutlineServers], interval: int = TRAFFIC_POLL_INTERVAL
+) -> None:
+    """Poll key transfer every ``interval`` seconds."""
+    while True:
+        try:
+            count = await poll_traffic(servers())
+            logging.info("Stored transfer of %s keys", count)
+        except Exception as exc:
+            logging.error("Failed to poll transfer: %s", exc)
+        await asyncio.sleep(interval)
@@ -0,0 +1,154 @@
+"""Serving Telegram updates from a webhook instead of long polling."""
+
+import asyncio
+import logging
+import os
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+# Public HTTPS URL Telegram posts updates to, e.g. https://bot.example.com/webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+
+# Path of the update endpoint on this server
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+
+# Token Telegram sends back in every request, checked when set
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Address the HTTP server listens on
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+
+# Maximum number of updates handled at the same time
+WEBHOOK_MAX_HANDLERS = int(os.getenv("WEBHOOK_MAX_HANDLERS", "100"))
+
+# Seconds to wait for handlers in flight when shutting down
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp app feeding webhook updates to the dispatcher.
+
+    Updates are acknowledged as soon as their handler starts. Once
+    ``max_handlers`` handlers are running, new requests wait for a free slot,
+    which makes Telegram slow down instead of piling up tasks. ``/healthz``
+    answers while the process is alive and ``/readyz`` only while updates are
+    accepted, so a load balancer stops routing here during the drain.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        max_handlers: int = WEBHOOK_MAX_HANDLERS,
+        drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT,
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.max_handlers = max_handlers
+        self.drain_timeout = drain_timeout
+        self.ready = False
+        self.handled = 0
+        self._slots = asyncio.Semaphore(max_handlers)
+        self._tasks: set[asyncio.Task] = set()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self._update)
+        app.router.add_get("/healthz", self._health)
+        app.router.add_get("/readyz", self._readiness)
+        return app
+
+    async def _update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        if not self.ready:
+            # Telegram delivers the update again later
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as exc:
+            logging.error("Failed to parse update: %s", exc)
+            return web.Response(status=400)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _handle(self, update: Update) -> None:
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception as exc:
+            logging.error("Failed to handle update %s: %s", update.update_id, exc)
+        finally:
+            self.handled += 1
+            self._slots.release()
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def _readiness(self, request: web.Request) -> web.Response:
+        if not self.ready:
+            return web.Response(status=503, text="draining")
+        return web.Response(text="ready")
+
+    async def drain(self) -> int:
+        """Stop accepting updates and wait for the handlers in flight.
+
+        Returns the number of handlers cancelled after the timeout.
+        """
+        self.ready = False
+        if not self._tasks:
+            return 0
+        logging.info("Waiting for %s update handlers", len(self._tasks))
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+    async def serve(
+        self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, url: str = WEBHOOK_URL
+    ) -> None:
+        """Serve updates until SIGINT or SIGTERM, then drain and stop."""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            if url:
+                await self.bot.set_webhook(
+                    url,
+                    secret_token=self.secret or None,
+                    max_connections=min(self.max_handlers, 100),
+                    allowed_updates=self.dispatcher.resolve_used_update_types(),
+                )
+            self.ready = True
+            logging.info("Serving webhook on %s:%s%s", host, port, self.path)
+            await stop.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            cancelled = await self.drain()
+            if cancelled:
+                logging.error("Cancelled %s update handlers on shutdown", cancelled)
+            await runner.cleanup()
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "in_flight": len(self._tasks),
+            "handled": self.handled,
+        }